@@ -14,6 +14,8 @@
 #    under the License.
 #
 import abc
+import collections
+import datetime
 import fractions
 
 from oslo_config import cfg
@@ -32,6 +34,7 @@ from voluptuous import Required
 from voluptuous import Schema
 
 from cloudkitty import utils as ck_utils
+from cloudkitty.utils import tz as tzutils
 
 
 LOG = logging.getLogger(__name__)
@@ -247,6 +250,100 @@ class BaseCollector(object):
 
         return name, data
 
+    def iter_periods(self, start, end):
+        """Yields (begin, end) tuples for each period between start and end.
+
+        :param start: start of the first period
+        :type start: datetime.datetime
+        :param end: end of the last period
+        :type end: datetime.datetime
+        """
+        delta = datetime.timedelta(seconds=self.period)
+        period_start = start
+        while period_start < end:
+            period_end = tzutils.add_delta(period_start, delta)
+            yield period_start, period_end
+            period_start = period_end
+
+    def fetch_all_periods(self, metric_name, start, end,
+                          project_id=None, q_filter=None):
+        """Fetches information about a metric for several periods at once.
+
+        Returns an OrderedDict mapping the beginning of each collect period
+        between ``start`` and ``end`` to a list of
+        cloudkitty.dataframe.DataPoint objects.
+
+        The default implementation calls ``fetch_all`` once per period.
+        Collectors able to retrieve several periods with a single query
+        should override this method.
+
+        :param metric_name: Name of the metric to fetch
+        :type metric_name: str
+        :param start: start of the first period
+        :type start: datetime.datetime
+        :param end: end of the last period
+        :type end: datetime.datetime
+        :param project_id: ID of the scope for which data should be collected
+        :type project_id: str
+        :param q_filter: Optional filters
+        :type q_filter: dict
+        """
+        output = collections.OrderedDict()
+        for period_start, period_end in self.iter_periods(start, end):
+            output[period_start] = self.fetch_all(
+                metric_name,
+                period_start,
+                period_end,
+                project_id,
+                q_filter=q_filter,
+            )
+        return output
+
+    def fetch_all_scopes(self, metric_name, start, end, scope_ids,
+                         q_filter=None):
+        """Fetches information about a metric for several scopes at once.
+
+        Returns a dict mapping each scope ID to a list of
+        cloudkitty.dataframe.DataPoint objects.
+
+        The default implementation calls ``fetch_all`` once per scope.
+        Collectors able to retrieve the data of several scopes with a single
+        query should override this method.
+
+        :param metric_name: Name of the metric to fetch
+        :type metric_name: str
+        :param start: start of the period
+        :type start: datetime.datetime
+        :param end: end of the period
+        :type end: datetime.datetime
+        :param scope_ids: IDs of the scopes for which data should be collected
+        :type scope_ids: list
+        :param q_filter: Optional filters
+        :type q_filter: dict
+        """
+        return {
+            scope_id: self.fetch_all(
+                metric_name, start, end, scope_id, q_filter=q_filter)
+            for scope_id in scope_ids
+        }
+
+    def retrieve_periods(self, metric_name, start, end,
+                         project_id=None, q_filter=None):
+
+        data = self.fetch_all_periods(
+            metric_name,
+            start,
+            end,
+            project_id,
+            q_filter=q_filter,
+        )
+
+        name = self.conf[metric_name].get('alt_name', metric_name)
+        if not any(data.values()):
+            raise NoDataCollected(self.collector_name, name)
+
+        return name, data
+
 
 class InvalidConfiguration(Exception):
     pass
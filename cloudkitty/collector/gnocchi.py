@@ -13,13 +13,16 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 #
+import collections
 from datetime import timedelta
+import threading
 import six
 
 from gnocchiclient import auth as gauth
 from gnocchiclient import client as gclient
 from gnocchiclient import exceptions as gexceptions
 from keystoneauth1 import loading as ks_loading
+from oslo_concurrency import lockutils
 from oslo_config import cfg
 from oslo_log import log as logging
 from voluptuous import All
@@ -67,6 +70,22 @@ collector_gnocchi_opts = [
         default='RegionOne',
         help='Region Name',
     ),
+    cfg.IntOpt(
+        'resource_cache_ttl',
+        default=0,
+        min=0,
+        help='Time in seconds after which the resources cached for a '
+        'resource type and a scope are fully reloaded. Cached resources are '
+        'refreshed incrementally in-between. 0 disables the resource cache.',
+    ),
+    cfg.IntOpt(
+        'resource_cache_size',
+        default=1024,
+        min=1,
+        help='Maximal number of (resource type, scope) pairs for which '
+        'resources are cached. The least recently used pairs are evicted '
+        'first.',
+    ),
 ]
 
 ks_loading.register_session_conf_options(cfg.CONF, COLLECTOR_GNOCCHI_OPTS)
@@ -121,6 +140,110 @@ class AssociatedResourceNotFound(Exception):
         )
 
 
+class ResourceCache(object):
+    """LRU cache of gnocchi resources, by resource type and scope.
+
+    Each entry holds the resources of a resource type and scope which were
+    alive at some point after the beginning of the first timeframe they were
+    loaded for. Entries are refreshed incrementally by loading the resources
+    which have been updated since the last refresh, and fully reloaded once
+    their TTL has expired. Entries are loaded under a lock of their own, so
+    that different resource types and scopes can be loaded concurrently.
+
+    :param search: Callable taking a resource type and a query, and returning
+                   the list of all matching resources.
+    :param ttl: Time in seconds after which an entry is fully reloaded
+    :type ttl: int
+    :param size: Maximal number of entries
+    :type size: int
+    """
+
+    def __init__(self, search, ttl, size):
+        self._search = search
+        self._ttl = ttl
+        self._size = size
+        self._entries = collections.OrderedDict()
+        # Protects _entries, entries are loaded under a lock per key
+        self._lock = threading.Lock()
+        self._key_locks = lockutils.Semaphores()
+
+    @staticmethod
+    def _is_alive(resource, start, end):
+        ended_at = resource.get('ended_at')
+        if ended_at and tzutils.dt_from_iso(ended_at) < start:
+            return False
+        return tzutils.dt_from_iso(resource['started_at']) <= end
+
+    def _load(self, resource_type, query_parameters):
+        resources = self._search(
+            resource_type, GnocchiCollector.extend_filter(*query_parameters))
+        return {resource['id']: resource for resource in resources}
+
+    def get(self, resource_type, scope_filter, scope_id, start, end):
+        """Returns the resources which were alive between start and end.
+
+        :param resource_type: Gnocchi resource type
+        :type resource_type: str
+        :param scope_filter: Filter restricting resources to the scope, or
+                             an empty dict.
+        :type scope_filter: dict
+        :param scope_id: ID of the scope, used as part of the cache key
+        :type scope_id: str
+        :param start: Start of the timeframe
+        :type start: datetime.datetime
+        :param end: End of the timeframe
+        :type end: datetime.datetime
+        :rtype: list
+        """
+        key = (resource_type, scope_id)
+        with self._key_locks.get('{}|{}'.format(resource_type, scope_id)):
+            now = tzutils.localized_now()
+            with self._lock:
+                entry = self._entries.pop(key, None)
+            if entry is not None and (
+                    entry['start'] > start
+                    or tzutils.diff_seconds(now, entry['loaded_at'])
+                    >= self._ttl):
+                entry = None
+
+            if entry is None:
+                # Resources still alive at the beginning of the timeframe,
+                # including the ones which have been created since then
+                query_parameters = [GnocchiCollector.extend_filter(
+                    GnocchiCollector.gen_filter(ended_at=None),
+                    GnocchiCollector.gen_filter(
+                        cop='>=', ended_at=start.isoformat()),
+                    lop='or')]
+                query_parameters.append(scope_filter)
+                entry = {
+                    'start': start,
+                    'loaded_at': now,
+                    'refreshed_at': now,
+                    'resources': self._load(resource_type, query_parameters),
+                }
+            elif entry['refreshed_at'] < end:
+                # Resources created or updated since the last refresh. Once
+                # the cache has been refreshed after the end of a timeframe,
+                # all resources alive during it are known.
+                query_parameters = [
+                    GnocchiCollector.gen_filter(
+                        cop='>=',
+                        revision_start=entry['refreshed_at'].isoformat()),
+                    scope_filter,
+                ]
+                entry['resources'].update(
+                    self._load(resource_type, query_parameters))
+                entry['refreshed_at'] = now
+
+            with self._lock:
+                self._entries[key] = entry
+                while len(self._entries) > self._size:
+                    self._entries.popitem(last=False)
+
+            return [resource for resource in entry['resources'].values()
+                    if self._is_alive(resource, start, end)]
+
+
 class GnocchiCollector(collector.BaseCollector):
 
     collector_name = 'gnocchi'
@@ -154,6 +277,14 @@ class GnocchiCollector(collector.BaseCollector):
             adapter_options=adapter_options,
         )
 
+        self._resource_cache = None
+        if CONF.collector_gnocchi.resource_cache_ttl > 0:
+            self._resource_cache = ResourceCache(
+                self._search_resources,
+                CONF.collector_gnocchi.resource_cache_ttl,
+                CONF.collector_gnocchi.resource_cache_size,
+            )
+
     @staticmethod
     def check_configuration(conf):
         """Check metrics configuration
@@ -235,7 +366,7 @@ class GnocchiCollector(collector.BaseCollector):
         return time_filter
 
     def _fetch_resources(self, metric_name, start, end,
-                         project_id=None, q_filter=None):
+                         project_id=None, q_filter=None, scope_ids=None):
         """Get resources during the timeframe.
 
         :type metric_name: str
@@ -245,6 +376,8 @@ class GnocchiCollector(collector.BaseCollector):
         :type project_id: str
         :param q_filter: Append a custom filter.
         :type q_filter: list
+        :param scope_ids: Filter on several scopes, instead of project_id.
+        :type scope_ids: list
         """
 
         # Get gnocchi specific conf
@@ -260,28 +393,54 @@ class GnocchiCollector(collector.BaseCollector):
         delta = timedelta(seconds=CONF.collect.period)
         start = tzutils.substract_delta(start, delta)
         end = tzutils.add_delta(end, delta)
-        query_parameters = self._generate_time_filter(start, end)
 
-        if project_id:
+        scope_filter = {}
+        if scope_ids is not None:
+            scope_filter = {'in': {scope_key: list(scope_ids)}}
+        elif project_id:
             kwargs = {scope_key: project_id}
-            query_parameters.append(self.gen_filter(**kwargs))
-        if q_filter:
-            query_parameters.append(q_filter)
+            scope_filter = self.gen_filter(**kwargs)
+
+        # Resources are shared by all the metrics of a resource type. Custom
+        # filters can't be cached.
+        if self._resource_cache is not None and not q_filter:
+            if scope_ids is None:
+                resources = self._resource_cache.get(
+                    resource_type, scope_filter, project_id, start, end)
+            else:
+                # The resources of a batch of scopes are read from the
+                # entries of each scope
+                resources = []
+                for scope_id in scope_ids:
+                    kwargs = {scope_key: scope_id}
+                    resources += self._resource_cache.get(
+                        resource_type, self.gen_filter(**kwargs), scope_id,
+                        start, end)
+        else:
+            query_parameters = self._generate_time_filter(start, end)
+            if scope_filter:
+                query_parameters.append(scope_filter)
+            if q_filter:
+                query_parameters.append(q_filter)
+            resources = self._search_resources(
+                resource_type, self.extend_filter(*query_parameters))
+        return {res[extra_args['resource_key']]: res for res in resources}
 
-        sorts = [extra_args['resource_key'] + ':asc']
+    def _search_resources(self, resource_type, query):
+        """Returns all the resources of a type matching the given query."""
         resources = []
         marker = None
         while True:
             resources_chunk = self._conn.resource.search(
                 resource_type=resource_type,
-                query=self.extend_filter(*query_parameters),
-                sorts=sorts,
+                query=query,
+                sorts=['id:asc'],
                 marker=marker)
             if len(resources_chunk) < 1:
                 break
             resources += resources_chunk
-            marker = resources_chunk[-1][extra_args['resource_key']]
-        return {res[extra_args['resource_key']]: res for res in resources}
+            marker = resources_chunk[-1]['id']
+        return resources
 
     def _fetch_metric(self, metric_name, start, end,
                       project_id=None, q_filter=None):
@@ -365,10 +524,11 @@ class GnocchiCollector(collector.BaseCollector):
               ["metric", metric_name, extra_args['aggregation_method']]]
         return op
 
-    def _format_data(self, metconf, data, resources_info=None):
+    def _format_data(self, metconf, data, resources_info=None, measure=None):
         """Formats gnocchi data to CK data.
 
-        Returns metadata, groupby and qty
+        Returns metadata, groupby and qty. If no measure is provided, the
+        first aggregated measure of ``data`` is used.
 
         """
         groupby = data['group']
@@ -384,7 +544,9 @@ class GnocchiCollector(collector.BaseCollector):
                 raise AssociatedResourceNotFound(resource_key, resource_id)
             for i in metconf['metadata']:
                 metadata[i] = resource.get(i, '')
-        qty = data['measures']['measures']['aggregated'][0][2]
+        if measure is None:
+            measure = data['measures']['measures']['aggregated'][0]
+        qty = measure[2]
         converted_qty = ck_utils.convert_unit(
             qty, metconf['factor'], metconf['offset'])
         mutated_qty = ck_utils.mutate(converted_qty, metconf['mutate'])
@@ -392,15 +554,25 @@ class GnocchiCollector(collector.BaseCollector):
 
     def fetch_all(self, metric_name, start, end,
                   project_id=None, q_filter=None):
+        return self._fetch_all(metric_name, start, end,
+                               project_id=project_id, q_filter=q_filter)
+
+    def _fetch_all(self, metric_name, start, end,
+                   project_id=None, q_filter=None, scope_ids=None):
 
         met = self.conf[metric_name]
 
+        metric_filter = q_filter
+        if scope_ids is not None:
+            metric_filter = self.extend_filter(
+                {'in': {CONF.collect.scope_key: list(scope_ids)}},
+                q_filter or {})
         data = self._fetch_metric(
             metric_name,
             start,
             end,
             project_id=project_id,
-            q_filter=q_filter,
+            q_filter=metric_filter,
         )
 
         resources_info = None
@@ -410,7 +582,8 @@ class GnocchiCollector(collector.BaseCollector):
                 start,
                 end,
                 project_id=project_id,
-                q_filter=q_filter
+                q_filter=q_filter,
+                scope_ids=scope_ids,
             )
         formated_resources = list()
         for d in data:
@@ -434,3 +607,86 @@ class GnocchiCollector(collector.BaseCollector):
                     metadata,
                 ))
         return formated_resources
+
+    def fetch_all_scopes(self, metric_name, start, end, scope_ids,
+                         q_filter=None):
+        scope_key = CONF.collect.scope_key
+        # The scope key is always part of the groupby, so the data of all
+        # scopes can be retrieved with a single query and split afterwards.
+        output = {scope_id: [] for scope_id in scope_ids}
+        for point in self._fetch_all(
+                metric_name, start, end, q_filter=q_filter,
+                scope_ids=scope_ids):
+            scope_id = point.groupby.get(scope_key)
+            if scope_id in output:
+                output[scope_id].append(point)
+        return output
+
+    def _split_measures(self, measures, periods):
+        """Splits aggregated measures between collect periods.
+
+        Returns a dict mapping the beginning of each period to the first
+        measure whose timestamp belongs to it, which is the measure that
+        would have been used if the period had been collected on its own.
+        """
+        output = {}
+        if not periods:
+            return output
+        start = periods[0][0]
+        for measure in measures:
+            timestamp = tzutils.dt_from_iso(measure[0])
+            if timestamp < start:
+                continue
+            idx = tzutils.diff_seconds(timestamp, start) // self.period
+            if idx < len(periods):
+                output.setdefault(periods[idx][0], measure)
+        return output
+
+    def fetch_all_periods(self, metric_name, start, end,
+                          project_id=None, q_filter=None):
+
+        met = self.conf[metric_name]
+        periods = list(self.iter_periods(start, end))
+
+        data = self._fetch_metric(
+            metric_name,
+            start,
+            end,
+            project_id=project_id,
+            q_filter=q_filter,
+        )
+
+        resources_info = None
+        if met['metadata']:
+            resources_info = self._fetch_resources(
+                metric_name,
+                start,
+                end,
+                project_id=project_id,
+                q_filter=q_filter
+            )
+
+        output = collections.OrderedDict(
+            (period_start, []) for period_start, _ in periods)
+        for d in data:
+            period_measures = self._split_measures(
+                d['measures']['measures']['aggregated'], periods)
+            for period_start, measure in period_measures.items():
+                try:
+                    metadata, groupby, qty = self._format_data(
+                        met, d, resources_info, measure=measure)
+                except AssociatedResourceNotFound as e:
+                    LOG.warning(
+                        '[{}] An error occured during data collection '
+                        'between {} and {}: {}'.format(
+                            project_id, start, end, e),
+                    )
+                    break
+                output[period_start].append(dataframe.DataPoint(
+                    met['unit'],
+                    qty,
+                    0,
+                    groupby,
+                    metadata,
+                ))
+        return output
@@ -12,6 +12,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 #
+import collections
 from decimal import Decimal
 from decimal import localcontext
 from decimal import ROUND_HALF_UP
@@ -123,10 +124,12 @@ class PrometheusCollector(collector.BaseCollector):
 
         return output
 
-    def _format_data(self, metric_name, scope_key, scope_id, start, end, data):
+    def _format_data(self, metric_name, scope_key, scope_id, start, end, data,
+                     value=None):
         """Formats Prometheus data format to Cloudkitty data format.
 
-        Returns metadata, groupby, qty
+        Returns metadata, groupby, qty. If no value is provided, the value of
+        the instant vector ``data`` is used.
         """
         metadata = {}
         for meta in self.conf[metric_name]['metadata']:
@@ -136,20 +139,23 @@ class PrometheusCollector(collector.BaseCollector):
         for meta in self.conf[metric_name]['groupby']:
             groupby[meta] = data['metric'].get(meta, '')
 
+        if value is None:
+            value = data['value']
+
         with localcontext() as ctx:
             ctx.prec = 9
             ctx.rounding = ROUND_HALF_UP
 
             qty = ck_utils.convert_unit(
-                +Decimal(data['value'][1]),
+                +Decimal(value[1]),
                 self.conf[metric_name]['factor'],
                 self.conf[metric_name]['offset'],
             )
 
         return metadata, groupby, qty
 
-    def fetch_all(self, metric_name, start, end, scope_id, q_filter=None):
-        """Returns metrics to be valorized."""
+    def _build_query(self, metric_name, scope_id, period):
+        """Builds the query aggregating a metric over a period."""
         scope_key = CONF.collect.scope_key
         method = self.conf[metric_name]['extra_args']['aggregation_method']
         query_function = self.conf[metric_name]['extra_args'].get(
@@ -158,8 +164,6 @@ class PrometheusCollector(collector.BaseCollector):
             'range_function')
         groupby = self.conf[metric_name].get('groupby', [])
         metadata = self.conf[metric_name].get('metadata', [])
-        period = tzutils.diff_seconds(end, start)
-        time = end
 
         # The metric with the period
         query = '{0}{{{1}="{2}"}}[{3}s]'.format(
@@ -196,6 +200,32 @@ class PrometheusCollector(collector.BaseCollector):
             query,
             ', '.join(groupby + metadata)
         )
+        return query
+
+    def _to_datapoint(self, metric_name, scope_id, start, end, item,
+                      value=None):
+        metadata, groupby, qty = self._format_data(
+            metric_name,
+            CONF.collect.scope_key,
+            scope_id,
+            start,
+            end,
+            item,
+            value=value,
+        )
+        return dataframe.DataPoint(
+            self.conf[metric_name]['unit'],
+            qty,
+            0,
+            groupby,
+            metadata,
+        )
+
+    def fetch_all(self, metric_name, start, end, scope_id, q_filter=None):
+        """Returns metrics to be valorized."""
+        period = tzutils.diff_seconds(end, start)
+        time = end
+        query = self._build_query(metric_name, scope_id, period)
 
         try:
             res = self._conn.get_instant(
@@ -210,24 +240,45 @@ class PrometheusCollector(collector.BaseCollector):
         if not res['data']['result']:
             return []
 
-        formatted_resources = []
+        return [
+            self._to_datapoint(metric_name, scope_id, start, end, item)
+            for item in res['data']['result']
+        ]
 
-        for item in res['data']['result']:
-            metadata, groupby, qty = self._format_data(
-                metric_name,
-                scope_key,
-                scope_id,
-                start,
-                end,
-                item,
-            )
+    def fetch_all_periods(self, metric_name, start, end,
+                          scope_id, q_filter=None):
+        """Returns metrics to be valorized for several periods at once.
 
-            formatted_resources.append(dataframe.DataPoint(
-                self.conf[metric_name]['unit'],
-                qty,
-                0,
-                groupby,
-                metadata,
-            ))
+        A single range query is issued, with one step per collect period.
+        The sample of each step is the value of the instant query which
+        would have been issued at the end of the corresponding period.
+        """
+        periods = list(self.iter_periods(start, end))
+        output = collections.OrderedDict(
+            (period_start, []) for period_start, _ in periods)
+        if not periods:
+            return output
+        periods_by_end = {
+            period_end: period_start for period_start, period_end in periods}
 
-        return formatted_resources
+        query = self._build_query(metric_name, scope_id, self.period)
+        try:
+            res = self._conn.get_range(
+                query,
+                periods[0][1].isoformat(),
+                periods[-1][1].isoformat(),
+                '{}s'.format(self.period),
+            )
+        except PrometheusResponseError as e:
+            raise CollectError(*e.args)
+
+        for item in res['data']['result']:
+            for value in item.get('values', []):
+                period_end = tzutils.dt_from_ts(float(value[0]))
+                period_start = periods_by_end.get(period_end)
+                if period_start is None:
+                    continue
+                output[period_start].append(self._to_datapoint(
+                    metric_name, scope_id, period_start, period_end,
+                    item, value=value))
+        return output
@@ -27,6 +27,8 @@ import cloudkitty.fetcher.keystone
 import cloudkitty.fetcher.prometheus
 import cloudkitty.fetcher.source
 import cloudkitty.orchestrator
+import cloudkitty.rating.instrumentation
+import cloudkitty.rating.pyscripts
 import cloudkitty.service
 import cloudkitty.storage
 import cloudkitty.storage.v1.hybrid.backends.gnocchi
@@ -62,6 +64,10 @@ _opts = [
         cloudkitty.orchestrator.orchestrator_opts))),
     ('output', list(itertools.chain(
         cloudkitty.config.output_opts))),
+    ('pyscripts', list(itertools.chain(
+        cloudkitty.rating.pyscripts.pyscripts_opts))),
+    ('rating_metrics', list(itertools.chain(
+        cloudkitty.rating.instrumentation.rating_metrics_opts))),
     ('state', list(itertools.chain(
         cloudkitty.config.state_opts))),
     ('storage', list(itertools.chain(
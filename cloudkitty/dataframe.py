@@ -13,9 +13,9 @@
 #    under the License.
 #
 import collections
+import collections.abc
 import datetime
 import decimal
-import functools
 
 import voluptuous
 from werkzeug import datastructures
@@ -46,6 +46,75 @@ _DataPointBase = collections.namedtuple(
     "DataPoint",
     field_names=("unit", "qty", "price", "groupby", "metadata"))
 
+_DATAPOINT_KEYS = frozenset(('vol', 'rating', 'groupby', 'metadata'))
+_LEGACY_DATAPOINT_KEYS = frozenset(('vol', 'rating', 'desc'))
+_VOL_KEYS = frozenset(('unit', 'qty'))
+_RATING_KEYS = frozenset(('price', ))
+
+
+def _coerce_decimal(value):
+    """Same as Coerce(str) followed by a conversion to Decimal."""
+    if isinstance(value, decimal.Decimal):
+        return value
+    return decimal.Decimal(str(value))
+
+
+def _to_str_dict(mapping):
+    """Returns an ImmutableDict with keys and values converted to str."""
+    return datastructures.ImmutableDict({
+        (k if k.__class__ is str else str(k)):
+        (v if v.__class__ is str else str(v))
+        for k, v in mapping.items()})
+
+
+def _coerce_str_dict(item):
+    """Same as DictTypeValidator(str, str), returns an ImmutableDict."""
+    try:
+        return _to_str_dict(dict(item))
+    except (TypeError, ValueError):
+        raise ValueError("{} can't be converted to dict".format(item))
+
+
+def _check_keys(dict_, allowed, path):
+    if not isinstance(dict_, dict):
+        raise ValueError("expected a dictionary for {}".format(path))
+    extra = set(dict_) - allowed
+    if extra:
+        raise ValueError("extra keys not allowed in {}: {}".format(
+            path, ', '.join(sorted(map(str, extra)))))
+
+
+def _validate_datapoint(dict_, legacy=False):
+    """Validates a dict against DATAPOINT_SCHEMA without voluptuous.
+
+    Returns the arguments of the DataPoint to build, with converted values.
+    The dict is not modified.
+
+    :raises ValueError: The dict is not valid
+    """
+    _check_keys(dict_,
+                _LEGACY_DATAPOINT_KEYS if legacy else _DATAPOINT_KEYS,
+                'datapoint')
+    vol = dict_['vol']
+    _check_keys(vol, _VOL_KEYS, 'vol')
+    unit = vol['unit']
+    if not isinstance(unit, str):
+        raise ValueError("expected str for vol.unit")
+    rating = dict_.get('rating', {})
+    _check_keys(rating, _RATING_KEYS, 'rating')
+    try:
+        qty = _coerce_decimal(vol['qty'])
+        price = _coerce_decimal(rating.get('price', 0))
+    except decimal.InvalidOperation as e:
+        raise ValueError("invalid number: {}".format(e))
+    if legacy:
+        return (unit, qty, price,
+                _coerce_str_dict(dict_['desc']),
+                datastructures.ImmutableDict())
+    return (unit, qty, price,
+            _coerce_str_dict(dict_['groupby']),
+            _coerce_str_dict(dict_['metadata']))
+
 
 class DataPoint(_DataPointBase):
 
@@ -60,6 +129,15 @@ class DataPoint(_DataPointBase):
             datastructures.ImmutableDict(metadata),
         )
 
+    @classmethod
+    def _from_valid(cls, unit, qty, price, groupby, metadata):
+        """Builds a DataPoint from already converted values.
+
+        qty and price must be Decimals, groupby and metadata ImmutableDicts.
+        """
+        return _DataPointBase.__new__(
+            cls, unit or "undefined", qty, price, groupby, metadata)
+
     def set_price(self, price):
         """Sets the price of the DataPoint and returns a new object."""
         return self._replace(price=price)
@@ -136,20 +214,61 @@ class DataPoint(_DataPointBase):
                        before validating it.
         :rtype: DataPoint
         """
-        try:
-            if legacy:
-                dict_['groupby'] = dict_.pop('desc')
-                dict_['metadata'] = {}
-            valid = DATAPOINT_SCHEMA(dict_)
-            return cls(
-                unit=valid["vol"]["unit"],
-                qty=valid["vol"]["qty"],
-                price=valid["rating"]["price"],
-                groupby=valid["groupby"],
-                metadata=valid["metadata"],
-            )
-        except (voluptuous.Invalid, KeyError) as e:
-            raise ValueError("{} isn't a valid DataPoint: {}".format(dict_, e))
+        return cls.from_dicts([dict_], legacy=legacy)[0]
+
+    @classmethod
+    def from_dicts(cls, dicts, legacy=False):
+        """Returns a list of DataPoints built from a list of dicts.
+
+        Each dict is validated against ``DATAPOINT_SCHEMA``. The checks are
+        done in plain python rather than through voluptuous, which is a lot
+        faster for large batches.
+
+        :param dicts: Dicts to build the DataPoints from
+        :type dicts: iterable of dict
+        :param legacy: Set to true if the dicts are in the legacy format.
+        :type legacy: bool
+        :rtype: list of DataPoint
+        :raises ValueError: One of the dicts isn't a valid DataPoint
+        """
+        output = []
+        for dict_ in dicts:
+            try:
+                output.append(cls._from_valid(
+                    *_validate_datapoint(dict_, legacy=legacy)))
+            except (ValueError, KeyError, TypeError) as e:
+                raise ValueError(
+                    "{} isn't a valid DataPoint: {}".format(dict_, e))
+        return output
+
+    @classmethod
+    def from_trusted_dict(cls, dict_, legacy=False):
+        """Returns a new DataPoint instance built from a trusted dict.
+
+        The dict is not validated, values are only converted. This must only
+        be used with data generated by cloudkitty itself, for example when
+        reading from a storage backend.
+
+        :param dict_: Dict to build the DataPoint from
+        :type dict_: dict
+        :param legacy: Set to true if the dict is in the legacy format.
+        :type legacy: bool
+        :rtype: DataPoint
+        """
+        vol = dict_['vol']
+        if legacy:
+            groupby = dict_['desc']
+            metadata = {}
+        else:
+            groupby = dict_['groupby']
+            metadata = dict_['metadata']
+        return cls._from_valid(
+            vol['unit'],
+            _coerce_decimal(vol['qty']),
+            _coerce_decimal(dict_.get('rating', {}).get('price', 0)),
+            _to_str_dict(groupby),
+            _to_str_dict(metadata),
+        )
 
     @property
     def desc(self):
@@ -158,6 +277,30 @@ class DataPoint(_DataPointBase):
         return datastructures.ImmutableDict(output)
 
 
+class _UsageValidator(object):
+    """Voluptuous validator building all the points of a usage dict.
+
+    The points of each type are built in bulk with ``DataPoint.from_dicts``.
+    """
+
+    def __init__(self, legacy=False):
+        self._legacy = legacy
+
+    def __call__(self, item):
+        try:
+            output = {}
+            for key, points in dict(item).items():
+                if not isinstance(points, collections.abc.Iterable):
+                    raise voluptuous.Invalid(
+                        "{} is not iterable".format(points))
+                output[str(key)] = DataPoint.from_dicts(
+                    points, legacy=self._legacy)
+            return output
+        except (TypeError, ValueError) as e:
+            raise voluptuous.Invalid(
+                "{} can't be converted to a dict: {}".format(item, e))
+
+
 DATAFRAME_SCHEMA = voluptuous.Schema({
     voluptuous.Required('period'): {
         voluptuous.Required('begin'): voluptuous.Any(
@@ -165,8 +308,11 @@ DATAFRAME_SCHEMA = voluptuous.Schema({
         voluptuous.Required('end'): voluptuous.Any(
             datetime.datetime, voluptuous.Coerce(tzutils.dt_from_iso)),
     },
-    voluptuous.Required('usage'): vutils.IterableValuesDict(
-        str, DataPoint.from_dict),
+    voluptuous.Required('usage'): _UsageValidator(),
+})
+
+LEGACY_DATAFRAME_SCHEMA = DATAFRAME_SCHEMA.extend({
+    voluptuous.Required('usage'): _UsageValidator(legacy=True),
 })
 
 
@@ -207,23 +353,22 @@ class DataFrame(object):
         return json.dumps(self.as_dict(legacy=legacy, mutable=True))
 
     @classmethod
-    def from_dict(cls, dict_, legacy=False):
+    def from_dict(cls, dict_, legacy=False, trusted=False):
+        """Returns a new DataFrame instance built from a dict.
+
+        :param dict_: Dict to build the DataFrame from
+        :type dict_: dict
+        :param legacy: Set to true if the points are in the legacy format.
+        :type legacy: bool
+        :param trusted: Set to true to skip validation. This must only be
+                        used with data generated by cloudkitty itself.
+        :type trusted: bool
+        :rtype: DataFrame
+        """
+        if trusted:
+            return cls._from_trusted_dict(dict_, legacy=legacy)
         try:
-            schema = DATAFRAME_SCHEMA
-            if legacy:
-                validator = functools.partial(DataPoint.from_dict, legacy=True)
-                # NOTE(peschk_l): __name__ is required for voluptuous exception
-                # message formatting
-                validator.__name__ = 'DataPoint.from_dict'
-                # NOTE(peschk_l): In case the legacy format is required, we
-                # create a new schema where DataPoint.from_dict is called with
-                # legacy=True. The "extend" method does create a new objects,
-                # and replaces existing keys with new ones.
-                schema = DATAFRAME_SCHEMA.extend({
-                    voluptuous.Required('usage'): vutils.IterableValuesDict(
-                        str, validator
-                    ),
-                })
+            schema = LEGACY_DATAFRAME_SCHEMA if legacy else DATAFRAME_SCHEMA
             valid = schema(dict_)
             return cls(
                 valid["period"]["begin"],
@@ -232,6 +377,20 @@ class DataFrame(object):
         except (voluptuous.error.Invalid, KeyError) as e:
             raise ValueError("{} isn't a valid DataFrame: {}".format(dict_, e))
 
+    @classmethod
+    def _from_trusted_dict(cls, dict_, legacy=False):
+        start = dict_['period']['begin']
+        end = dict_['period']['end']
+        if not isinstance(start, datetime.datetime):
+            start = tzutils.dt_from_iso(start)
+        if not isinstance(end, datetime.datetime):
+            end = tzutils.dt_from_iso(end)
+        return cls(start, end, usage={
+            type_: [DataPoint.from_trusted_dict(point, legacy=legacy)
+                    for point in points]
+            for type_, points in dict_['usage'].items()
+        })
+
     def add_points(self, points, type_):
         """Adds multiple points to the DataFrame
 
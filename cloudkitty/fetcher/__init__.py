@@ -14,18 +14,46 @@
 #    under the License.
 #
 import abc
-import six
+import json
+import os
+import tempfile
+import time
 
+from oslo_concurrency import lockutils
 from oslo_config import cfg
+from oslo_log import log
+import six
+
+from cloudkitty.utils import tz as tzutils
+
+
+LOG = log.getLogger(__name__)
 
 FETCHER_OPTS = 'fetcher'
 fetcher_opts = [
     cfg.StrOpt('backend',
                default='keystone',
                help='Driver used to fetch the list of scopes to rate.'),
+    cfg.IntOpt('cache_ttl',
+               default=0,
+               min=0,
+               help='Time in seconds during which the list of scopes is '
+               'cached and shared between all the processor workers of a '
+               'host. 0 disables the cache.'),
+    cfg.IntOpt('cache_full_refresh_interval',
+               default=86400,
+               min=0,
+               help='Time in seconds between two full scope discoveries. In '
+               'between, fetchers supporting it only look for scopes which '
+               'changed since the last refresh of the cache.'),
+    cfg.StrOpt('cache_path',
+               default='/var/lib/cloudkitty/scope_cache.json',
+               help='Path of the file in which scopes are cached.'),
 ]
 cfg.CONF.register_opts(fetcher_opts, 'fetcher')
 
+CONF = cfg.CONF
+
 
 @six.add_metaclass(abc.ABCMeta)
 class BaseFetcher(object):
@@ -34,6 +62,113 @@ class BaseFetcher(object):
     Provides Cloudkitty integration with a backend announcing ratable scopes.
     """
 
+    #: Set to True by fetchers implementing ``get_updated_tenants``
+    supports_incremental = False
+
     @abc.abstractmethod
     def get_tenants(self):
         """Retrieve a list of scopes to rate."""
+
+    def get_updated_tenants(self, since):
+        """Retrieve the scopes which have been updated since a given date.
+
+        Fetchers able to do so should implement this method and set
+        ``supports_incremental`` to True in order to allow incremental
+        refreshes of the scope cache.
+
+        :param since: Date of the previous scope discovery
+        :type since: datetime.datetime
+        """
+        raise NotImplementedError
+
+
+class CachedFetcher(BaseFetcher):
+    """Caches the scopes returned by a fetcher in a file.
+
+    The cache is shared between processes: the first process to find an
+    outdated cache refreshes it while holding an inter-process lock, the
+    other ones reuse its result.
+    """
+
+    def __init__(self, fetcher):
+        super(CachedFetcher, self).__init__()
+        self._fetcher = fetcher
+        self._path = CONF.fetcher.cache_path
+        self._ttl = CONF.fetcher.cache_ttl
+        self._full_refresh_interval = CONF.fetcher.cache_full_refresh_interval
+
+    @property
+    def name(self):
+        return self._fetcher.name
+
+    def _read(self):
+        try:
+            with open(self._path) as f:
+                cache = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        # A malformed cache is handled like an outdated one
+        if not self._is_valid(cache) or cache['fetcher'] != self.name:
+            return None
+        return cache
+
+    @staticmethod
+    def _is_valid(cache):
+        if not isinstance(cache, dict):
+            return False
+        return (isinstance(cache.get('fetcher'), six.string_types)
+                and isinstance(cache.get('scopes'), list)
+                and isinstance(cache.get('refreshed_at'), (int, float))
+                and isinstance(cache.get('full_refresh_at'), (int, float)))
+
+    def _write(self, cache):
+        dirname = os.path.dirname(self._path)
+        fd, tmp_path = tempfile.mkstemp(dir=dirname)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(cache, f)
+            os.rename(tmp_path, self._path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+    def _is_fresh(self, cache, now):
+        return cache is not None and now < cache['refreshed_at'] + self._ttl
+
+    def _refresh(self, cache, now):
+        if (self._fetcher.supports_incremental and cache is not None and
+                now < cache['full_refresh_at'] + self._full_refresh_interval):
+            since = tzutils.dt_from_ts(cache['refreshed_at'])
+            updated = self._fetcher.get_updated_tenants(since)
+            LOG.debug('Found {} updated scopes since {}'.format(
+                len(updated), since))
+            return {
+                'fetcher': self.name,
+                'scopes': sorted(set(cache['scopes']) | set(updated)),
+                'refreshed_at': now,
+                'full_refresh_at': cache['full_refresh_at'],
+            }
+
+        return {
+            'fetcher': self.name,
+            'scopes': sorted(set(self._fetcher.get_tenants())),
+            'refreshed_at': now,
+            'full_refresh_at': now,
+        }
+
+    def get_tenants(self):
+        cache = self._read()
+        if self._is_fresh(cache, time.time()):
+            return list(cache['scopes'])
+
+        lock = lockutils.lock('scope-cache', external=True,
+                              lock_path=os.path.dirname(self._path))
+        with lock:
+            # The cache may have been refreshed by another process while we
+            # were waiting for the lock
+            cache = self._read()
+            now = time.time()
+            if not self._is_fresh(cache, now):
+                cache = self._refresh(cache, now)
+                self._write(cache)
+        return list(cache['scopes'])
@@ -80,6 +80,8 @@ class GnocchiFetcher(fetcher.BaseFetcher):
 
     name = 'gnocchi'
 
+    supports_incremental = True
+
     def __init__(self):
         super(GnocchiFetcher, self).__init__()
 
@@ -125,6 +127,30 @@ class GnocchiFetcher(fetcher.BaseFetcher):
                 resources += resources_chunk
                 marker = resources_chunk[-1]['id']
 
+        return self._get_scope_ids(resources)
+
+    def get_updated_tenants(self, since):
+        resources = []
+        resource_types = CONF.fetcher_gnocchi.resource_types
+        query = {'>=': {'revision_start': since.isoformat()}}
+        for resource_type in resource_types:
+            marker = None
+            while True:
+                resources_chunk = self._conn.resource.search(
+                    resource_type=resource_type,
+                    query=query,
+                    sorts=['id:asc'],
+                    marker=marker,
+                    details=True)
+                if len(resources_chunk) < 1:
+                    break
+                resources += resources_chunk
+                marker = resources_chunk[-1]['id']
+
+        return self._get_scope_ids(resources)
+
+    @staticmethod
+    def _get_scope_ids(resources):
         scope_attribute = CONF.fetcher_gnocchi.scope_attribute
         scope_ids = [
             resource.get(scope_attribute, None) for resource in resources]
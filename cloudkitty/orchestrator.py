@@ -12,13 +12,17 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 #
+import collections
 from datetime import timedelta
 import decimal
 import functools
 import hashlib
+import heapq
 import multiprocessing
+import queue
 import random
 import sys
+import threading
 import time
 
 import cotyledon
@@ -30,13 +34,17 @@ from oslo_log import log as logging
 import oslo_messaging
 from oslo_utils import uuidutils
 from stevedore import driver
+from stevedore import extension
+import tooz
 from tooz import coordination
 
 from cloudkitty import collector
 from cloudkitty import config  # noqa
 from cloudkitty import dataframe
 from cloudkitty import extension_manager
+from cloudkitty import fetcher
 from cloudkitty import messaging
+from cloudkitty.rating import instrumentation
 from cloudkitty import storage
 from cloudkitty import storage_state as state
 from cloudkitty import utils as ck_utils
@@ -68,6 +76,71 @@ orchestrator_opts = [
                advanced=True,
                help='Maximal number of threads to use per worker. Defaults to '
                '5 times the nb of available CPUs'),
+    cfg.BoolOpt('scope_partitioning',
+                default=True,
+                help='Distribute scopes between processor workers with a '
+                'consistent hash ring, so that each worker only tries to '
+                'lock the scopes it owns. Requires a coordination backend '
+                'supporting groups, workers fall back to trying to lock all '
+                'scopes otherwise.'),
+    cfg.IntOpt('pipeline_depth',
+               default=1,
+               min=1,
+               advanced=True,
+               help='Maximal number of collected or rated periods which can '
+               'wait for the next stage of the pipeline of a worker.'),
+    cfg.IntOpt('catch_up_threshold',
+               default=1,
+               min=1,
+               help='Number of collect periods a scope must be late by '
+               'before the catch-up mode is used for it.'),
+    cfg.IntOpt('catch_up_periods',
+               default=1,
+               min=1,
+               help='Maximal number of collect periods to collect, rate and '
+               'store at once for a scope in catch-up mode. The default '
+               'value of 1 disables the catch-up mode.'),
+    cfg.IntOpt('state_commit_batch_size',
+               default=1,
+               min=1,
+               advanced=True,
+               help='Number of state updates of a scope to buffer before '
+               'committing them in a single transaction. Pending states are '
+               'always committed before the lock of a scope is released. '
+               'Higher values reduce database load when scopes are catching '
+               'up, at the cost of re-processing up to this number of '
+               'periods if a worker crashes. The default value of 1 commits '
+               'each state update immediately.'),
+    cfg.IntOpt('state_commit_delay',
+               default=0,
+               min=0,
+               advanced=True,
+               help='Maximal age, in seconds, of a buffered state update '
+               'before pending states are committed. 0 disables this '
+               'limit.'),
+    cfg.BoolOpt('scope_batching',
+                default=False,
+                help='Collect each metric for all the scopes of a worker '
+                'which are due for the same period with a single query, '
+                'instead of one query per scope. Data is then split per '
+                'scope and rated and stored as usual. Only collectors '
+                'supporting it issue a single query.'),
+    cfg.IntOpt('rating_rules_check_interval',
+               default=60,
+               min=0,
+               help='Rating processors are reused between scopes as long as '
+               'the rules of their module do not change. This is the '
+               'interval, in seconds, at which the rules of each module are '
+               'checked for changes. Reload, enable and disable commands '
+               'trigger a check right away. 0 checks rules before each '
+               'scope is processed.'),
+    cfg.IntOpt('rating_processors_cache_size',
+               default=0,
+               min=0,
+               advanced=True,
+               help='Maximal number of scopes for which rating processors '
+               'are kept in memory by each worker. 0 keeps the processors of '
+               'all the scopes of the worker.'),
 ]
 
 CONF.register_opts(orchestrator_opts, group='orchestrator')
@@ -80,6 +153,9 @@ COLLECTORS_NAMESPACE = 'cloudkitty.collector.backends'
 STORAGES_NAMESPACE = 'cloudkitty.storage.backends'
 
 
+PARTITIONER_GROUP = b'cloudkitty-processors'
+
+
 def get_lock(coord, tenant_id):
     name = hashlib.sha256(
         ("cloudkitty-"
@@ -90,6 +166,23 @@ def get_lock(coord, tenant_id):
     return name, coord.get_lock(name.encode('ascii'))
 
 
+class PartitionedScope(object):
+    """Wraps a scope ID for the tooz partitioner.
+
+    The partitioner relies on ``hash()`` for objects not implementing
+    ``__tooz_hash__``, which is randomized for strings and would lead to
+    different hash rings in each process.
+    """
+
+    __slots__ = ('scope_id', )
+
+    def __init__(self, scope_id):
+        self.scope_id = scope_id
+
+    def __tooz_hash__(self):
+        return str(self.scope_id).encode('utf-8')
+
+
 class RatingEndpoint(object):
     target = oslo_messaging.Target(namespace='rating',
                                    version='1.0')
@@ -124,6 +217,7 @@ class RatingEndpoint(object):
         lock = lockutils.lock('module-reload')
         with lock:
             self._global_reload = True
+        self._orchestrator.processor_cache.invalidate()
 
     def reload_module(self, ctxt, name):
         LOG.info('Received reload command for module %s.', name)
@@ -131,12 +225,14 @@ class RatingEndpoint(object):
         with lock:
             if name not in self._pending_reload:
                 self._pending_reload.append(name)
+        self._orchestrator.processor_cache.invalidate()
 
     def enable_module(self, ctxt, name):
         LOG.info('Received enable command for module %s.', name)
         lock = lockutils.lock('module-state')
         with lock:
             self._module_state[name] = True
+        self._orchestrator.processor_cache.invalidate()
 
     def disable_module(self, ctxt, name):
         LOG.info('Received disable command for module %s.', name)
@@ -145,6 +241,7 @@ class RatingEndpoint(object):
             self._module_state[name] = False
             if name in self._pending_reload:
                 self._pending_reload.remove(name)
+        self._orchestrator.processor_cache.invalidate()
 
 
 class ScopeEndpoint(object):
@@ -195,15 +292,131 @@ class ScopeEndpoint(object):
                     )
 
 
+class ProcessorCache(object):
+    """Process-wide cache of rating processors, by scope.
+
+    Processors are reused by workers as long as the rules of their module
+    do not change. The list of enabled modules and the version of their
+    rules are checked at most once every ``check_interval`` seconds, or
+    right away after the cache has been invalidated. Modules are not
+    instantiated for these checks. When the rules of a module change, its
+    cached processors are reloaded the next time they are used.
+
+    :param check_interval: Interval in seconds between two checks
+    :type check_interval: int
+    :param size: Maximal number of scopes for which processors are cached.
+                 0 caches the processors of all the scopes set with
+                 ``set_scope_count``.
+    :type size: int
+    """
+
+    def __init__(self, check_interval, size=0):
+        self._check_interval = check_interval
+        self._size = size
+        self._scope_count = 0
+        self._manager = extension.ExtensionManager(PROCESSORS_NAMESPACE)
+        # Enabled extensions, sorted by priority, with their rules version
+        self._modules = []
+        # Processors of each scope, by module name, in LRU order
+        self._processors = collections.OrderedDict()
+        self._checked_at = None
+        # Incremented on invalidation, so that a check running concurrently
+        # does not hide it
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """Forces a check before processors are used again."""
+        with self._lock:
+            self._checked_at = None
+            self._generation += 1
+
+    def set_scope_count(self, count):
+        """Sets the number of scopes the processors are used for."""
+        with self._lock:
+            self._scope_count = count
+            self._evict()
+
+    def _evict(self):
+        size = self._size or self._scope_count
+        while len(self._processors) > max(size, 1):
+            self._processors.popitem(last=False)
+
+    def _load_modules(self):
+        modules = [ext for ext in self._manager if ext.plugin.is_enabled()]
+        modules.sort(key=lambda ext: ext.plugin.get_priority(), reverse=True)
+        return [(ext, ext.plugin.get_rules_version()) for ext in modules]
+
+    def _get_modules(self):
+        with self._lock:
+            now = time.time()
+            if self._checked_at is not None and (
+                    now - self._checked_at < self._check_interval):
+                return self._modules
+            generation = self._generation
+
+        modules = self._load_modules()
+        with self._lock:
+            self._modules = modules
+            if self._generation == generation:
+                self._checked_at = now
+            return modules
+
+    def get_processors(self, tenant_id):
+        """Returns the enabled processors for a scope, by priority."""
+        modules = self._get_modules()
+        with self._lock:
+            cached = self._processors.pop(tenant_id, {})
+
+        # A scope is processed by a single worker at a time, processors can
+        # be created or reloaded without holding the lock
+        processors = {}
+        output = []
+        for ext, version in modules:
+            entry = cached.get(ext.name)
+            if entry is None or version is None:
+                entry = (version, extension.Extension(
+                    ext.name,
+                    ext.entry_point,
+                    ext.plugin,
+                    ext.plugin(tenant_id=tenant_id)))
+            elif entry[0] != version:
+                entry[1].obj.reload_config()
+                entry = (version, entry[1])
+            if version is not None:
+                processors[ext.name] = entry
+            output.append(entry[1])
+
+        with self._lock:
+            self._processors[tenant_id] = processors
+            self._evict()
+        return output
+
+
 class BaseWorker(object):
-    def __init__(self, tenant_id=None):
+    def __init__(self, tenant_id=None, processor_cache=None):
         self._tenant_id = tenant_id
+        self._processor_cache = processor_cache
+        self._instrumentation = instrumentation.get_instrumentation()
 
         # Rating processors
         self._processors = []
         self._load_rating_processors()
 
+    def _call_processor(self, processor, method_name, frames):
+        """Calls a method of a rating processor, measuring it if enabled."""
+        method = getattr(processor.obj, method_name)
+        if self._instrumentation is None:
+            return method(frames)
+        return self._instrumentation.call(
+            processor.name, self._tenant_id, method, frames)
+
     def _load_rating_processors(self):
+        if self._processor_cache is not None:
+            self._processors = self._processor_cache.get_processors(
+                self._tenant_id)
+            return
+
         self._processors = []
         processors = extension_manager.EnabledExtensionManager(
             PROCESSORS_NAMESPACE,
@@ -220,7 +433,7 @@ class APIWorker(BaseWorker):
 
     def quote(self, res_data):
         for processor in self._processors:
-            processor.obj.quote(res_data)
+            self._call_processor(processor, 'quote', res_data)
 
         price = decimal.Decimal(0)
         for res in res_data:
@@ -238,10 +451,170 @@ def _check_state(obj, period, tenant_id):
                                      CONF.collect.wait_periods)
 
 
+def _pipeline_put(queue_, item, stop_event):
+    """Puts an item in a pipeline queue unless the pipeline is stopped."""
+    while not stop_event.is_set():
+        try:
+            queue_.put(item, timeout=1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _pipeline_get(queue_, stop_event):
+    """Gets an item from a pipeline queue unless the pipeline is stopped."""
+    while not stop_event.is_set():
+        try:
+            return queue_.get(timeout=1)
+        except queue.Empty:
+            pass
+    return None
+
+
+class ScopeScheduler(object):
+    """Priority queue of scopes, ordered by the date they are due at.
+
+    A scope is due as soon as its next period can be collected, which is
+    computed from its state.
+    """
+
+    def __init__(self, state_manager, period, wait_periods):
+        self._state = state_manager
+        self._period = timedelta(seconds=period)
+        # check_time_state() uses a strict comparison and the current time
+        # has a one second resolution
+        self._wait = timedelta(seconds=period * wait_periods + 1)
+        self._heap = []
+        self._counter = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def _get_due_date(self, timestamp):
+        """Returns the date at which the period following timestamp is due."""
+        if not timestamp:
+            return tzutils.localized_now()
+        return tzutils.add_delta(timestamp, self._period + self._wait)
+
+    def _push(self, scope_id, due):
+        heapq.heappush(self._heap, (due, self._counter, scope_id))
+        self._counter += 1
+
+    def reset(self, scope_ids):
+        """Replaces all scheduled scopes with the given ones.
+
+        The states of all scopes are loaded at once. Scopes which are due at
+        the same date are scheduled in the order in which they are provided.
+        """
+        self._heap = []
+        self._counter = 0
+        states = self._state.get_states_bulk(scope_ids)
+        for scope_id in scope_ids:
+            self._push(scope_id, self._get_due_date(states.get(scope_id)))
+
+    def schedule(self, scope_id, not_before=None):
+        """Schedules a scope, based on its cached state.
+
+        :param scope_id: ID of the scope to schedule
+        :type scope_id: str
+        :param not_before: If the scope is due before this date, it is
+                           scheduled at the first period boundary following
+                           it.
+        :type not_before: datetime.datetime
+        """
+        due = self._get_due_date(self._state.get_cached_state(scope_id))
+        if not_before is not None:
+            while due <= not_before:
+                due = tzutils.add_delta(due, self._period)
+        self._push(scope_id, due)
+
+    def next_due(self):
+        """Returns the due date of the first scheduled scope, or None."""
+        return self._heap[0][0] if self._heap else None
+
+    def pop(self):
+        """Removes and returns the first scheduled scope."""
+        return heapq.heappop(self._heap)[2]
+
+
+class ScopeBatch(object):
+    """Collects metrics for several scopes with a single query per metric.
+
+    When a scope requests a metric for a period, the metric is collected for
+    all the scopes of the batch whose next period to collect is the same
+    one. The data of the other scopes is kept until they request it, or
+    until the batch is reset.
+    """
+
+    def __init__(self, collector, state_manager, period, wait_periods):
+        self._collector = collector
+        self._state = state_manager
+        self._period = period
+        self._wait_periods = wait_periods
+        self._scope_ids = []
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def reset(self, scope_ids):
+        """Replaces the scopes of the batch and drops all collected data."""
+        with self._lock:
+            self._scope_ids = list(scope_ids)
+            self._data = {}
+
+    def _get_due_scope_ids(self, start):
+        """Returns the scopes whose next period to collect starts at start.
+
+        This relies on cached states, which are loaded in bulk when the
+        scheduler is reset. The state of a scope is the start of the last
+        period which was processed for it.
+        """
+        return [scope_id for scope_id in self._scope_ids
+                if ck_utils.check_time_state(
+                    self._state.get_cached_state(scope_id),
+                    self._period,
+                    self._wait_periods) == start]
+
+    def retrieve(self, metric_name, start, end, scope_id):
+        key = (metric_name, start)
+        with self._lock:
+            scopes = self._data.setdefault(key, {})
+            scope_ids = None
+            if scope_id not in scopes:
+                scope_ids = set(self._get_due_scope_ids(start))
+                scope_ids.add(scope_id)
+                scope_ids = [s for s in scope_ids if s not in scopes]
+
+        if scope_ids:
+            data = self._collector.fetch_all_scopes(
+                metric_name, start, end, scope_ids)
+            with self._lock:
+                scopes = self._data.setdefault(key, {})
+                for s in scope_ids:
+                    scopes[s] = data.get(s, [])
+
+        with self._lock:
+            scopes = self._data.get(key, {})
+            data = scopes.pop(scope_id, [])
+            if not scopes:
+                self._data.pop(key, None)
+
+        name = self._collector.conf[metric_name].get('alt_name', metric_name)
+        if not data:
+            raise collector.NoDataCollected(
+                self._collector.collector_name, name)
+        return name, data
+
+
 class Worker(BaseWorker):
-    def __init__(self, collector, storage, tenant_id, worker_id):
+    def __init__(self, collector, storage, tenant_id, worker_id,
+                 executor, pipeline_executor, scope_batch=None,
+                 processor_cache=None):
         self._collector = collector
         self._storage = storage
+        self._executor = executor
+        self._pipeline_executor = pipeline_executor
+        self._scope_batch = scope_batch
         self._period = CONF.collect.period
         self._wait_time = CONF.collect.wait_periods * self._period
         self._tenant_id = tenant_id
@@ -250,15 +623,27 @@ class Worker(BaseWorker):
             scope=self._tenant_id, worker=self._worker_id)
         self._conf = ck_utils.load_conf(CONF.collect.metrics_conf)
         self._state = state.StateManager()
+        self._state_writer = state.StateWriter(
+            self._state,
+            batch_size=CONF.orchestrator.state_commit_batch_size,
+            max_delay=CONF.orchestrator.state_commit_delay)
         self._check_state = functools.partial(
             _check_state, self, self._period, self._tenant_id)
 
-        super(Worker, self).__init__(self._tenant_id)
+        super(Worker, self).__init__(self._tenant_id, processor_cache)
 
     def _collect(self, metric, start_timestamp):
         next_timestamp = tzutils.add_delta(
             start_timestamp, timedelta(seconds=self._period))
 
+        if self._scope_batch is not None:
+            return self._scope_batch.retrieve(
+                metric,
+                start_timestamp,
+                next_timestamp,
+                self._tenant_id,
+            )
+
         name, data = self._collector.retrieve(
             metric,
             start_timestamp,
@@ -270,10 +655,41 @@ class Worker(BaseWorker):
 
         return name, data
 
-    def _do_collection(self, metrics, timestamp):
+    def _collect_periods(self, metric, start_timestamp, nb_periods):
+        end_timestamp = tzutils.add_delta(
+            start_timestamp, timedelta(seconds=self._period * nb_periods))
+
+        name, data = self._collector.retrieve_periods(
+            metric,
+            start_timestamp,
+            end_timestamp,
+            self._tenant_id,
+        )
+
+        return name, data
+
+    def _get_catch_up_periods(self, timestamp):
+        """Returns the nb of periods to collect at once from timestamp."""
+        max_periods = CONF.orchestrator.catch_up_periods
+        if max_periods < 2:
+            return 1
+
+        limit = tzutils.substract_delta(
+            tzutils.localized_now(), timedelta(seconds=self._wait_time))
+        if limit <= timestamp:
+            return 1
+        late_periods = tzutils.diff_seconds(limit, timestamp) // self._period
+        if late_periods <= CONF.orchestrator.catch_up_threshold:
+            return 1
+        return min(late_periods, max_periods)
+
+    def _do_collection(self, metrics, timestamp, nb_periods=1):
 
         def _get_result(metric):
             try:
+                if nb_periods > 1:
+                    return self._collect_periods(
+                        metric, timestamp, nb_periods)
                 return self._collect(metric, timestamp)
             except collector.NoDataCollected:
                 LOG.info(
@@ -292,60 +708,155 @@ class Worker(BaseWorker):
                 # system in workers
                 sys.exit(1)
 
-        with futurist.ThreadPoolExecutor(
-                max_workers=CONF.orchestrator.max_threads) as tpool:
-            futs = [tpool.submit(_get_result, metric) for metric in metrics]
-            LOG.debug(self._log_prefix +
-                      'Collecting {} metrics.'.format(len(metrics)))
-            results = [r.result() for r in waiters.wait_for_all(futs).done]
-            LOG.debug(self._log_prefix + 'Collecting {} metrics took {}s '
-                      'total, with {}s average'.format(
-                          tpool.statistics.executed,
-                          tpool.statistics.runtime,
-                          tpool.statistics.average_runtime))
+        start = time.time()
+        futs = [self._executor.submit(_get_result, metric)
+                for metric in metrics]
+        LOG.debug(self._log_prefix +
+                  'Collecting {} metrics.'.format(len(metrics)))
+        results = [r.result() for r in waiters.wait_for_all(futs).done]
+        LOG.debug(self._log_prefix + 'Collecting {} metrics took {}s '
+                  'total'.format(len(metrics), time.time() - start))
         return dict(filter(lambda x: x[1] is not None, results))
 
-    def run(self):
-        while True:
-            timestamp = self._check_state()
-            if not timestamp:
-                break
+    def _collect_frames(self, metrics, timestamp, nb_periods=1):
+        """Collects nb_periods periods starting at timestamp.
 
-            metrics = list(self._conf['metrics'].keys())
+        Returns one DataFrame per period.
+        """
+        if nb_periods > 1:
+            LOG.info(self._log_prefix + 'Catching up on {nb} periods '
+                     'starting at {ts}'.format(nb=nb_periods, ts=timestamp))
 
-            # Collection
-            usage_data = self._do_collection(metrics, timestamp)
-
-            frame = dataframe.DataFrame(
+        usage_data = self._do_collection(metrics, timestamp, nb_periods)
+        if nb_periods == 1:
+            return [dataframe.DataFrame(
                 start=timestamp,
                 end=tzutils.add_delta(timestamp,
                                       timedelta(seconds=self._period)),
                 usage=usage_data,
-            )
-            # Rating
-            for processor in self._processors:
-                frame = processor.obj.process(frame)
+            )]
+
+        frames = []
+        delta = timedelta(seconds=self._period)
+        period_start = timestamp
+        for _ in range(nb_periods):
+            period_end = tzutils.add_delta(period_start, delta)
+            usage = {}
+            for name, periods in usage_data.items():
+                points = periods.get(period_start)
+                if points:
+                    usage[name] = points
+            frames.append(dataframe.DataFrame(
+                start=period_start,
+                end=period_end,
+                usage=usage,
+            ))
+            period_start = period_end
+        return frames
+
+    def _rate_frames(self, frames):
+        for processor in self._processors:
+            frames = self._call_processor(processor, 'process_batch', frames)
+        return frames
+
+    def _store_frames(self, frames):
+        self._storage.push(frames, self._tenant_id)
+        self._state_writer.set_state(self._tenant_id, frames[-1].start)
+
+    def _collect_stage(self, metrics, output_queue, stop_event):
+        """Collects periods one after another until the scope is up to date.
+
+        The state of the scope is only read once: as the storage stage may
+        not have committed the previous periods yet, the next timestamp is
+        computed from the last collected period.
+        """
+        try:
+            timestamp = self._check_state()
+            while timestamp and not stop_event.is_set():
+                nb_periods = self._get_catch_up_periods(timestamp)
+                frames = self._collect_frames(metrics, timestamp, nb_periods)
+                if not _pipeline_put(output_queue, frames, stop_event):
+                    return
+                timestamp = ck_utils.check_time_state(
+                    frames[-1].start, self._period, CONF.collect.wait_periods)
+            _pipeline_put(output_queue, None, stop_event)
+        except BaseException:
+            stop_event.set()
+            raise
+
+    def _store_stage(self, input_queue, stop_event):
+        try:
+            while True:
+                frames = _pipeline_get(input_queue, stop_event)
+                if frames is None:
+                    return
+                self._store_frames(frames)
+        except BaseException:
+            stop_event.set()
+            raise
 
-            # Writing
-            self._storage.push([frame], self._tenant_id)
-            self._state.set_state(self._tenant_id, timestamp)
+    def run(self):
+        metrics = list(self._conf['metrics'].keys())
+        depth = CONF.orchestrator.pipeline_depth
+        rating_queue = queue.Queue(maxsize=depth)
+        storage_queue = queue.Queue(maxsize=depth)
+        stop_event = threading.Event()
+
+        # Period N+1 is collected while period N is being rated in the
+        # current thread and period N-1 is being pushed to the storage
+        # backend.
+        stages = [
+            self._pipeline_executor.submit(
+                self._collect_stage, metrics, rating_queue, stop_event),
+            self._pipeline_executor.submit(
+                self._store_stage, storage_queue, stop_event),
+        ]
+        try:
+            while True:
+                frames = _pipeline_get(rating_queue, stop_event)
+                if frames is None:
+                    _pipeline_put(storage_queue, None, stop_event)
+                    break
+                frames = self._rate_frames(frames)
+                if not _pipeline_put(storage_queue, frames, stop_event):
+                    break
+        except BaseException:
+            stop_event.set()
+            raise
+        finally:
+            try:
+                # Re-raises any exception which occurred in one of the stages
+                for stage in stages:
+                    stage.result()
+            finally:
+                # Buffered states only concern periods which have been pushed
+                # to the storage backend. They must be committed before the
+                # lock of the scope is released.
+                self._state_writer.flush()
 
 
 class Orchestrator(cotyledon.Service):
     def __init__(self, worker_id):
         self._worker_id = worker_id
         super(Orchestrator, self).__init__(self._worker_id)
+        instrumentation.set_worker_id(self._worker_id)
 
         self.fetcher = driver.DriverManager(
             FETCHERS_NAMESPACE,
             CONF.fetcher.backend,
             invoke_on_load=True,
         ).driver
+        if CONF.fetcher.cache_ttl > 0:
+            self.fetcher = fetcher.CachedFetcher(self.fetcher)
 
         self.collector = collector.get_collector()
         self.storage = storage.get_storage()
         self._state = state.StateManager()
 
+        self.processor_cache = ProcessorCache(
+            CONF.orchestrator.rating_rules_check_interval,
+            CONF.orchestrator.rating_processors_cache_size)
+
         # RPC
         self.server = None
         self._rating_endpoint = RatingEndpoint(self)
@@ -357,8 +868,49 @@ class Orchestrator(cotyledon.Service):
             CONF.orchestrator.coordination_url,
             uuidutils.generate_uuid().encode('ascii'))
         self.coord.start(start_heart=True)
+        self._partitioner = None
+        if CONF.orchestrator.scope_partitioning:
+            self._init_partitioner()
         self._check_state = functools.partial(
             _check_state, self, CONF.collect.period)
+        self._scheduler = ScopeScheduler(
+            self._state, CONF.collect.period, CONF.collect.wait_periods)
+        self._scope_batch = None
+        if CONF.orchestrator.scope_batching:
+            self._scope_batch = ScopeBatch(
+                self.collector, self._state,
+                CONF.collect.period, CONF.collect.wait_periods)
+
+        # Long-lived executors, shared by all the workers of this process
+        self._executor = futurist.ThreadPoolExecutor(
+            max_workers=CONF.orchestrator.max_threads)
+        # One thread for the collection stage and one for the storage
+        # stage, rating happens in the main thread
+        self._pipeline_executor = futurist.ThreadPoolExecutor(max_workers=2)
+
+    def _init_partitioner(self):
+        try:
+            self._partitioner = self.coord.join_partitioned_group(
+                PARTITIONER_GROUP)
+        except tooz.NotImplemented:
+            LOG.warning(
+                '[Worker: {w}] The coordination backend does not support '
+                'groups, scope partitioning is disabled.'.format(
+                    w=self._worker_id))
+
+    def _owns_tenant(self, tenant_id):
+        if self._partitioner is None:
+            return True
+        return self._partitioner.belongs_to_self(PartitionedScope(tenant_id))
+
+    def _partition_changed(self):
+        """Processes group membership events.
+
+        Returns True if members joined or left the group since the last call.
+        """
+        if self._partitioner is None:
+            return False
+        return bool(self.coord.run_watchers())
 
     def _init_messaging(self):
         target = oslo_messaging.Target(topic='cloudkitty',
@@ -378,44 +930,96 @@ class Orchestrator(cotyledon.Service):
         # pending_states = self._rating_endpoint.get_module_state()
         pass
 
-    def run(self):
-        LOG.debug('Started worker {}.'.format(self._worker_id))
-        while True:
-            self.tenants = self.fetcher.get_tenants()
-            random.shuffle(self.tenants)
-            LOG.info('[Worker: {w}] Tenants loaded for fetcher {f}'.format(
-                w=self._worker_id, f=self.fetcher.name))
-
-            for tenant_id in self.tenants:
+    def _wait_until(self, dt):
+        delay = (tzutils.local_to_utc(dt)
+                 - tzutils.local_to_utc(tzutils.localized_now()))
+        if delay.total_seconds() > 0:
+            time.sleep(delay.total_seconds())
+
+    def _load_tenants(self):
+        self._partition_changed()
+        self.tenants = [tenant_id for tenant_id in self.fetcher.get_tenants()
+                        if self._owns_tenant(tenant_id)]
+        random.shuffle(self.tenants)
+        LOG.info('[Worker: {w}] Tenants loaded for fetcher {f}'.format(
+            w=self._worker_id, f=self.fetcher.name))
+        self._scheduler.reset(self.tenants)
+        self.processor_cache.set_scope_count(len(self.tenants))
+        if self._scope_batch is not None:
+            self._scope_batch.reset(self.tenants)
+
+    def _process_tenant(self, tenant_id):
+        """Runs a worker for the given scope if its lock can be acquired."""
+        lock_name, lock = get_lock(self.coord, tenant_id)
+        LOG.debug(
+            '[Worker: {w}] Trying to acquire lock "{l}" ...'.format(
+                w=self._worker_id, l=lock_name)
+        )
+        if not lock.acquire(blocking=False):
+            return
 
-                lock_name, lock = get_lock(self.coord, tenant_id)
-                LOG.debug(
-                    '[Worker: {w}] Trying to acquire lock "{l}" ...'.format(
-                        w=self._worker_id, l=lock_name)
+        LOG.debug(
+            '[Worker: {w}] Acquired lock "{l}" ...'.format(
+                w=self._worker_id, l=lock_name)
+        )
+        try:
+            state = self._check_state(tenant_id)
+            if state:
+                worker = Worker(
+                    self.collector,
+                    self.storage,
+                    tenant_id,
+                    self._worker_id,
+                    self._executor,
+                    self._pipeline_executor,
+                    scope_batch=self._scope_batch,
+                    processor_cache=self.processor_cache,
                 )
-                if lock.acquire(blocking=False):
-                    LOG.debug(
-                        '[Worker: {w}] Acquired lock "{l}" ...'.format(
-                            w=self._worker_id, l=lock_name)
-                    )
-                    state = self._check_state(tenant_id)
-                    if state:
-                        worker = Worker(
-                            self.collector,
-                            self.storage,
-                            tenant_id,
-                            self._worker_id,
-                        )
-                        worker.run()
-
-                    lock.release()
+                worker.run()
+        finally:
+            lock.release()
 
-            # FIXME(sheeprine): We may cause a drift here
-            time.sleep(CONF.collect.period)
+    def run(self):
+        LOG.debug('Started worker {}.'.format(self._worker_id))
+        while True:
+            self._load_tenants()
+            # The list of tenants is refreshed once per collect period
+            refresh_at = tzutils.add_delta(
+                tzutils.localized_now(),
+                timedelta(seconds=CONF.collect.period))
+
+            while True:
+                next_due = self._scheduler.next_due()
+                if next_due is None or next_due >= refresh_at:
+                    break
+                self._wait_until(next_due)
+                if self._partition_changed():
+                    # Scopes have been redistributed between workers
+                    LOG.info('[Worker: {w}] Processor group membership '
+                             'changed, reloading tenants.'.format(
+                                 w=self._worker_id))
+                    refresh_at = None
+                    break
+                tenant_id = self._scheduler.pop()
+                self._process_tenant(tenant_id)
+                # If the scope is still due, it is being processed by another
+                # worker: try again once its next period is due.
+                self._scheduler.schedule(
+                    tenant_id, not_before=tzutils.localized_now())
+
+            if refresh_at is not None:
+                self._wait_until(refresh_at)
 
     def terminate(self):
         LOG.debug('Terminating worker {}...'.format(self._worker_id))
+        if self._partitioner is not None:
+            self._partitioner.stop()
         self.coord.stop()
+        self._pipeline_executor.shutdown()
+        self._executor.shutdown()
+        instr = instrumentation.get_instrumentation()
+        if instr is not None:
+            instr.flush()
         LOG.debug('Terminated worker {}.'.format(self._worker_id))
 
 
@@ -57,18 +57,41 @@ class RatingProcessorBase(object):
 
         :returns: bool if module is enabled
         """
-        api = db_api.get_instance()
-        module_db = api.get_module_info()
-        return module_db.get_state(self.module_name) or False
+        return self._get_state(self.module_name)
 
     @property
     def priority(self):
         """Get the priority of the module.
 
         """
+        return self._get_priority(self.module_name)
+
+    @classmethod
+    def is_enabled(cls):
+        """Check if the module is enabled, without instantiating it.
+
+        :returns: bool if module is enabled
+        """
+        return cls._get_state(cls.module_name)
+
+    @classmethod
+    def get_priority(cls):
+        """Get the priority of the module, without instantiating it.
+
+        """
+        return cls._get_priority(cls.module_name)
+
+    @staticmethod
+    def _get_state(module_name):
         api = db_api.get_instance()
         module_db = api.get_module_info()
-        return module_db.get_priority(self.module_name)
+        return module_db.get_state(module_name) or False
+
+    @staticmethod
+    def _get_priority(module_name):
+        api = db_api.get_instance()
+        module_db = api.get_module_info()
+        return module_db.get_priority(module_name)
 
     def set_priority(self, priority):
         """Set the priority of the module.
@@ -98,6 +121,17 @@ class RatingProcessorBase(object):
         client.cast({}, operation, name=self.module_name)
         return module_db.set_state(self.module_name, enabled)
 
+    @classmethod
+    def get_rules_version(cls):
+        """Returns a value identifying the current rules of the module.
+
+        The returned value must change whenever the rules of the module
+        change. Processors are reused between scopes by the orchestrator as
+        long as their version doesn't change. Returning None prevents
+        processors from being reused.
+        """
+        return None
+
     def quote(self, data):
         """Compute rating informations from data.
 
@@ -124,6 +158,18 @@ class RatingProcessorBase(object):
         :type data: dict(str:?)
         """
 
+    def process_batch(self, frames):
+        """Add rating informations to several frames
+
+        Modules which can rate several frames at once more efficiently than
+        one after another can override this method.
+
+        :param frames: Frames to rate, in chronological order.
+        :type frames: list
+        :returns: The rated frames, in the same order.
+        """
+        return [self.process(frame) for frame in frames]
+
     @abc.abstractmethod
     def reload_config(self):
         """Trigger configuration reload
@@ -19,6 +19,7 @@ from cloudkitty import dataframe
 from cloudkitty import rating
 from cloudkitty.rating.hash.controllers import root as root_api
 from cloudkitty.rating.hash.db import api as hash_db_api
+from cloudkitty.rating.hash import plan
 
 
 class HashMap(rating.RatingProcessorBase):
@@ -38,6 +39,7 @@ class HashMap(rating.RatingProcessorBase):
     def __init__(self, tenant_id=None):
         super(HashMap, self).__init__(tenant_id)
         self._entries = {}
+        self._plan = plan.RatingPlan({})
         self._res = {}
         self._load_rates()
 
@@ -47,6 +49,10 @@ class HashMap(rating.RatingProcessorBase):
         """
         self._load_rates()
 
+    @classmethod
+    def get_rules_version(cls):
+        return hash_db_api.get_instance().get_rules_version()
+
     def _load_mappings(self, mappings_uuid_list):
         hashmap = hash_db_api.get_instance()
         mappings = {}
@@ -88,86 +94,94 @@ class HashMap(rating.RatingProcessorBase):
             current_scope['cost'] = threshold_db.cost
         return thresholds
 
-    def _update_entries(self,
-                        entry_type,
-                        root,
-                        service_uuid=None,
-                        field_uuid=None,
-                        tenant_uuid=None):
-        hashmap = hash_db_api.get_instance()
-        list_func = getattr(hashmap, 'list_{}'.format(entry_type))
-        entries_uuid_list = list_func(
-            service_uuid=service_uuid,
-            field_uuid=field_uuid,
-            tenant_uuid=tenant_uuid)
-        load_func = getattr(self, '_load_{}'.format(entry_type))
-        entries = load_func(entries_uuid_list)
-        if entry_type in root:
-            res = root[entry_type]
-            for group, values in entries.items():
-                if group in res:
-                    res[group].update(values)
+    @staticmethod
+    def _add_entry(root, entry, key_name):
+        group_name = entry['group'] or '_DEFAULT_'
+        current_scope = root.setdefault(group_name, {})
+        key = entry[key_name]
+        if key_name == 'level' or key:
+            current_scope[key] = {}
+            current_scope = current_scope[key]
+        current_scope['type'] = entry['map_type']
+        current_scope['cost'] = entry['cost']
+
+    @classmethod
+    def _build_entries(cls, rules):
+        """Builds the rates of every service from a snapshot of the rules.
+
+        Tenant specific rules are applied after global ones, and override
+        them.
+        """
+        entries = {}
+        services = {}
+        for service_uuid, service_name in rules['services']:
+            services[service_uuid] = entries[service_name] = {
+                'mappings': {}, 'thresholds': {}}
+        fields = {}
+        for field_uuid, service_uuid, field_name in rules['fields']:
+            service_fields = services[service_uuid].setdefault('fields', {})
+            fields[field_uuid] = service_fields[field_name] = {
+                'mappings': {}, 'thresholds': {}}
+
+        for entry_type, key_name in (('mappings', 'value'),
+                                     ('thresholds', 'level')):
+            for entry in rules[entry_type]:
+                if entry['service_uuid']:
+                    root = services.get(entry['service_uuid'])
                 else:
-                    res[group] = values
-        else:
-            root[entry_type] = entries
-
-    def _load_service_entries(self, service_name, service_uuid):
-        self._entries[service_name] = dict()
-        for entry_type in ('mappings', 'thresholds'):
-            for tenant in (None, self._tenant_id):
-                self._update_entries(
-                    entry_type,
-                    self._entries[service_name],
-                    service_uuid=service_uuid,
-                    tenant_uuid=tenant)
-
-    def _load_field_entries(self, service_name, field_name, field_uuid):
-        if service_name not in self._entries:
-            self._entries[service_name] = {}
-        if 'fields' not in self._entries[service_name]:
-            self._entries[service_name]['fields'] = {}
-        scope = self._entries[service_name]['fields'][field_name] = {}
-        for entry_type in ('mappings', 'thresholds'):
-            for tenant in (None, self._tenant_id):
-                self._update_entries(
-                    entry_type,
-                    scope,
-                    field_uuid=field_uuid,
-                    tenant_uuid=tenant)
+                    root = fields.get(entry['field_uuid'])
+                if root is not None:
+                    cls._add_entry(root[entry_type], entry, key_name)
+        return entries
 
     def _load_rates(self):
-        self._entries = {}
         hashmap = hash_db_api.get_instance()
-        services_uuid_list = hashmap.list_services()
-        for service_uuid in services_uuid_list:
-            service_db = hashmap.get_service(uuid=service_uuid)
-            service_name = service_db.name
-            self._load_service_entries(service_name, service_uuid)
-            fields_uuid_list = hashmap.list_fields(service_uuid)
-            for field_uuid in fields_uuid_list:
-                field_db = hashmap.get_field(uuid=field_uuid)
-                field_name = field_db.name
-                self._load_field_entries(service_name, field_name, field_uuid)
+        rules = hashmap.load_rules(tenant_uuid=self._tenant_id)
+        self._entries = self._build_entries(rules)
+        self._plan = plan.RatingPlan(self._entries)
 
-    def add_rating_informations(self, point):
-        for entry in self._res.values():
+    @staticmethod
+    def _get_rating_terms(result):
+        """Converts a rating result to a list of rating terms.
+
+        Each term is a (factor, threshold) tuple. The price of a point is
+        increased by ``factor * qty`` for each term, adjusted by the service
+        threshold if there is one.
+        """
+        terms = []
+        for entry in result.values():
             rate = entry['rate']
             flat = entry['flat']
+            threshold = None
             if entry['threshold']['scope'] == 'field':
                 if entry['threshold']['type'] == 'flat':
                     flat += entry['threshold']['cost']
                 else:
                     rate *= entry['threshold']['cost']
-            res = rate * flat
-            res *= point.qty
-            if entry['threshold']['scope'] == 'service':
-                if entry['threshold']['type'] == 'flat':
-                    res += entry['threshold']['cost']
+            elif entry['threshold']['scope'] == 'service':
+                threshold = (entry['threshold']['type'],
+                             entry['threshold']['cost'])
+            terms.append((rate * flat, threshold))
+        return terms
+
+    @staticmethod
+    def _apply_rating_terms(point, terms):
+        if not terms:
+            return point
+        price = point.price
+        for factor, threshold in terms:
+            res = factor * point.qty
+            if threshold is not None:
+                if threshold[0] == 'flat':
+                    res += threshold[1]
                 else:
-                    res *= entry['threshold']['cost']
-            point = point.set_price(point.price + res)
-        return point
+                    res *= threshold[1]
+            price = price + res
+        return point.set_price(price)
+
+    def add_rating_informations(self, point):
+        return self._apply_rating_terms(
+            point, self._get_rating_terms(self._res))
 
     def update_result(self,
                       group,
@@ -258,13 +272,30 @@ class HashMap(rating.RatingProcessorBase):
                                         decimal.Decimal(cmp_value),
                                         'field')
 
+    def _process_batch(self, service_name, points):
+        """Rates all the points of a service.
+
+        The matching rules and the resulting rating terms are only computed
+        once for all the points sharing the same rules key. Prices are the
+        same as the ones computed point by point.
+        """
+        terms_by_key = {}
+        for point in points:
+            key = self._plan.get_rules_key(service_name, point)
+            terms = terms_by_key.get(key) if key is not None else None
+            if terms is None:
+                self._res = {}
+                self._plan.evaluate(service_name, point, self.update_result)
+                terms = self._get_rating_terms(self._res)
+                if key is not None:
+                    terms_by_key[key] = terms
+            yield self._apply_rating_terms(point, terms)
+
     def process(self, data):
         output = dataframe.DataFrame(start=data.start, end=data.end)
 
-        for service_name, point in data.iterpoints():
-            self._res = {}
-            self.process_services(service_name, point)
-            self.process_fields(service_name, point)
-            output.add_point(self.add_rating_informations(point), service_name)
+        for service_name, points in data.itertypes():
+            for point in self._process_batch(service_name, points):
+                output.add_point(point, service_name)
 
         return output
@@ -289,6 +289,35 @@ class HashMap(object):
         :return list(str): List of thresholds' UUID.
         """
 
+    @abc.abstractmethod
+    def load_rules(self, tenant_uuid=None):
+        """Return a snapshot of every rating rule, loaded in bulk.
+
+        Services and fields are identified by their UUID. Only global
+        mappings and thresholds and the ones of the given tenant are
+        returned, global ones first.
+
+        :param tenant_uuid: The tenant to load specific rules of.
+
+        :return dict: A dict with the following keys:
+                      - services: list of (uuid, name) tuples.
+                      - fields: list of (uuid, service_uuid, name) tuples.
+                      - mappings: list of dicts with the service_uuid,
+                        field_uuid, group, value, map_type and cost keys.
+                      - thresholds: list of dicts with the service_uuid,
+                        field_uuid, group, level, map_type and cost keys.
+        """
+
+    @abc.abstractmethod
+    def get_rules_version(self):
+        """Return the version of the rating rules.
+
+        The version changes whenever a service, field, group, mapping or
+        threshold is created, updated or deleted.
+
+        :return int: Version of the rules.
+        """
+
     @abc.abstractmethod
     def create_service(self, name):
         """Create a new service.
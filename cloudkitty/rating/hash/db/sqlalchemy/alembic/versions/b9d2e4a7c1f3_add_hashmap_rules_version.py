@@ -0,0 +1,40 @@
+# Copyright 2019 Objectif Libre
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""Add hashmap_rules_version table
+
+Revision ID: b9d2e4a7c1f3
+Revises: 644faa4491fd
+Create Date: 2019-11-04 10:12:41.306527
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'b9d2e4a7c1f3'
+down_revision = '644faa4491fd'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    table = op.create_table(
+        'hashmap_rules_version',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        mysql_charset='utf8',
+        mysql_engine='InnoDB')
+    op.bulk_insert(table, [{'id': 1, 'version': 0}])
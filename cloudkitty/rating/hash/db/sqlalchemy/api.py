@@ -230,6 +230,80 @@ class HashMap(api.HashMap):
             models.HashMapThreshold.threshold_id)
         return [uuid[0] for uuid in res]
 
+    @staticmethod
+    def _load_entries(session, model, columns, tenant_uuid):
+        q = session.query(
+            models.HashMapService.service_id,
+            models.HashMapField.field_id,
+            models.HashMapGroup.name,
+            model.tenant_id,
+            *[getattr(model, column) for column in columns])
+        q = q.select_from(model)
+        q = q.outerjoin(models.HashMapService,
+                        model.service_id == models.HashMapService.id)
+        q = q.outerjoin(models.HashMapField,
+                        model.field_id == models.HashMapField.id)
+        q = q.outerjoin(models.HashMapGroup,
+                        model.group_id == models.HashMapGroup.id)
+        tenant_filter = model.tenant_id == None  # noqa
+        if tenant_uuid:
+            tenant_filter = sqlalchemy.or_(
+                tenant_filter, model.tenant_id == tenant_uuid)
+        q = q.filter(tenant_filter).order_by(model.id)
+
+        entries = []
+        for row in q.all():
+            entry = {
+                'service_uuid': row[0],
+                'field_uuid': row[1],
+                'group': row[2],
+            }
+            entry.update(zip(columns, row[4:]))
+            # Global entries first, sort() is stable
+            entries.append((row[3] is not None, entry))
+        entries.sort(key=lambda entry: entry[0])
+        return [entry for _, entry in entries]
+
+    def load_rules(self, tenant_uuid=None):
+        session = db.get_session()
+        services = session.query(
+            models.HashMapService.service_id,
+            models.HashMapService.name,
+        ).order_by(models.HashMapService.id).all()
+        fields = session.query(
+            models.HashMapField.field_id,
+            models.HashMapService.service_id,
+            models.HashMapField.name,
+        ).join(models.HashMapField.service).order_by(
+            models.HashMapField.id).all()
+        return {
+            'services': [tuple(service) for service in services],
+            'fields': [tuple(field) for field in fields],
+            'mappings': self._load_entries(
+                session, models.HashMapMapping,
+                ('value', 'map_type', 'cost'), tenant_uuid),
+            'thresholds': self._load_entries(
+                session, models.HashMapThreshold,
+                ('level', 'map_type', 'cost'), tenant_uuid),
+        }
+
+    def get_rules_version(self):
+        session = db.get_session()
+        version = session.query(
+            models.HashMapRulesVersion.version).scalar()
+        return version or 0
+
+    @staticmethod
+    def _bump_rules_version(session):
+        """Increments the rules version, in the transaction of session."""
+        q = session.query(models.HashMapRulesVersion)
+        updated = q.update(
+            {models.HashMapRulesVersion.version:
+             models.HashMapRulesVersion.version + 1},
+            synchronize_session=False)
+        if not updated:
+            session.add(models.HashMapRulesVersion(id=1, version=1))
+
     def create_service(self, name):
         session = db.get_session()
         try:
@@ -237,6 +311,7 @@ class HashMap(api.HashMap):
                 service_db = models.HashMapService(name=name)
                 service_db.service_id = uuidutils.generate_uuid()
                 session.add(service_db)
+                self._bump_rules_version(session)
             return service_db
         except exception.DBDuplicateEntry:
             service_db = self.get_service(name=name)
@@ -254,6 +329,7 @@ class HashMap(api.HashMap):
                     name=name,
                     field_id=uuidutils.generate_uuid())
                 session.add(field_db)
+                self._bump_rules_version(session)
             # FIXME(sheeprine): backref are not populated as they used to be.
             #                   Querying the item again to get backref.
             field_db = self.get_field(service_uuid=service_uuid, name=name)
@@ -271,6 +347,7 @@ class HashMap(api.HashMap):
                     name=name,
                     group_id=uuidutils.generate_uuid())
                 session.add(group_db)
+                self._bump_rules_version(session)
             return group_db
         except exception.DBDuplicateEntry:
             group_db = self.get_group(name=name)
@@ -322,6 +399,7 @@ class HashMap(api.HashMap):
                 if group_fk:
                     field_map.group_id = group_fk
                 session.add(field_map)
+                self._bump_rules_version(session)
         except exception.DBDuplicateEntry:
             if field_id:
                 puuid = field_id
@@ -379,6 +457,7 @@ class HashMap(api.HashMap):
                 if group_fk:
                     threshold_db.group_id = group_fk
                 session.add(threshold_db)
+                self._bump_rules_version(session)
         except exception.DBDuplicateEntry:
             if field_id:
                 puuid = field_id
@@ -429,6 +508,7 @@ class HashMap(api.HashMap):
                                     attribute))
                 else:
                     raise api.ClientHashMapError('No attribute to update.')
+                self._bump_rules_version(session)
                 return mapping_db
         except exception.DBDuplicateEntry:
             puuid = uuid
@@ -470,6 +550,7 @@ class HashMap(api.HashMap):
                                     attribute))
                 else:
                     raise api.ClientHashMapError('No attribute to update.')
+                self._bump_rules_version(session)
                 return threshold_db
         except exception.DBDuplicateEntry:
             puuid = uuid
@@ -494,7 +575,10 @@ class HashMap(api.HashMap):
         else:
             raise api.ClientHashMapError(
                 'You must specify either name or uuid.')
-        r = q.delete()
+        with session.begin():
+            r = q.delete()
+            if r:
+                self._bump_rules_version(session)
         if not r:
             raise api.NoSuchService(name, uuid)
 
@@ -504,7 +588,10 @@ class HashMap(api.HashMap):
             models.HashMapField,
             session)
         q = q.filter(models.HashMapField.field_id == uuid)
-        r = q.delete()
+        with session.begin():
+            r = q.delete()
+            if r:
+                self._bump_rules_version(session)
         if not r:
             raise api.NoSuchField(uuid)
 
@@ -525,6 +612,7 @@ class HashMap(api.HashMap):
                 for threshold in r.thresholds:
                     session.delete(threshold)
             q.delete()
+            self._bump_rules_version(session)
 
     def delete_mapping(self, uuid):
         session = db.get_session()
@@ -532,7 +620,10 @@ class HashMap(api.HashMap):
             models.HashMapMapping,
             session)
         q = q.filter(models.HashMapMapping.mapping_id == uuid)
-        r = q.delete()
+        with session.begin():
+            r = q.delete()
+            if r:
+                self._bump_rules_version(session)
         if not r:
             raise api.NoSuchMapping(uuid)
 
@@ -542,6 +633,9 @@ class HashMap(api.HashMap):
             models.HashMapThreshold,
             session)
         q = q.filter(models.HashMapThreshold.threshold_id == uuid)
-        r = q.delete()
+        with session.begin():
+            r = q.delete()
+            if r:
+                self._bump_rules_version(session)
         if not r:
             raise api.NoSuchThreshold(uuid)
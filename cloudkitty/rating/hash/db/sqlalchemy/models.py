@@ -348,3 +348,24 @@ class HashMapThreshold(Base, HashMapBase):
                     level=self.level,
                     cost=self.cost,
                     tenant=self.tenant_id)
+
+
+class HashMapRulesVersion(Base, HashMapBase):
+    """Version of the hashmap rules.
+
+    Single row table, the version is incremented each time a service, field,
+    group, mapping or threshold is created, updated or deleted.
+    """
+    __tablename__ = 'hashmap_rules_version'
+
+    id = sqlalchemy.Column(
+        sqlalchemy.Integer,
+        primary_key=True)
+    version = sqlalchemy.Column(
+        sqlalchemy.BigInteger,
+        nullable=False,
+        default=0)
+
+    def __repr__(self):
+        return '<HashMapRulesVersion: version={version}>'.format(
+            version=self.version)
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Objectif Libre
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+import bisect
+import collections
+import decimal
+import types
+
+
+Mapping = collections.namedtuple('Mapping', ['group', 'type', 'cost'])
+
+# Levels are sorted in ascending order, thresholds[i] applies from levels[i]
+ThresholdGroup = collections.namedtuple(
+    'ThresholdGroup', ['group', 'levels', 'thresholds'])
+
+# mappings maps a field value to the mappings of each group matching it
+Field = collections.namedtuple('Field', ['name', 'mappings', 'thresholds'])
+
+Service = collections.namedtuple(
+    'Service', ['mappings', 'thresholds', 'fields'])
+
+# Value of the fields which are not set on a point
+_MISSING = object()
+
+
+def _compile_thresholds(threshold_groups):
+    output = []
+    for group_name, thresholds in threshold_groups.items():
+        levels = sorted(thresholds.keys())
+        output.append(ThresholdGroup(
+            group_name,
+            tuple(levels),
+            tuple(Mapping(group_name,
+                          thresholds[level]['type'],
+                          thresholds[level]['cost'])
+                  for level in levels),
+        ))
+    return tuple(output)
+
+
+def _compile_field(field_name, entries):
+    mappings = collections.OrderedDict()
+    for group_name, group_mappings in entries['mappings'].items():
+        for value, mapping in group_mappings.items():
+            mappings.setdefault(value, []).append(
+                Mapping(group_name, mapping['type'], mapping['cost']))
+    return Field(
+        field_name,
+        types.MappingProxyType(
+            {value: tuple(m) for value, m in mappings.items()}),
+        _compile_thresholds(entries['thresholds']),
+    )
+
+
+def _compile_service(entries):
+    return Service(
+        tuple(Mapping(group_name, mapping['type'], mapping['cost'])
+              for group_name, mapping in entries['mappings'].items()),
+        _compile_thresholds(entries['thresholds']),
+        tuple(_compile_field(field_name, field_entries)
+              for field_name, field_entries
+              in entries.get('fields', {}).items()),
+    )
+
+
+class RatingPlan(object):
+    """Immutable and indexed representation of HashMap rating rules.
+
+    Field mappings are indexed by value and thresholds are sorted by level,
+    so that the cost of rating a point depends on the number of fields of
+    its service rather than on the number of rules.
+
+    :param entries: Rating rules, as loaded by the HashMap module.
+    :type entries: dict
+    """
+
+    def __init__(self, entries):
+        self._services = types.MappingProxyType({
+            service_name: _compile_service(service_entries)
+            for service_name, service_entries in entries.items()
+        })
+
+    @staticmethod
+    def _apply_thresholds(threshold_groups, level, threshold_scope,
+                          update_result):
+        for threshold_group in threshold_groups:
+            # Only the threshold with the highest level lower or equal to
+            # the given level is kept
+            idx = bisect.bisect_right(threshold_group.levels, level) - 1
+            if idx < 0:
+                continue
+            threshold = threshold_group.thresholds[idx]
+            update_result(threshold.group,
+                          threshold.type,
+                          threshold.cost,
+                          threshold_group.levels[idx],
+                          True,
+                          threshold_scope)
+
+    def get_rules_key(self, service_name, point):
+        """Returns a key identifying the rules matching a point.
+
+        The rules matching a point only depend on the values of the fields
+        of its service and on the service thresholds its quantity reaches.
+        Points of a service with the same key match the same rules. Field
+        values are converted to strings as when matching mappings, so that
+        equal values such as 1 and 1.0 get different keys. None is returned
+        if the values of fields having thresholds are not hashable.
+
+        :param service_name: Name of the service of the point
+        :type service_name: str
+        :param point: Point to rate
+        :type point: cloudkitty.dataframe.DataPoint
+        """
+        service = self._services.get(service_name)
+        if service is None:
+            return ()
+        # Same as point.desc, without building a new dict
+        groupby = point.groupby
+        metadata = point.metadata
+        values = []
+        for field in service.fields:
+            value = (groupby[field.name] if field.name in groupby
+                     else metadata.get(field.name, _MISSING))
+            if value is _MISSING:
+                values.append(value)
+            elif field.thresholds:
+                # Mappings are matched against str(value) and thresholds
+                # against the value itself
+                values.append((str(value), value))
+            else:
+                values.append(str(value))
+        key = (
+            tuple(bisect.bisect_right(threshold_group.levels, point.qty)
+                  for threshold_group in service.thresholds),
+            tuple(values),
+        )
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def evaluate(self, service_name, point, update_result):
+        """Applies the rules of a service to a point.
+
+        Matching rules are given to ``update_result`` in the same order as
+        the one in which the HashMap module processes them.
+
+        :param service_name: Name of the service of the point
+        :type service_name: str
+        :param point: Point to rate
+        :type point: cloudkitty.dataframe.DataPoint
+        :param update_result: Callable with the signature of
+                              ``HashMap.update_result``
+        """
+        service = self._services.get(service_name)
+        if service is None:
+            return
+
+        for mapping in service.mappings:
+            update_result(mapping.group, mapping.type, mapping.cost)
+        self._apply_thresholds(
+            service.thresholds, point.qty, 'service', update_result)
+
+        desc_data = point.desc
+        for field in service.fields:
+            if field.name not in desc_data:
+                continue
+            cmp_value = desc_data[field.name]
+            for mapping in field.mappings.get(str(cmp_value), ()):
+                update_result(mapping.group, mapping.type, mapping.cost)
+            if field.thresholds:
+                self._apply_thresholds(
+                    field.thresholds, decimal.Decimal(cmp_value), 'field',
+                    update_result)
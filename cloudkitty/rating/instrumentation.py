@@ -0,0 +1,438 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Objectif Libre
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+"""Timing and throughput instrumentation of the rating processors."""
+import abc
+import bisect
+import collections
+import os
+import re
+import socket
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_config import types
+from oslo_log import log
+import six
+from stevedore import driver
+
+from cloudkitty import dataframe
+
+
+LOG = log.getLogger(__name__)
+
+SINKS_NAMESPACE = 'cloudkitty.rating.metric_sinks'
+
+RATING_METRICS_OPTS = 'rating_metrics'
+rating_metrics_opts = [
+    cfg.StrOpt(
+        'sink',
+        help='Sink to which the duration of each rating module and the '
+             'number of points it rated are sent. Can be '
+             '"prometheus_textfile" or "statsd". Rating modules are not '
+             'instrumented if left unset.',
+    ),
+    cfg.ListOpt(
+        'duration_buckets',
+        item_type=types.Float(),
+        default=[0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60],
+        help='Upper bounds of the buckets of the duration histograms, in '
+             'seconds. Used by the "prometheus_textfile" sink.',
+    ),
+    cfg.StrOpt(
+        'textfile_path',
+        default='/var/lib/cloudkitty/rating_metrics.prom',
+        help='File to which the "prometheus_textfile" sink writes metrics. '
+             'It is meant to be read by the textfile collector of the '
+             'Prometheus node exporter. Each process writes its own file, '
+             'named after this one with the ID of the process worker '
+             'appended to it, for example "rating_metrics-2.prom".',
+    ),
+    cfg.IntOpt(
+        'textfile_write_interval',
+        default=10,
+        min=0,
+        help='Minimal interval between two writes of the metrics file, in '
+             'seconds.',
+    ),
+    cfg.HostAddressOpt(
+        'statsd_host',
+        default='localhost',
+        help='Host of the statsd server used by the "statsd" sink.',
+    ),
+    cfg.PortOpt(
+        'statsd_port',
+        default=8125,
+        help='Port of the statsd server used by the "statsd" sink.',
+    ),
+    cfg.StrOpt(
+        'statsd_prefix',
+        default='cloudkitty.rating',
+        help='Prefix of the metrics sent by the "statsd" sink.',
+    ),
+]
+cfg.CONF.register_opts(rating_metrics_opts, RATING_METRICS_OPTS)
+
+CONF = cfg.CONF
+
+
+_worker_id = None
+
+
+def set_worker_id(worker_id):
+    """Sets the ID of the worker running in the current process.
+
+    It identifies the metrics of each process. The PID of the process is
+    used if it is not set.
+    """
+    global _worker_id
+    _worker_id = worker_id
+
+
+def get_worker_id():
+    return str(os.getpid() if _worker_id is None else _worker_id)
+
+
+def split_duration(duration, points):
+    """Splits the duration of a call between metric types.
+
+    Rating modules rate all the metric types of a frame at once, so the
+    duration is split in proportion to the number of points of each type.
+    """
+    total = sum(points.values())
+    if not total:
+        return {}
+    return {metric_type: duration * count / total
+            for metric_type, count in points.items()}
+
+
+def count_points(frames):
+    """Returns the number of points of each metric type in frames.
+
+    Frames can either be DataFrame objects or dicts in the legacy format,
+    as used by quotes.
+    """
+    counts = collections.Counter()
+    for frame in frames:
+        if isinstance(frame, dataframe.DataFrame):
+            for metric_type, points in frame.itertypes():
+                counts[metric_type] += len(points)
+        else:
+            for metric_type, points in frame.get('usage', {}).items():
+                counts[metric_type] += len(points)
+    return counts
+
+
+@six.add_metaclass(abc.ABCMeta)
+class MetricsSink(object):
+    """Base class of the sinks of rating metrics."""
+
+    @abc.abstractmethod
+    def record(self, module_name, scope_id, duration, points):
+        """Records a call to a rating module.
+
+        :param module_name: Name of the rating module
+        :type module_name: str
+        :param scope_id: Scope that was rated
+        :type scope_id: str
+        :param duration: Time the module took, in seconds
+        :type duration: float
+        :param points: Number of rated points, by metric type
+        :type points: dict
+        """
+
+    def record_compilations(self, module_name, compiled, skipped):
+        """Records a reload of the scripts of a rating module.
+
+        Sinks not supporting this metric can leave this method as is.
+
+        :param module_name: Name of the rating module
+        :type module_name: str
+        :param compiled: Number of scripts which were compiled
+        :type compiled: int
+        :param skipped: Number of unchanged scripts which were not compiled
+                        again
+        :type skipped: int
+        """
+
+    def flush(self):
+        """Sends the metrics which have not been sent yet, if any."""
+
+
+class PrometheusTextfileSink(MetricsSink):
+    """Writes metrics in the Prometheus text format to a file.
+
+    Metrics are aggregated in memory and the file is atomically replaced at
+    most every ``write_interval`` seconds. As metrics are kept by each
+    process, every process writes its own file, and its metrics have a
+    ``worker`` label.
+    """
+
+    def __init__(self, path=None, buckets=None, write_interval=None,
+                 worker=None):
+        self._worker = get_worker_id() if worker is None else str(worker)
+        root, ext = os.path.splitext(
+            path or CONF.rating_metrics.textfile_path)
+        self._path = '{}-{}{}'.format(root, self._worker, ext)
+        self._buckets = sorted(
+            buckets or CONF.rating_metrics.duration_buckets)
+        self._write_interval = (
+            CONF.rating_metrics.textfile_write_interval
+            if write_interval is None else write_interval)
+        self._lock = threading.Lock()
+        self._last_write = 0
+        # (module, scope) -> [bucket counts..., +Inf count, sum, count]
+        self._durations = {}
+        # (module, scope, metric_type) -> same as above
+        self._type_durations = {}
+        # (module, scope, metric_type) -> number of points
+        self._points = collections.Counter()
+        # (module, scope) -> points per second of the last call
+        self._throughputs = {}
+        # (module, result) -> number of scripts
+        self._compilations = collections.Counter()
+
+    def _observe(self, histograms, key, duration):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [0] * (len(self._buckets) + 3)
+        histogram[bisect.bisect_left(self._buckets, duration)] += 1
+        histogram[-2] += duration
+        histogram[-1] += 1
+
+    def record(self, module_name, scope_id, duration, points):
+        key = (module_name, scope_id)
+        with self._lock:
+            self._observe(self._durations, key, duration)
+            for metric_type, type_duration in split_duration(
+                    duration, points).items():
+                self._observe(self._type_durations,
+                              key + (metric_type, ), type_duration)
+            for metric_type, count in points.items():
+                self._points[key + (metric_type, )] += count
+            if duration > 0:
+                self._throughputs[key] = sum(points.values()) / duration
+            if time.time() - self._last_write >= self._write_interval:
+                self._write()
+
+    def record_compilations(self, module_name, compiled, skipped):
+        with self._lock:
+            self._compilations[(module_name, 'compiled')] += compiled
+            self._compilations[(module_name, 'skipped')] += skipped
+
+    def flush(self):
+        with self._lock:
+            self._write()
+
+    def _labels(self, **labels):
+        labels['worker'] = self._worker
+        return ','.join(
+            '{}="{}"'.format(k, str(v).replace('\\', '\\\\')
+                             .replace('"', '\\"').replace('\n', '\\n'))
+            for k, v in sorted(labels.items()))
+
+    def _format_histogram(self, name, histograms, label_names):
+        lines = []
+        for key, histogram in sorted(histograms.items()):
+            labels = dict(zip(label_names, key))
+            cumulative = 0
+            for bound, count in zip(self._buckets + ['+Inf'],
+                                    histogram[:-2]):
+                cumulative += count
+                lines.append('%s_bucket{%s} %d' % (
+                    name, self._labels(le=bound, **labels), cumulative))
+            lines.append('%s_sum{%s} %r' % (
+                name, self._labels(**labels), histogram[-2]))
+            lines.append('%s_count{%s} %d' % (
+                name, self._labels(**labels), histogram[-1]))
+        return lines
+
+    def format(self):
+        """Returns the metrics in the Prometheus text format."""
+        lines = [
+            '# HELP cloudkitty_rating_duration_seconds Time spent in '
+            'rating modules.',
+            '# TYPE cloudkitty_rating_duration_seconds histogram',
+        ]
+        lines += self._format_histogram(
+            'cloudkitty_rating_duration_seconds',
+            self._durations, ('module', 'scope'))
+        lines += [
+            '# HELP cloudkitty_rating_type_duration_seconds Time spent in '
+            'rating modules by metric type, estimated from the number of '
+            'points of each type.',
+            '# TYPE cloudkitty_rating_type_duration_seconds histogram',
+        ]
+        lines += self._format_histogram(
+            'cloudkitty_rating_type_duration_seconds',
+            self._type_durations, ('module', 'scope', 'type'))
+        lines += [
+            '# HELP cloudkitty_rating_points_total Points rated by rating '
+            'modules.',
+            '# TYPE cloudkitty_rating_points_total counter',
+        ]
+        for (module, scope, metric_type), count in sorted(
+                self._points.items()):
+            lines.append('cloudkitty_rating_points_total{%s} %d' % (
+                self._labels(module=module, scope=scope, type=metric_type),
+                count))
+        lines += [
+            '# HELP cloudkitty_rating_points_per_second Throughput of the '
+            'last call to rating modules.',
+            '# TYPE cloudkitty_rating_points_per_second gauge',
+        ]
+        for (module, scope), value in sorted(self._throughputs.items()):
+            lines.append('cloudkitty_rating_points_per_second{%s} %r' % (
+                self._labels(module=module, scope=scope), value))
+        if self._compilations:
+            lines += [
+                '# HELP cloudkitty_rating_script_compilations_total Scripts '
+                'compiled or left unchanged when rating modules are '
+                'reloaded.',
+                '# TYPE cloudkitty_rating_script_compilations_total counter',
+            ]
+            for (module, result), count in sorted(
+                    self._compilations.items()):
+                lines.append(
+                    'cloudkitty_rating_script_compilations_total{%s} %d' % (
+                        self._labels(module=module, result=result), count))
+        return '\n'.join(lines) + '\n'
+
+    def _write(self):
+        tmp_path = '{}.{}.tmp'.format(self._path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(self.format())
+            os.rename(tmp_path, self._path)
+        except (IOError, OSError) as e:
+            LOG.warning('Could not write rating metrics to %s: %s',
+                        self._path, e)
+        self._last_write = time.time()
+
+
+class StatsdSink(MetricsSink):
+    """Sends metrics to a statsd server over UDP.
+
+    For each call to a rating module, the following metrics are sent, in a
+    single datagram:
+
+    * ``<prefix>.<scope>.<module>.duration``: timer, in milliseconds
+    * ``<prefix>.<scope>.<module>.<metric type>.duration``: timer, in
+      milliseconds, estimated from the number of points of the type
+    * ``<prefix>.<scope>.<module>.<metric type>.points``: counter
+    * ``<prefix>.<scope>.<module>.points_per_second``: gauge
+
+    When the scripts of a module are reloaded,
+    ``<prefix>.<module>.scripts_compiled`` and
+    ``<prefix>.<module>.scripts_unchanged`` counters are sent.
+    """
+
+    _INVALID_CHARS = re.compile(r'[^a-zA-Z0-9_\-]')
+
+    def __init__(self, host=None, port=None, prefix=None):
+        self._address = (host or CONF.rating_metrics.statsd_host,
+                         port or CONF.rating_metrics.statsd_port)
+        self._prefix = (CONF.rating_metrics.statsd_prefix
+                        if prefix is None else prefix)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def _name(self, *parts):
+        return '.'.join([self._prefix] + [
+            self._INVALID_CHARS.sub('_', str(part)) for part in parts if part])
+
+    def record(self, module_name, scope_id, duration, points):
+        lines = ['{}:{:.3f}|ms'.format(
+            self._name(scope_id, module_name, 'duration'), duration * 1000)]
+        for metric_type, type_duration in sorted(
+                split_duration(duration, points).items()):
+            lines.append('{}:{:.3f}|ms'.format(
+                self._name(scope_id, module_name, metric_type, 'duration'),
+                type_duration * 1000))
+        for metric_type, count in sorted(points.items()):
+            lines.append('{}:{}|c'.format(
+                self._name(scope_id, module_name, metric_type, 'points'),
+                count))
+        if duration > 0:
+            lines.append('{}:{:.3f}|g'.format(
+                self._name(scope_id, module_name, 'points_per_second'),
+                sum(points.values()) / duration))
+        self._send(lines)
+
+    def record_compilations(self, module_name, compiled, skipped):
+        self._send([
+            '{}:{}|c'.format(
+                self._name(module_name, 'scripts_compiled'), compiled),
+            '{}:{}|c'.format(
+                self._name(module_name, 'scripts_unchanged'), skipped),
+        ])
+
+    def _send(self, lines):
+        try:
+            self._socket.sendto(
+                '\n'.join(lines).encode('utf-8'), self._address)
+        except (socket.error, OSError) as e:
+            LOG.debug('Could not send rating metrics to statsd: %s', e)
+
+
+class RatingInstrumentation(object):
+    """Measures the calls to rating modules and records them in a sink."""
+
+    def __init__(self, sink):
+        self._sink = sink
+
+    def call(self, module_name, scope_id, method, frames):
+        """Calls a method of a rating module on frames and records it.
+
+        :param module_name: Name of the rating module
+        :param scope_id: Scope being rated, None for quotes
+        :param method: Method to call, ``process_batch`` or ``quote``
+        :param frames: Frames to pass to the method
+        """
+        points = count_points(frames)
+        start = time.monotonic()
+        output = method(frames)
+        self._sink.record(
+            module_name, scope_id or '', time.monotonic() - start, points)
+        return output
+
+    def record_compilations(self, module_name, compiled, skipped):
+        """Records a reload of the scripts of a rating module."""
+        self._sink.record_compilations(module_name, compiled, skipped)
+
+    def flush(self):
+        self._sink.flush()
+
+
+_instrumentation = None
+_instrumentation_lock = threading.Lock()
+
+
+def get_instrumentation():
+    """Returns the RatingInstrumentation of the process.
+
+    None is returned if no sink is configured.
+    """
+    global _instrumentation
+    if not CONF.rating_metrics.sink:
+        return None
+    with _instrumentation_lock:
+        if _instrumentation is None:
+            sink = driver.DriverManager(
+                SINKS_NAMESPACE,
+                CONF.rating_metrics.sink,
+                invoke_on_load=True).driver
+            _instrumentation = RatingInstrumentation(sink)
+        return _instrumentation
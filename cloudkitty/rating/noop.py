@@ -33,6 +33,18 @@ class Noop(rating.RatingProcessorBase):
     def priority(self):
         return 1
 
+    @classmethod
+    def is_enabled(cls):
+        return True
+
+    @classmethod
+    def get_priority(cls):
+        return 1
+
+    @classmethod
+    def get_rules_version(cls):
+        return 0
+
     def reload_config(self):
         pass
 
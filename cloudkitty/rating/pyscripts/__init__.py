@@ -13,9 +13,65 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 #
+from oslo_config import cfg
+from oslo_log import log
+
 from cloudkitty import rating
+from cloudkitty.rating import instrumentation
 from cloudkitty.rating.pyscripts.controllers import root as root_api
 from cloudkitty.rating.pyscripts.db import api as pyscripts_db_api
+from cloudkitty.rating.pyscripts import executor
+
+
+PYSCRIPTS_OPTS = 'pyscripts'
+pyscripts_opts = [
+    cfg.StrOpt(
+        'execution_backend',
+        default='inline',
+        choices=['inline', 'subprocess'],
+        help='Where scripts are executed. "inline" runs them in the '
+             'processor, "subprocess" runs them in a pool of worker '
+             'processes. With "subprocess", the frames of a scope are all '
+             'rated by the same worker when entry-point scripts are used, '
+             'and the state of these scripts is lost when the workers are '
+             'restarted.',
+    ),
+    cfg.IntOpt(
+        'workers',
+        default=2,
+        min=1,
+        help='Number of worker processes of the "subprocess" backend.',
+    ),
+    cfg.IntOpt(
+        'cpu_time_limit',
+        default=0,
+        min=0,
+        help='Maximum CPU time of a script for a single frame, in seconds. '
+             'Only used by the "subprocess" backend. 0 means unlimited.',
+    ),
+    cfg.IntOpt(
+        'memory_limit',
+        default=0,
+        min=0,
+        help='Maximum address space of each worker process, in MiB. Only '
+             'used by the "subprocess" backend. 0 means unlimited.',
+    ),
+    cfg.IntOpt(
+        'timeout',
+        default=600,
+        min=0,
+        help='Maximum time spent rating a single frame, in seconds. Frames '
+             'are split in one chunk per worker process, a chunk of n frames '
+             'may take up to n times this value. The worker pool is '
+             'restarted if it is exceeded. Only used by the "subprocess" '
+             'backend. 0 means unlimited.',
+    ),
+]
+cfg.CONF.register_opts(pyscripts_opts, PYSCRIPTS_OPTS)
+
+CONF = cfg.CONF
+
+LOG = log.getLogger(__name__)
 
 
 class PyScripts(rating.RatingProcessorBase):
@@ -34,38 +90,68 @@ class PyScripts(rating.RatingProcessorBase):
 
     def __init__(self, tenant_id=None):
         self._scripts = {}
+        # Namespaces of the entry-point scripts, by script UUID
+        self._modules = {}
+        # Number of scripts compiled and of compilations skipped because
+        # the script didn't change, since the module was created
+        self.compiled_count = 0
+        self.skipped_compile_count = 0
         self.load_scripts_in_memory()
         super(PyScripts, self).__init__(tenant_id)
 
     def load_scripts_in_memory(self):
+        """Loads new scripts and updates modified ones.
+
+        Scripts are identified by their UUID, and are only compiled again
+        when their checksum changes.
+        """
         db = pyscripts_db_api.get_instance()
-        scripts_uuid_list = db.list_scripts()
+        checksums = db.list_checksums()
         # Purge old entries
-        scripts_to_purge = []
-        for script_uuid in self._scripts.keys():
-            if script_uuid not in scripts_uuid_list:
-                scripts_to_purge.append(script_uuid)
-        for script_uuid in scripts_to_purge:
+        for script_uuid in set(self._scripts) - set(checksums):
             del self._scripts[script_uuid]
+            self._modules.pop(script_uuid, None)
         # Load or update script
-        for script_uuid in scripts_uuid_list:
+        compiled = skipped = 0
+        for script_uuid, checksum in checksums.items():
+            script = self._scripts.get(script_uuid)
+            if script is not None and script['checksum'] == checksum:
+                skipped += 1
+                continue
             script_db = db.get_script(uuid=script_uuid)
             name = script_db.name
-            checksum = script_db.checksum
-            if name not in self._scripts:
-                self._scripts[script_uuid] = {}
-            script = self._scripts[script_uuid]
-            # NOTE(sheeprine): We're doing this the easy way, we might want to
-            # store the context and call functions in future
-            if script.get(checksum, '') != checksum:
-                code = compile(
-                    script_db.data,
-                    '<PyScripts: {name}>'.format(name=name),
-                    'exec')
-                script.update({
-                    'name': name,
-                    'code': code,
-                    'checksum': checksum})
+            code = compile(
+                script_db.data,
+                '<PyScripts: {name}>'.format(name=name),
+                'exec')
+            # Entry-point scripts are executed before being registered, so
+            # that a failing script is loaded again on the next reload
+            self._load_module(script_uuid, code)
+            self._scripts[script_uuid] = {
+                'name': name,
+                'code': code,
+                'checksum': script_db.checksum}
+            compiled += 1
+        self.compiled_count += compiled
+        self.skipped_compile_count += skipped
+        LOG.debug('Loaded %d PyScripts: %d compiled, %d unchanged.',
+                  compiled + skipped, compiled, skipped)
+        instr = instrumentation.get_instrumentation()
+        if instr is not None:
+            instr.record_compilations(self.module_name, compiled, skipped)
+
+    def _load_module(self, script_uuid, code):
+        """Executes an entry-point script, and keeps its namespace.
+
+        As scripts are only compiled again when they are modified, the state
+        of the script is kept until then. With the "subprocess" backend,
+        scripts are only executed in the worker processes.
+        """
+        if (CONF.pyscripts.execution_backend == 'inline'
+                and executor.uses_entry_points(code)):
+            self._modules[script_uuid] = executor.load_module(code)
+        else:
+            self._modules.pop(script_uuid, None)
 
     def reload_config(self):
         """Reload the module's configuration.
@@ -73,12 +159,37 @@ class PyScripts(rating.RatingProcessorBase):
         """
         self.load_scripts_in_memory()
 
+    @classmethod
+    def get_rules_version(cls):
+        db = pyscripts_db_api.get_instance()
+        return tuple(sorted(db.list_checksums().items()))
+
     def start_script(self, code, data):
         context = {'data': data}
         exec(code, context)  # nosec
         return data
 
+    def process_batch(self, frames):
+        if CONF.pyscripts.execution_backend == 'subprocess':
+            return executor.get_executor(
+                CONF.pyscripts.workers,
+                cpu_time_limit=CONF.pyscripts.cpu_time_limit,
+                memory_limit=CONF.pyscripts.memory_limit,
+                timeout=CONF.pyscripts.timeout,
+            ).execute(
+                [(script['checksum'], script['code'])
+                 for script in self._scripts.values()],
+                frames,
+                scope_id=self._tenant_id)
+        frames = list(frames)
+        for script_uuid, script in self._scripts.items():
+            module = self._modules.get(script_uuid)
+            if module is not None:
+                frames = executor.call_entry_points(module, frames)
+            else:
+                frames = [self.start_script(script['code'], frame)
+                          for frame in frames]
+        return frames
+
     def process(self, data):
-        for script in self._scripts.values():
-            data = self.start_script(script['code'], data)
-        return data
+        return self.process_batch([data])[0]
@@ -75,6 +75,12 @@ class PyScripts(object):
 
         """
 
+    @abc.abstractmethod
+    def list_checksums(self):
+        """Return a dict mapping the UUID of every script to its checksum.
+
+        """
+
     @abc.abstractmethod
     def create_script(self, name, data):
         """Create a new script.
@@ -57,6 +57,14 @@ class PyScripts(api.PyScripts):
             models.PyScriptsScript.script_id)
         return [uuid[0] for uuid in res]
 
+    def list_checksums(self):
+        session = db.get_session()
+        q = session.query(models.PyScriptsScript)
+        res = q.values(
+            models.PyScriptsScript.script_id,
+            models.PyScriptsScript._checksum)
+        return {uuid: checksum for uuid, checksum in res}
+
     def create_script(self, name, data):
         session = db.get_session()
         try:
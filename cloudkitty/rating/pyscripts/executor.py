@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Objectif Libre
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+"""Execution of PyScripts."""
+import contextlib
+import marshal
+import math
+import multiprocessing
+import os
+import pickle
+import resource
+import signal
+import threading
+import time
+import zlib
+
+from oslo_log import log
+
+
+LOG = log.getLogger(__name__)
+
+# Compiled scripts of a worker process, by checksum
+_CODE_CACHE = {}
+
+# Namespaces of the entry-point scripts of a worker process, by
+# (scope_id, checksum). As with the inline backend, each scope has its own
+# state.
+_MODULE_CACHE = {}
+
+# Scripts defining this variable are executed once when they are loaded, and
+# their process(frame) / process_batch(frames) functions are called instead.
+ENTRY_POINTS_MARKER = 'USE_ENTRY_POINTS'
+
+
+class ScriptTimeout(Exception):
+    """Raised when a script exceeds its CPU time or wall-clock limit."""
+
+
+def uses_entry_points(code):
+    """Returns True if a compiled script uses the entry-point format."""
+    return ENTRY_POINTS_MARKER in code.co_names
+
+
+def load_module(code):
+    """Executes an entry-point script and returns its namespace.
+
+    :raises ValueError: The script does not define a process function.
+    """
+    name = code.co_filename
+    module = {'__name__': name}
+    exec(code, module)  # nosec
+    if not module.get(ENTRY_POINTS_MARKER):
+        raise ValueError('{} must set {} to True'.format(
+            name, ENTRY_POINTS_MARKER))
+    if not callable(module.get('process')):
+        raise ValueError(
+            '{} must define a process(frame) function'.format(name))
+    return module
+
+
+def call_entry_points(module, frames):
+    """Rates frames with the functions of an entry-point script.
+
+    process_batch(frames) is used if the script defines it, process(frame)
+    is called for each frame otherwise. If process returns None, the frame
+    is expected to have been modified in place.
+    """
+    process_batch = module.get('process_batch')
+    if callable(process_batch):
+        return list(process_batch(frames))
+    output = []
+    for frame in frames:
+        result = module['process'](frame)
+        output.append(frame if result is None else result)
+    return output
+
+
+def _on_cpu_time_limit(signum, frame):
+    raise ScriptTimeout('CPU time limit exceeded')
+
+
+def _init_worker(memory_limit):
+    # Workers must not react to the signals sent to the cloudkitty process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGXCPU, _on_cpu_time_limit)
+    if memory_limit:
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        limit = memory_limit * 1024 * 1024
+        if hard != resource.RLIM_INFINITY:
+            limit = min(limit, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+@contextlib.contextmanager
+def _cpu_time_limit(seconds):
+    """Limits the CPU time of the current process for a given duration.
+
+    RLIMIT_CPU applies to the whole lifetime of the process, so the limit is
+    set relatively to the CPU time consumed so far.
+    """
+    if not seconds:
+        yield
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    limit = int(math.ceil(usage.ru_utime + usage.ru_stime + seconds))
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (limit, hard))
+    try:
+        yield
+    finally:
+        resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _get_script(scope_id, checksum, marshalled_code, cpu_time_limit):
+    code = _CODE_CACHE.get(checksum)
+    if code is None:
+        code = _CODE_CACHE[checksum] = marshal.loads(marshalled_code)  # nosec
+    if not uses_entry_points(code):
+        return code, None
+    module = _MODULE_CACHE.get((scope_id, checksum))
+    if module is None:
+        with _cpu_time_limit(cpu_time_limit):
+            module = load_module(code)
+        _MODULE_CACHE[(scope_id, checksum)] = module
+    return code, module
+
+
+def _execute(scope_id, scripts, payload, cpu_time_limit):
+    """Runs scripts on serialized frames of a scope, in a worker process."""
+    frames = pickle.loads(payload)  # nosec
+    # The CPU time limit is given for a single frame
+    chunk_time_limit = cpu_time_limit * max(len(frames), 1)
+    used = set()
+    for checksum, marshalled_code in scripts:
+        used.add(checksum)
+        code, module = _get_script(
+            scope_id, checksum, marshalled_code, cpu_time_limit)
+        with _cpu_time_limit(chunk_time_limit):
+            if module is not None:
+                frames = call_entry_points(module, frames)
+                continue
+            for frame in frames:
+                context = {'data': frame}
+                exec(code, context)  # nosec
+    # Forget the scripts which have been updated or deleted
+    for checksum in set(_CODE_CACHE) - used:
+        del _CODE_CACHE[checksum]
+    for key in [key for key in _MODULE_CACHE if key[1] not in used]:
+        del _MODULE_CACHE[key]
+    return pickle.dumps(frames, pickle.HIGHEST_PROTOCOL)
+
+
+def _split(frames, count):
+    """Splits frames in count contiguous chunks of similar sizes."""
+    size, extra = divmod(len(frames), count)
+    chunks = []
+    start = 0
+    for i in range(count):
+        end = start + size + (1 if i < extra else 0)
+        chunks.append(frames[start:end])
+        start = end
+    return chunks
+
+
+class SubprocessExecutor(object):
+    """Runs PyScripts in long-lived worker processes.
+
+    Frames are pickled and sent to the workers, which execute the scripts
+    with the same ``data`` contract as the inline execution and send the
+    frames back. A slow script does not hold the GIL of the cloudkitty
+    process.
+
+    Frames of scripts without entry points are split in one chunk per
+    worker, and the chunks are rated in parallel. Entry-point scripts are
+    loaded once per scope and worker, and keep their state between calls:
+    all the frames of a scope are then rated by the same worker.
+
+    :param workers: Number of worker processes
+    :type workers: int
+    :param cpu_time_limit: CPU time limit of a single script, in seconds.
+                           0 means unlimited.
+    :type cpu_time_limit: int
+    :param memory_limit: Address space limit of each worker process, in MiB.
+                         0 means unlimited.
+    :type memory_limit: int
+    :param timeout: Wall-clock limit for rating a frame, in seconds. A chunk
+                    of n frames may take up to n times this value. 0 means
+                    unlimited. The workers are restarted if it is exceeded.
+    :type timeout: int
+    """
+
+    def __init__(self, workers, cpu_time_limit=0, memory_limit=0, timeout=0):
+        self._workers = workers
+        self._cpu_time_limit = cpu_time_limit
+        self._memory_limit = memory_limit
+        self._timeout = timeout
+        # Each worker has a pool of its own, so that frames can be sent to a
+        # given worker
+        self._pools = [None] * workers
+        self._lock = threading.Lock()
+
+    def _get_pool(self, index):
+        with self._lock:
+            pool = self._pools[index]
+            if pool is None:
+                # spawn avoids inheriting the state of the
+                # cloudkitty process (database connections, locks...)
+                context = multiprocessing.get_context('spawn')
+                pool = self._pools[index] = context.Pool(
+                    1,
+                    initializer=_init_worker,
+                    initargs=(self._memory_limit, ))
+                # Waits for the worker to be started, so that the startup
+                # time is not included in the timeout
+                pool.apply(os.getpid)
+            return pool
+
+    def _reset_pool(self, index, pool):
+        with self._lock:
+            if self._pools[index] is pool:
+                self._pools[index] = None
+        pool.terminate()
+
+    def _get_worker(self, scope_id):
+        """Returns the index of the worker rating the frames of a scope."""
+        return zlib.crc32(str(scope_id).encode('utf-8')) % self._workers
+
+    def execute(self, scripts, frames, scope_id=None):
+        """Runs scripts on frames in the worker processes.
+
+        :param scripts: (checksum, code object) tuples, in execution order
+        :type scripts: list of tuple
+        :param frames: Frames to pass to the scripts
+        :type frames: list
+        :param scope_id: Scope the frames belong to. Entry-point scripts have
+                         a state per scope.
+        :type scope_id: str
+        :returns: The frames, as modified by the scripts
+        """
+        frames = list(frames)
+        if any(uses_entry_points(code) for _, code in scripts):
+            chunks = [(self._get_worker(scope_id), frames)]
+        else:
+            chunks = enumerate(
+                _split(frames, max(min(self._workers, len(frames)), 1)))
+        scripts = [(checksum, marshal.dumps(code))
+                   for checksum, code in scripts]
+        chunks = [(index, self._get_pool(index), chunk)
+                  for index, chunk in chunks]
+        start = time.monotonic()
+        results = []
+        for index, pool, chunk in chunks:
+            payload = pickle.dumps(chunk, pickle.HIGHEST_PROTOCOL)
+            results.append((len(chunk), pool.apply_async(
+                _execute,
+                (scope_id, scripts, payload, self._cpu_time_limit))))
+
+        output = []
+        try:
+            for count, result in results:
+                timeout = None
+                if self._timeout:
+                    # Chunks are rated in parallel since start
+                    timeout = max(start + self._timeout * max(count, 1)
+                                  - time.monotonic(), 0)
+                output += pickle.loads(result.get(timeout))  # nosec
+        except multiprocessing.TimeoutError:
+            LOG.warning('PyScripts took more than %d seconds to rate a '
+                        'frame, restarting the worker processes.',
+                        self._timeout)
+            for index, pool, _ in chunks:
+                self._reset_pool(index, pool)
+            raise ScriptTimeout(
+                'Timeout of {}s exceeded'.format(self._timeout))
+        return output
+
+    def close(self):
+        with self._lock:
+            pools, self._pools = self._pools, [None] * self._workers
+        for pool in pools:
+            if pool is not None:
+                pool.terminate()
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_executor(workers, cpu_time_limit=0, memory_limit=0, timeout=0):
+    """Returns the SubprocessExecutor of the current process.
+
+    A single pool is shared by all the PyScripts instances of a process.
+    """
+    global _executor, _executor_pid
+    with _executor_lock:
+        # A pool inherited through fork can't be used
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = SubprocessExecutor(
+                workers, cpu_time_limit, memory_limit, timeout)
+            _executor_pid = os.getpid()
+        return _executor
@@ -87,6 +87,30 @@ class BaseStorage(object):
         :rtype: dict
        """
 
+    def iter_dataframes(self, begin=None, end=None,
+                        filters=None,
+                        metric_types=None):
+        """Yields all dataframes of a period, in chronological order.
+
+        Backends may override this so that the whole period is never held in
+        memory. The default implementation relies on ``retrieve``.
+
+        :param begin: Start date
+        :type begin: datetime
+        :param end: End date
+        :type end: datetime
+        :param filters: Attributes to filter on. ex: {'flavor_id': '42'}
+        :type filters: dict
+        :param metric_types: Metric type to filter on.
+        :type metric_types: str or list
+        :rtype: iterator of cloudkitty.dataframe.DataFrame
+        """
+        return iter(self.retrieve(
+            begin=begin, end=end,
+            filters=filters,
+            metric_types=metric_types,
+            paginate=False)['dataframes'])
+
     @abc.abstractmethod
     def delete(self, begin=None, end=None, filters=None):
         """Deletes all data from for the given period and filters.
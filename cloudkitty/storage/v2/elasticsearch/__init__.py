@@ -53,6 +53,20 @@ elasticsearch_storage_opts = [
                "should be kept alive.",
                advanced=True,
                default=30, min=0, max=300),
+    cfg.IntOpt('bulk_concurrency',
+               help='Maximal number of bulk requests sent to Elasticsearch at '
+               'the same time. Set to 1 to send them sequentially.',
+               default=4, min=1),
+    cfg.IntOpt('bulk_max_retries',
+               help='Number of times documents which were rejected by '
+               'Elasticsearch because it was overloaded are sent again.',
+               default=3, min=0),
+    cfg.FloatOpt('bulk_target_latency',
+                 help='Duration (in seconds) of a bulk request above which '
+                 'the number of documents per request is decreased. It is '
+                 'increased back when requests take less than half of it.',
+                 advanced=True,
+                 default=1.0, min=0.01),
 ]
 
 CONF.register_opts(elasticsearch_storage_opts, ELASTICSEARCH_STORAGE_GROUP)
@@ -99,7 +113,11 @@ class ElasticsearchStorage(v2_storage.BaseStorage):
             CONF.storage_elasticsearch.host,
             CONF.storage_elasticsearch.index_name,
             "_doc",
-            verify=verify)
+            verify=verify,
+            bulk_concurrency=CONF.storage_elasticsearch.bulk_concurrency,
+            bulk_max_retries=CONF.storage_elasticsearch.bulk_max_retries,
+            bulk_target_latency=(
+                CONF.storage_elasticsearch.bulk_target_latency))
 
     def init(self):
         r = self._conn.get_index()
@@ -12,16 +12,212 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 #
+import collections
 import itertools
+import threading
+import time
 
+import futurist
 from oslo_log import log
 import requests
+from requests import adapters
 
 from cloudkitty.storage.v2.elasticsearch import exceptions
 from cloudkitty.utils import json
 
 LOG = log.getLogger(__name__)
 
+# Statuses of the bulk items which are worth retrying: the node was
+# overloaded or unavailable
+RETRYABLE_STATUSES = frozenset((429, 502, 503, 504))
+
+_INDEX_INSTRUCTION = json.dumps({'index': {}})
+
+
+class BulkWriter(object):
+    """Indexes documents in Elasticsearch through the bulk API.
+
+    Documents are serialized to NDJSON as they are added. Once a batch is
+    full, it is sent by one of ``concurrency`` threads sharing a pooled
+    session. Only the documents rejected with a transient error are sent
+    again, with an exponential backoff. The size of the batches is halved
+    when a request is slower than ``target_latency`` or rejected, and grows
+    back up to ``chunk_size`` when requests are fast.
+
+    :param session: Session used to send the bulk requests
+    :type session: requests.Session
+    :param url: URL of the bulk API
+    :type url: str
+    :param chunk_size: Maximal number of documents per bulk request
+    :type chunk_size: int
+    :param concurrency: Maximal number of concurrent bulk requests
+    :type concurrency: int
+    :param max_retries: Number of times failed documents are sent again
+    :type max_retries: int
+    :param target_latency: Duration of a bulk request, in seconds, above
+                           which batches are made smaller
+    :type target_latency: float
+    :param autocommit: Set to False to only send batches on flush
+    :type autocommit: bool
+    """
+
+    def __init__(self, session, url, chunk_size=5000, concurrency=1,
+                 max_retries=3, target_latency=1.0, autocommit=True):
+        self._session = session
+        self._url = url
+        self._max_chunk_size = chunk_size
+        self._min_chunk_size = max(1, chunk_size // 16)
+        self._chunk_size = chunk_size
+        self._concurrency = concurrency
+        self._max_retries = max_retries
+        self._target_latency = target_latency
+        self._autocommit = autocommit
+        self._lock = threading.Lock()
+        self._batch = []
+        # Sealed batches which have not been submitted yet
+        self._batches = []
+        self._pending = collections.deque()
+        self._executor = None
+        self._last_dates = (None, None, None, None)
+
+    @property
+    def chunk_size(self):
+        """Current number of documents per bulk request."""
+        return self._chunk_size
+
+    def _dates(self, start, end):
+        last_start, last_end, start_iso, end_iso = self._last_dates
+        if start is not last_start or end is not last_end:
+            start_iso, end_iso = start.isoformat(), end.isoformat()
+            self._last_dates = (start, end, start_iso, end_iso)
+        return start_iso, end_iso
+
+    def add_point(self, point, type_, start, end):
+        """Serializes a point and adds it to the current batch."""
+        start, end = self._dates(start, end)
+        self.add(json.dumps({
+            'start': start,
+            'end': end,
+            'type': type_,
+            'unit': point.unit,
+            'qty': float(point.qty),
+            'price': float(point.price),
+            'groupby': point.groupby,
+            'metadata': point.metadata,
+        }))
+
+    def add(self, doc):
+        """Adds a serialized document to the current batch."""
+        self._batch.append(doc)
+        if len(self._batch) >= self._chunk_size:
+            self._seal()
+            if self._autocommit:
+                self._submit()
+
+    def _seal(self):
+        if self._batch:
+            self._batches.append(self._batch)
+            self._batch = []
+
+    def _adapt_chunk_size(self, latency, throttled):
+        with self._lock:
+            if throttled or latency > self._target_latency:
+                size = max(self._min_chunk_size, self._chunk_size // 2)
+            elif latency < self._target_latency / 2:
+                size = min(self._max_chunk_size,
+                           self._chunk_size + self._chunk_size // 4 + 1)
+            else:
+                return
+            if size != self._chunk_size:
+                LOG.debug('Bulk request took {:.3f}s, using batches of {} '
+                          'documents'.format(latency, size))
+                self._chunk_size = size
+
+    def _post(self, docs):
+        """Sends a bulk request and returns the documents to send again."""
+        data = ''.join(
+            _INDEX_INSTRUCTION + '\n' + doc + '\n' for doc in docs)
+        start = time.monotonic()
+        r = self._session.post(
+            self._url, data=data,
+            headers={'Content-Type': 'application/x-ndjson'})
+        latency = time.monotonic() - start
+
+        if r.status_code in RETRYABLE_STATUSES:
+            self._adapt_chunk_size(latency, True)
+            return docs
+        if r.status_code < 200 or r.status_code >= 300:
+            raise exceptions.InvalidStatusCode(
+                200, r.status_code, r.text, None)
+
+        output = r.json()
+        LOG.debug('Indexing {} documents took {}ms'.format(
+            len(docs), output.get('took')))
+        retry = []
+        rejected = []
+        if output.get('errors'):
+            for doc, item in zip(docs, output['items']):
+                result = item.get('index', {})
+                if 'error' not in result:
+                    continue
+                if result.get('status') in RETRYABLE_STATUSES:
+                    retry.append(doc)
+                else:
+                    rejected.append(result['error'])
+        if rejected:
+            LOG.error('Elasticsearch rejected {} documents. First error: '
+                      '{}'.format(len(rejected), rejected[0]))
+        self._adapt_chunk_size(latency, bool(retry))
+        return retry
+
+    def _write(self, docs):
+        for attempt in range(self._max_retries + 1):
+            if attempt:
+                time.sleep(min(2 ** (attempt - 1), 30))
+                LOG.debug('Retrying to index {} documents'.format(len(docs)))
+            docs = self._post(docs)
+            if not docs:
+                return
+        raise exceptions.BulkIndexError(len(docs), self._max_retries)
+
+    def _submit(self):
+        batches, self._batches = self._batches, []
+        for docs in batches:
+            if self._concurrency <= 1:
+                self._write(docs)
+                continue
+            if self._executor is None:
+                self._executor = futurist.ThreadPoolExecutor(
+                    max_workers=self._concurrency)
+            # Bounds the number of batches held in memory
+            while len(self._pending) >= self._concurrency:
+                self._pending.popleft().result()
+            self._pending.append(self._executor.submit(self._write, docs))
+
+    def flush(self):
+        """Sends the remaining documents and waits for all pending requests.
+
+        The first error encountered by a request is raised once all requests
+        are done.
+        """
+        self._seal()
+        error = None
+        try:
+            self._submit()
+        finally:
+            while self._pending:
+                try:
+                    self._pending.popleft().result()
+                except Exception as e:
+                    error = error or e
+        if error is not None:
+            raise error
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
 
 class ElasticsearchClient(object):
     """Class used to ease interaction with Elasticsearch.
@@ -34,13 +230,26 @@ class ElasticsearchClient(object):
     :param scroll_duration: Defaults to 60. Duration, in seconds, for which
                             search contexts should be kept alive
     :type scroll_duration: int
+    :param bulk_concurrency: Defaults to 1. Maximal number of concurrent
+                             bulk requests.
+    :type bulk_concurrency: int
+    :param bulk_max_retries: Defaults to 3. Number of times documents which
+                             failed to be indexed are sent again.
+    :type bulk_max_retries: int
+    :param bulk_target_latency: Defaults to 1. Duration of a bulk request,
+                                in seconds, above which batches are made
+                                smaller.
+    :type bulk_target_latency: float
     """
 
     def __init__(self, url, index_name, mapping_name,
                  verify=True,
                  autocommit=True,
                  chunk_size=5000,
-                 scroll_duration=60):
+                 scroll_duration=60,
+                 bulk_concurrency=1,
+                 bulk_max_retries=3,
+                 bulk_target_latency=1.0):
         self._url = url.strip('/')
         self._index_name = index_name.strip('/')
         self._mapping_name = mapping_name.strip('/')
@@ -49,13 +258,27 @@ class ElasticsearchClient(object):
         self._scroll_duration = str(scroll_duration) + 's'
         self._scroll_params = {'scroll': self._scroll_duration}
 
-        self._docs = []
         self._scroll_ids = set()
 
         self._sess = requests.Session()
+        # One connection per concurrent bulk request
+        adapter = adapters.HTTPAdapter(
+            pool_maxsize=max(adapters.DEFAULT_POOLSIZE, bulk_concurrency))
+        self._sess.mount('http://', adapter)
+        self._sess.mount('https://', adapter)
         self._verify = self._sess.verify = verify
         self._sess.headers = {'Content-Type': 'application/json'}
 
+        self._writer = BulkWriter(
+            self._sess,
+            '/'.join((self._url, self._index_name, self._mapping_name,
+                      '_bulk')),
+            chunk_size=chunk_size,
+            concurrency=bulk_concurrency,
+            max_retries=bulk_max_retries,
+            target_latency=bulk_target_latency,
+            autocommit=autocommit)
+
     @staticmethod
     def _log_query(url, query, response):
         message = 'Query on {} with body "{}" took {}ms'.format(
@@ -263,9 +486,7 @@ class ElasticsearchClient(object):
 
     def commit(self):
         """Index all documents"""
-        while self._docs:
-            self.bulk_index(self._docs[:self._chunk_size])
-            self._docs = self._docs[self._chunk_size:]
+        self._writer.flush()
 
     def add_point(self, point, type_, start, end):
         """Append a point to the client.
@@ -275,18 +496,7 @@ class ElasticsearchClient(object):
         :param type_: type of the DataPoint
         :type type_: str
         """
-        self._docs.append({
-            'start': start,
-            'end': end,
-            'type': type_,
-            'unit': point.unit,
-            'qty': point.qty,
-            'price': point.price,
-            'groupby': point.groupby,
-            'metadata': point.metadata,
-        })
-        if self._autocommit and len(self._docs) >= self._chunk_size:
-            self.commit()
+        self._writer.add_point(point, type_, start, end)
 
     def _get_chunk_size(self, offset, limit, paginate):
         if paginate and offset + limit < self._chunk_size:
@@ -30,3 +30,10 @@ class IndexDoesNotExist(BaseElasticsearchException):
         super(IndexDoesNotExist, self).__init__(
             "Elasticsearch index {} does not exist".format(index_name)
         )
+
+
+class BulkIndexError(BaseElasticsearchException):
+    def __init__(self, count, retries):
+        super(BulkIndexError, self).__init__(
+            "{} documents could not be indexed after {} retries".format(
+                count, retries))
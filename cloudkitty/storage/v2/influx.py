@@ -12,8 +12,18 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 #
+import calendar
+import collections
 import datetime
+import gzip
+import heapq
+import io
+import itertools
+import json
+import threading
+import time
 
+import futurist
 import influxdb
 from oslo_config import cfg
 from oslo_log import log
@@ -57,6 +67,49 @@ influx_storage_opts = [
         help='Path of the CA certificate to trust for HTTPS connections',
         default=None
     ),
+    cfg.IntOpt(
+        'chunk_size',
+        help='Number of points sent to InfluxDB in a single write request',
+        default=500,
+        min=1,
+    ),
+    cfg.BoolOpt(
+        'use_gzip',
+        help='Set to true to compress write requests with gzip. Defaults '
+        'to False',
+        default=False,
+    ),
+    cfg.IntOpt(
+        'write_concurrency',
+        help='Maximal number of write requests sent to InfluxDB at the same '
+        'time. Set to 1 to send them sequentially',
+        default=4,
+        min=1,
+    ),
+    cfg.IntOpt(
+        'query_chunk_size',
+        help='Number of points per chunk of the responses of InfluxDB when '
+        'retrieving dataframes',
+        default=10000,
+        min=1,
+    ),
+    cfg.IntOpt(
+        'page_counts_cache_ttl',
+        help='Time in seconds during which the number of points of each '
+        'period is kept for paginated requests, so that reading the '
+        'following pages does not count the points again. 0 disables the '
+        'cache',
+        default=60,
+        min=0,
+    ),
+    cfg.BoolOpt(
+        'use_rollups',
+        help='Set to true to maintain totals by scope and metric type, by '
+        'collect period and by day, alongside the rated data. Summaries '
+        'which are only grouped by scope and metric type are computed from '
+        'these totals. Defaults to False',
+        default=False,
+    ),
 ]
 
 CONF.register_opts(influx_storage_opts, INFLUX_STORAGE_GROUP)
@@ -70,23 +123,275 @@ def _sanitized_groupby(groupby):
     return [g for g in groupby if g not in forbidden] if groupby else []
 
 
+MEASUREMENT = 'dataframes'
+
+# Totals by scope and metric type, for each collect period
+ROLLUP_MEASUREMENT = 'dataframes_rollup'
+
+# Totals by scope and metric type, for each day (UTC)
+DAILY_ROLLUP_MEASUREMENT = 'dataframes_rollup_1d'
+
+# Holds the time from which rollups are complete
+ROLLUP_STATE_MEASUREMENT = 'dataframes_rollup_state'
+
+# Fields set on every point, which can't be overridden by metadata
+_RESERVED_FIELDS = frozenset(
+    ('qty', 'price', 'unit', 'groupby', 'metadata', PERIOD_FIELD_NAME))
+
+# Maximal number of queries for which the points of each period are counted
+_PAGE_COUNTS_CACHE_SIZE = 128
+
+# Level 1 is several times faster than the default level, and line protocol
+# compresses well enough with it
+_GZIP_LEVEL = 1
+
+
+def _escape_key(key):
+    """Escapes a measurement, a tag key, a tag value or a field key."""
+    return str(key).replace('\\', '\\\\').replace(' ', '\\ ').replace(
+        ',', '\\,').replace('=', '\\=').replace('\n', '\\n')
+
+
+def _format_field_value(value):
+    """Formats a field value. Returns None for values which can't be set."""
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        value = value.decode('utf-8')
+    if isinstance(value, six.string_types):
+        return '"{}"'.format(value.replace('\\', '\\\\').replace(
+            '"', '\\"').replace('\n', '\\n'))
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, six.integer_types):
+        return '{}i'.format(value)
+    try:
+        return repr(float(value))
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def _to_nanoseconds(timestamp):
+    """Converts a datetime to nanoseconds since epoch.
+
+    Naive datetimes are considered to be UTC, as done by the influxdb client.
+    """
+    return (calendar.timegm(timestamp.utctimetuple()) * 10 ** 9
+            + timestamp.microsecond * 1000)
+
+
+def _floor_day(dt):
+    """Returns the start of the UTC day of a datetime."""
+    return tzutils.local_to_utc(dt).replace(
+        hour=0, minute=0, second=0, microsecond=0)
+
+
+def _ceil_day(dt):
+    """Returns the start of the first UTC day not starting before dt."""
+    day = _floor_day(dt)
+    if day < dt:
+        day += datetime.timedelta(days=1)
+    return day
+
+
+class LineProtocolWriter(object):
+    """Writes DataPoints to InfluxDB in the line protocol, by batches.
+
+    Points are serialized straight to line protocol into a buffer, which is
+    sealed into a batch once it contains ``chunk_size`` points. Batches are
+    optionally gzip-compressed and written by up to ``concurrency`` threads
+    sharing the pooled HTTP session of the influxdb client.
+
+    :param client: Client used to send the write requests
+    :type client: influxdb.InfluxDBClient
+    :param database: Database to write to
+    :type database: str
+    :param retention_policy: Retention policy of the written points
+    :type retention_policy: str
+    :param chunk_size: Number of points per write request
+    :type chunk_size: int
+    :param use_gzip: Set to True to compress write requests
+    :type use_gzip: bool
+    :param concurrency: Maximal number of concurrent write requests
+    :type concurrency: int
+    :param autocommit: Set to False to only send batches on flush
+    :type autocommit: bool
+    """
+
+    def __init__(self, client, database, retention_policy, chunk_size=500,
+                 use_gzip=False, concurrency=1, autocommit=True):
+        self._client = client
+        self._params = {'db': database, 'rp': retention_policy}
+        self._headers = {'Content-Type': 'application/octet-stream'}
+        if use_gzip:
+            self._headers['Content-Encoding'] = 'gzip'
+        self._chunk_size = chunk_size
+        self._use_gzip = use_gzip
+        self._concurrency = concurrency
+        self._autocommit = autocommit
+        self._buffer = io.StringIO()
+        self._buffered = 0
+        # Sealed batches which have not been submitted yet
+        self._batches = []
+        self._pending = collections.deque()
+        self._executor = None
+        self._keys = {}
+        self._last_time = (None, None)
+
+    def _key(self, key):
+        escaped = self._keys.get(key)
+        if escaped is None:
+            escaped = self._keys[key] = _escape_key(key)
+        return escaped
+
+    def _timestamp(self, start):
+        last_start, timestamp = self._last_time
+        if start is not last_start:
+            timestamp = str(_to_nanoseconds(start))
+            self._last_time = (start, timestamp)
+        return timestamp
+
+    def format_point(self, metric_type, start, period, point):
+        """Returns the line protocol representation of a point.
+
+        The line is identical to the one the influxdb client builds from the
+        dict formerly created by ``InfluxClient.append_point``.
+        """
+        key = self._key
+        groupby = point.groupby
+        metadata = point.metadata
+
+        tags = dict(groupby)
+        tags['type'] = metric_type
+        tag_list = [MEASUREMENT]
+        for tag_key in sorted(tags):
+            value = tags[tag_key]
+            value = _escape_key(value) if value is not None else ''
+            if value:
+                tag_list.append(key(tag_key) + '=' + value)
+
+        fields = {k: v for k, v in metadata.items()
+                  if k not in _RESERVED_FIELDS}
+        fields['qty'] = float(point.qty)
+        fields['price'] = float(point.price)
+        fields['unit'] = point.unit
+        # Unfortunately, this seems to be the fastest way: Having several
+        # measurements would imply a high client-side workload, and this allows
+        # us to filter out unrequired keys
+        fields['groupby'] = '|'.join(groupby.keys())
+        fields['metadata'] = '|'.join(metadata.keys())
+        fields[PERIOD_FIELD_NAME] = period
+        field_list = []
+        for field_key in sorted(fields):
+            value = _format_field_value(fields[field_key])
+            if value:
+                field_list.append(key(field_key) + '=' + value)
+
+        return '{} {} {}'.format(
+            ','.join(tag_list), ','.join(field_list), self._timestamp(start))
+
+    def append(self, metric_type, start, period, point):
+        """Adds a point to the current batch."""
+        self._buffer.write(
+            self.format_point(metric_type, start, period, point))
+        self._buffer.write('\n')
+        self._buffered += 1
+        if self._buffered >= self._chunk_size:
+            self._seal()
+            if self._autocommit:
+                self._submit()
+
+    def _seal(self):
+        if not self._buffered:
+            return
+        self._batches.append((self._buffered, self._buffer.getvalue()))
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        self._buffered = 0
+
+    def _write(self, lines):
+        data = lines.encode('utf-8')
+        if self._use_gzip:
+            data = gzip.compress(data, compresslevel=_GZIP_LEVEL)
+        self._client.request(
+            url='write',
+            method='POST',
+            params=self._params,
+            data=data,
+            expected_response_code=204,
+            headers=dict(self._headers),
+        )
+
+    def _submit(self):
+        batches, self._batches = self._batches, []
+        for count, lines in batches:
+            LOG.debug('Pushing {} points to InfluxDB'.format(count))
+            if self._concurrency <= 1:
+                self._write(lines)
+                continue
+            if self._executor is None:
+                self._executor = futurist.ThreadPoolExecutor(
+                    max_workers=self._concurrency)
+            # Bounds the number of batches held in memory
+            while len(self._pending) >= self._concurrency:
+                self._pending.popleft().result()
+            self._pending.append(self._executor.submit(self._write, lines))
+
+    def flush(self):
+        """Writes the remaining points and waits for all pending writes.
+
+        The first error encountered by a write request is raised once all
+        requests are done.
+        """
+        self._seal()
+        error = None
+        try:
+            self._submit()
+        finally:
+            while self._pending:
+                try:
+                    self._pending.popleft().result()
+                except Exception as e:
+                    error = error or e
+        if error is not None:
+            raise error
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
 class InfluxClient(object):
     """Classe used to ease interaction with InfluxDB"""
 
-    def __init__(self, chunk_size=500, autocommit=True, default_period=3600):
+    def __init__(self, chunk_size=None, autocommit=True,
+                 default_period=3600):
         """Creates an InfluxClient object.
 
         :param chunk_size: Size after which points should be pushed.
+                           Defaults to ``[storage_influxdb]/chunk_size``.
         :param autocommit: Set to false to disable autocommit
         :param default_period: Placeholder for the period in cae it can't
                                be determined.
         """
         self._conn = self._get_influx_client()
-        self._chunk_size = chunk_size
+        self._chunk_size = chunk_size or CONF.storage_influxdb.chunk_size
         self._autocommit = autocommit
         self._retention_policy = CONF.storage_influxdb.retention_policy
         self._default_period = default_period
-        self._points = []
+        self._writer = LineProtocolWriter(
+            self._conn,
+            CONF.storage_influxdb.database,
+            self._retention_policy,
+            chunk_size=self._chunk_size,
+            use_gzip=CONF.storage_influxdb.use_gzip,
+            concurrency=CONF.storage_influxdb.write_concurrency,
+            autocommit=autocommit,
+        )
+        # (expiration time, period counts) tuples, by WHERE clause
+        self._page_counts = collections.OrderedDict()
+        self._page_counts_lock = threading.Lock()
 
     @staticmethod
     def _get_influx_client():
@@ -104,6 +409,8 @@ class InfluxClient(object):
             database=CONF.storage_influxdb.database,
             ssl=CONF.storage_influxdb.use_ssl,
             verify_ssl=verify,
+            # One connection per concurrent write request
+            pool_size=max(10, CONF.storage_influxdb.write_concurrency),
         )
 
     def retention_policy_exists(self, database, policy):
@@ -111,13 +418,7 @@ class InfluxClient(object):
         return policy in [pol['name'] for pol in policies]
 
     def commit(self):
-        total_points = len(self._points)
-        if len(self._points) < 1:
-            return
-        LOG.debug('Pushing {} points to InfluxDB'.format(total_points))
-        self._conn.write_points(self._points,
-                                retention_policy=self._retention_policy)
-        self._points = []
+        self._writer.flush()
 
     def append_point(self,
                      metric_type,
@@ -135,29 +436,7 @@ class InfluxClient(object):
         :param point: Point to push
         :type point: dataframe.DataPoint
         """
-        measurement_fields = dict(point.metadata)
-        measurement_fields['qty'] = float(point.qty)
-        measurement_fields['price'] = float(point.price)
-        measurement_fields['unit'] = point.unit
-        # Unfortunately, this seems to be the fastest way: Having several
-        # measurements would imply a high client-side workload, and this allows
-        # us to filter out unrequired keys
-        measurement_fields['groupby'] = '|'.join(point.groupby.keys())
-        measurement_fields['metadata'] = '|'.join(point.metadata.keys())
-
-        measurement_fields[PERIOD_FIELD_NAME] = period
-
-        measurement_tags = dict(point.groupby)
-        measurement_tags['type'] = metric_type
-
-        self._points.append({
-            'measurement': 'dataframes',
-            'tags': measurement_tags,
-            'fields': measurement_fields,
-            'time': start,
-        })
-        if self._autocommit and len(self._points) >= self._chunk_size:
-            self.commit()
+        self._writer.append(metric_type, start, period, point)
 
     @staticmethod
     def _get_filter(key, value):
@@ -187,8 +466,10 @@ class InfluxClient(object):
                                  for mtype in types)
         return ' AND (' + type_query + ')'
 
-    def get_total(self, types, begin, end, groupby=None, filters=None):
-        query = 'SELECT SUM(qty) AS qty, SUM(price) AS price FROM "dataframes"'
+    def _get_total_query(self, types, begin, end, groupby=None, filters=None,
+                         measurement=MEASUREMENT):
+        query = 'SELECT SUM(qty) AS qty, SUM(price) AS price FROM "{}"'.format(
+            measurement)
         query += self._get_time_query(begin, end)
         query += self._get_filter_query(filters)
         query += self._get_type_query(types)
@@ -204,32 +485,153 @@ class InfluxClient(object):
             query += ' GROUP BY ' + groupby_query
 
         query += ';'
-        return self._conn.query(query)
+        return query
+
+    def get_total(self, types, begin, end, groupby=None, filters=None,
+                  measurement=MEASUREMENT):
+        return self._conn.query(self._get_total_query(
+            types, begin, end, groupby, filters, measurement))
+
+    def iter_total(self, types, begin, end, groupby=None, filters=None,
+                   measurement=MEASUREMENT):
+        """Same as get_total, but streams the results.
+
+        Yields (groupby, point) tuples, ``groupby`` being the tags of the
+        series of the point.
+        """
+        return self._iter_series(self._get_total_query(
+            types, begin, end, groupby, filters, measurement))
+
+    def _iter_series(self, query):
+        """Runs a query with a chunked response and yields its points.
+
+        The response is parsed chunk by chunk as it is received, so that
+        only ``query_chunk_size`` points are held in memory at once. Yields
+        (tags, point) tuples, ``tags`` being the tags of the series of the
+        point.
+        """
+        response = self._conn.request(
+            url='query',
+            params={
+                'q': query,
+                'db': CONF.storage_influxdb.database,
+                'chunked': 'true',
+                'chunk_size': CONF.storage_influxdb.query_chunk_size,
+            },
+            stream=True,
+            headers={'Accept': 'application/json'},
+        )
+        try:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                if 'error' in data:
+                    raise influxdb.exceptions.InfluxDBClientError(
+                        data['error'])
+                for result in data.get('results', []):
+                    if 'error' in result:
+                        raise influxdb.exceptions.InfluxDBClientError(
+                            result['error'])
+                    for series in result.get('series', []):
+                        columns = series['columns']
+                        tags = series.get('tags') or {}
+                        for values in series.get('values', []):
+                            yield tags, dict(zip(columns, values))
+        finally:
+            response.close()
+
+    def _iter_query(self, query):
+        """Same as _iter_series, with the tags set on the points."""
+        for tags, point in self._iter_series(query):
+            if tags:
+                point.update(tags)
+            yield point
+
+    def _get_where_query(self, types, filters, begin, end):
+        return (self._get_time_query(begin, end)
+                + self._get_filter_query(filters)
+                + self._get_type_query(types))
+
+    def _get_period_counts(self, where):
+        """Returns the number of points of each period, as (time, count).
+
+        Counts are kept for ``page_counts_cache_ttl`` seconds, so that the
+        points are only counted once when all the pages of a result are read.
+        """
+        ttl = CONF.storage_influxdb.page_counts_cache_ttl
+        now = time.monotonic()
+        if ttl:
+            with self._page_counts_lock:
+                entry = self._page_counts.get(where)
+                if entry is not None and entry[0] > now:
+                    self._page_counts.move_to_end(where)
+                    return entry[1]
+
+        query = 'SELECT COUNT(groupby) FROM "dataframes"' + where
+        query += ' GROUP BY time({}s) fill(none);'.format(self._default_period)
+        counts = tuple((point['time'], point['count'])
+                       for point in self._conn.query(query).get_points())
+        if ttl:
+            with self._page_counts_lock:
+                self._page_counts[where] = (now + ttl, counts)
+                self._page_counts.move_to_end(where)
+                while len(self._page_counts) > _PAGE_COUNTS_CACHE_SIZE:
+                    self._page_counts.popitem(last=False)
+        return counts
+
+    def _get_page_cursor(self, where, offset):
+        """Returns the time from which a page should be read.
+
+        Points are counted by period, which gives the total number of points
+        and the first period containing the point at ``offset``. Returns a
+        (total, cursor, skip) tuple, ``skip`` being the number of points of
+        that period preceding ``offset``. ``cursor`` is None if there are no
+        points at ``offset``.
+        """
+        total = 0
+        cursor = None
+        skip = 0
+        for time_, count in self._get_period_counts(where):
+            if cursor is None and total + count > offset:
+                cursor = time_
+                skip = offset - total
+            total += count
+        return total, cursor, skip
+
+    def iter_points(self, types, filters, begin, end):
+        """Yields all points matching the given filters, ordered by time."""
+        query = 'SELECT * FROM "dataframes"'
+        query += self._get_where_query(types, filters, begin, end)
+        query += ';'
+        return self._iter_query(query)
 
     def retrieve(self,
                  types,
                  filters,
                  begin, end,
                  offset=0, limit=1000, paginate=True):
-        query = 'SELECT * FROM "dataframes"'
-        query += self._get_time_query(begin, end)
-        query += self._get_filter_query(filters)
-        query += self._get_type_query(types)
+        """Returns the number of matching points and an iterator on a page.
 
-        if paginate:
-            query += ' LIMIT {} OFFSET {}'.format(limit, offset)
+        Rather than making InfluxDB skip ``offset`` points from the start of
+        the period, the page is read from the start of the collect period
+        containing the point at ``offset``.
+        """
+        where = self._get_where_query(types, filters, begin, end)
+        if not paginate:
+            offset, limit = 0, None
+        total, cursor, skip = self._get_page_cursor(where, offset)
+        if cursor is None:
+            return total, iter(())
 
+        query = 'SELECT * FROM "dataframes"' + where
+        query += " AND time >= '{}'".format(cursor)
+        if limit is not None:
+            query += ' LIMIT {}'.format(limit)
+        if skip:
+            query += ' OFFSET {}'.format(skip)
         query += ';'
-
-        total_query = 'SELECT COUNT(groupby) FROM "dataframes"'
-        total_query += self._get_time_query(begin, end)
-        total_query += self._get_filter_query(filters)
-        total_query += self._get_type_query(types)
-        total_query += ';'
-
-        total, result = self._conn.query(total_query + query)
-        total = sum(point['count'] for point in total.get_points())
-        return total, result
+        return total, self._iter_query(query)
 
     @staticmethod
     def _get_time_query_delete(begin, end):
@@ -241,8 +643,8 @@ class InfluxClient(object):
             output += "time < '{}'".format(end.isoformat())
         return output
 
-    def delete(self, begin, end, filters):
-        query = 'DELETE FROM "dataframes"'
+    def delete(self, begin, end, filters, measurement=MEASUREMENT):
+        query = 'DELETE FROM "{}"'.format(measurement)
         query += self._get_time_query_delete(begin, end)
         filter_query = self._get_filter_query(filters)
         if 'WHERE' not in query and filter_query:
@@ -252,6 +654,76 @@ class InfluxClient(object):
         query += ';'
         self._conn.query(query)
 
+    def write_rollups(self, rollups):
+        """Writes the totals of collect periods.
+
+        :param rollups: Totals by (start, period, metric type, scope) tuples.
+                        Values are (qty, price) tuples.
+        :type rollups: dict
+        """
+        scope_key = CONF.collect.scope_key
+        points = []
+        for (start, period, metric_type, scope), (qty, price) in sorted(
+                rollups.items()):
+            tags = {'type': metric_type}
+            if scope:
+                tags[scope_key] = scope
+            points.append({
+                'measurement': ROLLUP_MEASUREMENT,
+                'tags': tags,
+                'fields': {
+                    'qty': float(qty),
+                    'price': float(price),
+                    PERIOD_FIELD_NAME: period,
+                },
+                'time': start,
+            })
+        self._conn.write_points(
+            points, retention_policy=self._retention_policy)
+
+    def update_daily_rollups(self, begin, end, filters=None):
+        """Recomputes the daily totals of the given days.
+
+        Daily totals are computed by InfluxDB from the totals of the collect
+        periods, and overwrite the existing ones.
+
+        :param begin: Start of the first day
+        :type begin: datetime.datetime
+        :param end: End of the last day
+        :type end: datetime.datetime
+        :param filters: Scope to update. All scopes are updated if None.
+        :type filters: dict
+        """
+        scope_key = CONF.collect.scope_key
+        query = ('SELECT SUM(qty) AS qty, SUM(price) AS price '
+                 'INTO "{rp}"."{daily}" FROM "{rp}"."{rollup}"').format(
+                     rp=self._retention_policy,
+                     daily=DAILY_ROLLUP_MEASUREMENT,
+                     rollup=ROLLUP_MEASUREMENT)
+        query += self._get_time_query(begin, end)
+        query += self._get_filter_query(filters)
+        query += ' GROUP BY time(1d),"type","{}";'.format(scope_key)
+        self._conn.query(query)
+
+    def get_rollups_start(self):
+        """Returns the time from which rollups are complete, or None."""
+        result = self._conn.query(
+            'SELECT LAST("since") FROM "{}";'.format(ROLLUP_STATE_MEASUREMENT))
+        for point in result.get_points():
+            return tzutils.dt_from_ts(point['last'], as_utc=True)
+        return None
+
+    def set_rollups_start(self, start):
+        self._conn.write_points([{
+            'measurement': ROLLUP_STATE_MEASUREMENT,
+            'fields': {'since': _to_nanoseconds(start) // 10 ** 9},
+            'time': 0,
+        }], retention_policy=self._retention_policy)
+
+    def drop_rollups_start(self):
+        self._conn.query(
+            'DROP MEASUREMENT "{}";'.format(ROLLUP_STATE_MEASUREMENT))
+
 
 class InfluxStorage(v2_storage.BaseStorage):
 
@@ -259,6 +731,8 @@ class InfluxStorage(v2_storage.BaseStorage):
         super(InfluxStorage, self).__init__(*args, **kwargs)
         self._default_period = kwargs.get('period') or CONF.collect.period
         self._conn = InfluxClient(default_period=self._default_period)
+        self._use_rollups = CONF.storage_influxdb.use_rollups
+        self._rollups_checked = False
 
     def init(self):
         policy = CONF.storage_influxdb.retention_policy
@@ -268,15 +742,59 @@ class InfluxStorage(v2_storage.BaseStorage):
                 'Archive policy "{}" does not exist in database "{}"'.format(
                     policy, database)
             )
+        self._check_rollups()
+
+    def _check_rollups(self):
+        """Sets or clears the time from which rollups are complete.
+
+        Rollups only include the data pushed while they are enabled, so they
+        are only used from the first day starting after they were enabled.
+        Once disabled, they are not maintained anymore and can't be used
+        until they are enabled again.
+        """
+        start = self._conn.get_rollups_start()
+        if self._use_rollups and start is None:
+            start = _ceil_day(tzutils.localized_now())
+            LOG.info('Rollups will be used from {}'.format(start.isoformat()))
+            self._conn.set_rollups_start(start)
+        elif not self._use_rollups and start is not None:
+            LOG.info('Rollups are disabled, they will not be used anymore')
+            self._conn.drop_rollups_start()
+        self._rollups_checked = True
 
     def push(self, dataframes, scope_id=None):
+        if not self._rollups_checked:
+            self._check_rollups()
 
+        scope_key = CONF.collect.scope_key
+        rollups = collections.defaultdict(lambda: [0, 0])
         for frame in dataframes:
             period = tzutils.diff_seconds(frame.end, frame.start)
+            start = tzutils.local_to_utc(frame.start)
             for type_, point in frame.iterpoints():
                 self._conn.append_point(type_, frame.start, period, point)
+                if self._use_rollups:
+                    rollup = rollups[(start, period, type_,
+                                      point.groupby.get(scope_key, ''))]
+                    rollup[0] += point.qty
+                    rollup[1] += point.price
 
         self._conn.commit()
+        if rollups:
+            self._push_rollups(rollups)
+
+    def _push_rollups(self, rollups):
+        self._conn.write_rollups(rollups)
+        starts = [key[0] for key in rollups]
+        scopes = set(key[3] for key in rollups)
+        # Points without scope are included in the totals of all scopes
+        filters = None
+        if len(scopes) == 1 and '' not in scopes:
+            filters = {CONF.collect.scope_key: scopes.pop()}
+        self._conn.update_daily_rollups(
+            _floor_day(min(starts)),
+            _floor_day(max(starts)) + datetime.timedelta(days=1),
+            filters)
 
     @staticmethod
     def _check_begin_end(begin, end):
@@ -298,48 +816,107 @@ class InfluxStorage(v2_storage.BaseStorage):
             {key: point.get(key, '') for key in metadata},
         )
 
-    def _build_dataframes(self, points):
+    def _iter_dataframes(self, points):
+        """Builds dataframes from points ordered by time.
+
+        The dataframes of a period are yielded as soon as a point of a later
+        period is read, so that a single period is held in memory.
+        """
         dataframes = {}
+        current_time = None
         for point in points:
-            point_type = point['type']
-            time = tzutils.dt_from_iso(point['time'])
+            if point['time'] != current_time:
+                for frame in self._sorted_dataframes(dataframes):
+                    yield frame
+                dataframes = {}
+                current_time = point['time']
+                start = tzutils.dt_from_iso(current_time)
+
             period = point.get(PERIOD_FIELD_NAME) or self._default_period
-            timekey = (
-                time,
-                tzutils.add_delta(time, datetime.timedelta(seconds=period)))
-            if timekey not in dataframes.keys():
-                dataframes[timekey] = dataframe.DataFrame(
-                    start=timekey[0],
-                    end=timekey[1])
-
-            dataframes[timekey].add_point(
-                self._point_to_dataframe_entry(point), point_type)
-
-        output = list(dataframes.values())
-        output.sort(key=lambda frame: (frame.start, frame.end))
-        return output
+            frame = dataframes.get(period)
+            if frame is None:
+                frame = dataframes[period] = dataframe.DataFrame(
+                    start=start,
+                    end=tzutils.add_delta(
+                        start, datetime.timedelta(seconds=period)))
+            frame.add_point(
+                self._point_to_dataframe_entry(point), point['type'])
+
+        for frame in self._sorted_dataframes(dataframes):
+            yield frame
+
+    @staticmethod
+    def _sorted_dataframes(dataframes):
+        return sorted(dataframes.values(),
+                      key=lambda frame: (frame.start, frame.end))
+
+    def _build_dataframes(self, points):
+        points = sorted(points, key=lambda point: point['time'])
+        return list(self._iter_dataframes(points))
+
+    def iter_dataframes(self, begin=None, end=None,
+                        filters=None,
+                        metric_types=None):
+        begin, end = self._check_begin_end(begin, end)
+        return self._iter_dataframes(
+            self._conn.iter_points(metric_types, filters, begin, end))
 
     def retrieve(self, begin=None, end=None,
                  filters=None,
                  metric_types=None,
                  offset=0, limit=1000, paginate=True):
         begin, end = self._check_begin_end(begin, end)
-        total, resp = self._conn.retrieve(
+        if not paginate:
+            # All the points are read, so they don't need to be counted
+            frames = list(self._iter_dataframes(
+                self._conn.iter_points(metric_types, filters, begin, end)))
+            return {
+                'total': sum(len(points) for frame in frames
+                             for _, points in frame.itertypes()),
+                'dataframes': frames,
+            }
+        total, points = self._conn.retrieve(
             metric_types, filters, begin, end, offset, limit, paginate)
 
-        # Unfortunately, a ResultSet has no values() method, so we need to
-        # get them manually
-        points = []
-        for _, item in resp.items():
-            points += list(item)
-
         return {
             'total': total,
-            'dataframes': self._build_dataframes(points)
+            'dataframes': list(self._iter_dataframes(points)),
         }
 
     def delete(self, begin=None, end=None, filters=None):
         self._conn.delete(begin, end, filters)
+        if self._use_rollups:
+            self._delete_rollups(begin, end, filters)
+
+    def _delete_rollups(self, begin, end, filters):
+        scope_key = CONF.collect.scope_key
+        if set(filters or ()) - {scope_key}:
+            # Rollups can't be updated without scanning the remaining data,
+            # so they are not used for the period anymore
+            start = _ceil_day(end or tzutils.localized_now())
+            current = self._conn.get_rollups_start()
+            if current is None or current < start:
+                LOG.warning(
+                    'Data was deleted with filters on other attributes than '
+                    '{}, rollups will only be used from {}'.format(
+                        scope_key, start.isoformat()))
+                self._conn.set_rollups_start(start)
+            return
+
+        self._conn.delete(begin, end, filters, measurement=ROLLUP_MEASUREMENT)
+        day_begin = _floor_day(begin) if begin else None
+        day_end = _ceil_day(end) if end else None
+        self._conn.delete(day_begin, day_end, filters,
+                          measurement=DAILY_ROLLUP_MEASUREMENT)
+        # The days which were partially deleted are computed again
+        one_day = datetime.timedelta(days=1)
+        if begin and day_begin < begin:
+            self._conn.update_daily_rollups(
+                day_begin, day_begin + one_day, filters)
+        if end and end < day_end and (
+                not begin or _floor_day(end) != day_begin):
+            self._conn.update_daily_rollups(
+                day_end - one_day, day_end, filters)
 
     def _get_total_elem(self, begin, end, groupby, series_groupby, point):
         if groupby and 'time' in groupby:
@@ -357,6 +934,106 @@ class InfluxStorage(v2_storage.BaseStorage):
                 output[group] = series_groupby.get(group, '')
         return output
 
+    def _can_use_rollups(self, groupby, filters):
+        if not self._use_rollups:
+            return False
+        allowed = {'type', CONF.collect.scope_key}
+        return (set(groupby or ()) <= allowed
+                and set(filters or ()) <= {CONF.collect.scope_key})
+
+    def _get_total_sources(self, begin, end):
+        """Splits a period by the measurement to compute its total from.
+
+        Full days are read from the daily rollups, and the other parts of
+        the period from the rollups of the collect periods. Data which is
+        older than the rollups is read from the raw points.
+
+        :returns: A list of (measurement, begin, end) tuples
+        """
+        start = self._conn.get_rollups_start()
+        if start is None or start >= end:
+            return [(MEASUREMENT, begin, end)]
+
+        sources = []
+        if begin < start:
+            sources.append((MEASUREMENT, begin, start))
+            begin = start
+        day_begin = _ceil_day(begin)
+        day_end = _floor_day(end)
+        if day_begin >= day_end:
+            sources.append((ROLLUP_MEASUREMENT, begin, end))
+            return sources
+        if begin < day_begin:
+            sources.append((ROLLUP_MEASUREMENT, begin, day_begin))
+        sources.append((DAILY_ROLLUP_MEASUREMENT, day_begin, day_end))
+        if day_end < end:
+            sources.append((ROLLUP_MEASUREMENT, day_end, end))
+        return sources
+
+    def _get_rollups_total(self, groupby, begin, end, metric_types, filters):
+        groupby = _sanitized_groupby(groupby)
+        totals = collections.OrderedDict()
+        for measurement, source_begin, source_end in self._get_total_sources(
+                begin, end):
+            for series_groupby, point in self._conn.iter_total(
+                    metric_types, source_begin, source_end, groupby, filters,
+                    measurement=measurement):
+                if point['qty'] is None or point['price'] is None:
+                    continue
+                key = tuple(series_groupby.get(group, '')
+                            for group in groupby)
+                elem = totals.get(key)
+                if elem is None:
+                    totals[key] = self._get_total_elem(
+                        tzutils.utc_to_local(begin),
+                        tzutils.utc_to_local(end),
+                        groupby,
+                        series_groupby,
+                        point)
+                else:
+                    elem['qty'] += point['qty']
+                    elem['rate'] += point['price']
+        return list(totals.values())
+
+    def _iter_raw_total(self, groupby, begin, end, metric_types, filters):
+        for series_groupby, point in self._conn.iter_total(
+                metric_types, begin, end, groupby, filters):
+            # NOTE(peschk_l): InfluxDB returns all timestamps for a given
+            # period and interval, even those with no data. This filters
+            # out periods with no data
+            if point['qty'] is not None and point['price'] is not None:
+                yield self._get_total_elem(
+                    tzutils.utc_to_local(begin),
+                    tzutils.utc_to_local(end),
+                    groupby,
+                    series_groupby,
+                    point)
+
+    @staticmethod
+    def _paginate_total(results, groupby, offset, limit):
+        """Returns the number of results and a page of the sorted results.
+
+        Results are consumed as they are read from InfluxDB, and at most
+        ``offset + limit`` of them are held in memory.
+        """
+        count = [0]
+
+        def counted():
+            for elem in results:
+                count[0] += 1
+                yield elem
+
+        if groupby:
+            page = heapq.nsmallest(
+                offset + limit, counted(),
+                key=lambda x: [x[group] for group in groupby])
+        else:
+            page = list(itertools.islice(counted(), offset + limit))
+            # Remaining results are only counted
+            for _ in counted():
+                pass
+        return count[0], page[offset:]
+
     def total(self, groupby=None,
               begin=None, end=None,
               metric_types=None,
@@ -365,27 +1042,20 @@ class InfluxStorage(v2_storage.BaseStorage):
 
         begin, end = self._check_begin_end(begin, end)
 
-        total = self._conn.get_total(
-            metric_types, begin, end, groupby, filters)
-
-        output = []
-        for (series_name, series_groupby), points in total.items():
-            for point in points:
-                # NOTE(peschk_l): InfluxDB returns all timestamps for a given
-                # period and interval, even those with no data. This filters
-                # out periods with no data
-                if point['qty'] is not None and point['price'] is not None:
-                    output.append(self._get_total_elem(
-                        tzutils.utc_to_local(begin),
-                        tzutils.utc_to_local(end),
-                        groupby,
-                        series_groupby,
-                        point))
+        if self._can_use_rollups(groupby, filters):
+            output = self._get_rollups_total(
+                groupby, begin, end, metric_types, filters)
+        else:
+            output = self._iter_raw_total(
+                groupby, begin, end, metric_types, filters)
 
         groupby = _sanitized_groupby(groupby)
+        if paginate:
+            total, output = self._paginate_total(
+                output, groupby, offset, limit)
+            return {'total': total, 'results': output}
+
+        output = list(output)
         if groupby:
             output.sort(key=lambda x: [x[group] for group in groupby])
-        return {
-            'total': len(output),
-            'results': output[offset:offset + limit] if paginate else output,
-        }
+        return {'total': len(output), 'results': output}
@@ -13,9 +13,14 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 #
+import collections
+import threading
+import time
+
 from oslo_config import cfg
 from oslo_db.sqlalchemy import utils
 from oslo_log import log
+import sqlalchemy
 
 from cloudkitty import db
 from cloudkitty.storage_state import migration
@@ -33,11 +38,41 @@ CONF.import_opt('collector', 'cloudkitty.collector', 'collect')
 CONF.import_opt('scope_key', 'cloudkitty.collector', 'collect')
 
 
+# In-process cache of scope states, shared by all StateManager instances.
+# Keys are (identifier, fetcher, collector, scope_key) tuples.
+_STATE_CACHE = {}
+_STATE_CACHE_LOCK = threading.Lock()
+
+
 class StateManager(object):
     """Class allowing state management in CloudKitty"""
 
     model = models.IdentifierState
 
+    # Maximal number of identifiers per query of get_states_bulk()
+    bulk_chunk_size = 500
+
+    @staticmethod
+    def _get_cache_key(identifier,
+                       fetcher=None, collector=None, scope_key=None):
+        return (
+            identifier,
+            fetcher or CONF.fetcher.backend,
+            collector or CONF.collect.collector,
+            scope_key or CONF.collect.scope_key,
+        )
+
+    @staticmethod
+    def _update_cache(states):
+        with _STATE_CACHE_LOCK:
+            _STATE_CACHE.update(states)
+
+    @staticmethod
+    def clear_cache():
+        """Empties the in-process state cache."""
+        with _STATE_CACHE_LOCK:
+            _STATE_CACHE.clear()
+
     def get_all(self,
                 identifier=None,
                 fetcher=None,
@@ -132,6 +167,9 @@ class StateManager(object):
         :param scope_key: scope_key associated to the scope
         :type scope_key: str
         """
+        cache_key = self._get_cache_key(
+            identifier, fetcher, collector, scope_key)
+        local_state = tzutils.utc_to_local(state)
         state = tzutils.local_to_utc(state, naive=True)
         session = db.get_session()
         session.begin()
@@ -154,6 +192,69 @@ class StateManager(object):
             session.commit()
 
         session.close()
+        self._update_cache({cache_key: local_state})
+
+    def set_states_bulk(self, states,
+                        fetcher=None, collector=None, scope_key=None):
+        """Set the state of several scopes in a single transaction.
+
+        :param states: New state of each scope, by scope identifier
+        :type states: dict
+        :param fetcher: Fetcher associated to the scopes
+        :type fetcher: str
+        :param collector: Collector associated to the scopes
+        :type collector: str
+        :param scope_key: scope_key associated to the scopes
+        :type scope_key: str
+        """
+        fetcher = fetcher or CONF.fetcher.backend
+        collector = collector or CONF.collect.collector
+        scope_key = scope_key or CONF.collect.scope_key
+
+        identifiers = list(states.keys())
+        rows = {}
+        legacy_rows = {}
+
+        session = db.get_session()
+        session.begin()
+        for i in range(0, len(identifiers), self.bulk_chunk_size):
+            chunk = identifiers[i:i + self.bulk_chunk_size]
+            q = utils.model_query(self.model, session)
+            q = q.filter(self.model.identifier.in_(chunk)).filter(
+                self._get_columns_filter(fetcher, collector, scope_key))
+            for item in q.all():
+                if item.scope_key is None:
+                    legacy_rows[item.identifier] = item
+                else:
+                    rows[item.identifier] = item
+
+        for identifier, state in states.items():
+            naive_state = tzutils.local_to_utc(state, naive=True)
+            r = rows.get(identifier)
+            if r is None:
+                r = legacy_rows.get(identifier)
+                if r is not None:
+                    r.scope_key = scope_key
+                    r.collector = collector
+                    r.fetcher = fetcher
+            if r is None:
+                session.add(self.model(
+                    identifier=identifier,
+                    state=naive_state,
+                    fetcher=fetcher,
+                    collector=collector,
+                    scope_key=scope_key,
+                ))
+            elif r.state != naive_state:
+                r.state = naive_state
+        session.commit()
+        session.close()
+
+        self._update_cache({
+            (identifier, fetcher, collector, scope_key):
+                tzutils.utc_to_local(state)
+            for identifier, state in states.items()
+        })
 
     def get_state(self, identifier,
                   fetcher=None, collector=None, scope_key=None):
@@ -176,6 +277,107 @@ class StateManager(object):
         session.close()
         return tzutils.utc_to_local(r.state) if r else None
 
+    def _get_columns_filter(self, fetcher, collector, scope_key):
+        """Matches rows with the given columns or with empty columns."""
+        # '==' must be used instead of 'is' because sqlalchemy overloads this
+        # operator
+        return sqlalchemy.or_(
+            sqlalchemy.and_(
+                self.model.scope_key == scope_key,
+                self.model.fetcher == fetcher,
+                self.model.collector == collector),
+            sqlalchemy.and_(
+                self.model.scope_key == None,  # noqa
+                self.model.fetcher == None,  # noqa
+                self.model.collector == None),  # noqa
+        )
+
+    def get_states_bulk(self, identifiers,
+                        fetcher=None, collector=None, scope_key=None):
+        """Get the state of several scopes at once.
+
+        States are loaded with one query per ``bulk_chunk_size`` scopes
+        instead of one query per scope. Loaded states are stored in the
+        in-process state cache.
+
+        :param identifiers: Identifiers of the scopes
+        :type identifiers: list
+        :param fetcher: Fetcher associated to the scopes
+        :type fetcher: str
+        :param collector: Collector associated to the scopes
+        :type collector: str
+        :param scope_key: scope_key associated to the scopes
+        :type scope_key: str
+        :returns: The state of each scope, or None if it has no state.
+        :rtype: dict
+        """
+        fetcher = fetcher or CONF.fetcher.backend
+        collector = collector or CONF.collect.collector
+        scope_key = scope_key or CONF.collect.scope_key
+
+        identifiers = list(set(identifiers))
+        states = dict.fromkeys(identifiers)
+        legacy_states = {}
+
+        session = db.get_session()
+        session.begin()
+        for i in range(0, len(identifiers), self.bulk_chunk_size):
+            chunk = identifiers[i:i + self.bulk_chunk_size]
+            q = utils.model_query(self.model, session)
+            q = q.filter(self.model.identifier.in_(chunk)).filter(
+                self._get_columns_filter(fetcher, collector, scope_key))
+            for item in q.all():
+                if item.scope_key is None:
+                    legacy_states[item.identifier] = item.state
+                else:
+                    states[item.identifier] = item.state
+        session.close()
+
+        # Rows with empty columns are only used if no complete row exists,
+        # like in get_state()
+        for identifier, state in legacy_states.items():
+            if states[identifier] is None:
+                states[identifier] = state
+
+        states = {
+            identifier: tzutils.utc_to_local(state) if state else None
+            for identifier, state in states.items()
+        }
+        self._update_cache({
+            (identifier, fetcher, collector, scope_key): state
+            for identifier, state in states.items()
+        })
+        return states
+
+    def get_cached_state(self, identifier,
+                         fetcher=None, collector=None, scope_key=None):
+        """Get the state of a scope from the in-process cache.
+
+        The cache is filled by ``get_states_bulk`` and ``set_state``. The
+        state is loaded from the database if it is not cached yet. As states
+        may be updated by other processes, the returned state may be
+        outdated: it must not be used to decide whether a period should be
+        collected or not.
+
+        :param identifier: Identifier of the scope
+        :type identifier: str
+        :param fetcher: Fetcher associated to the scope
+        :type fetcher: str
+        :param collector: Collector associated to the scope
+        :type collector: str
+        :param scope_key: scope_key associated to the scope
+        :type scope_key: str
+        :rtype: datetime.datetime
+        """
+        cache_key = self._get_cache_key(
+            identifier, fetcher, collector, scope_key)
+        with _STATE_CACHE_LOCK:
+            if cache_key in _STATE_CACHE:
+                return _STATE_CACHE[cache_key]
+        state = self.get_state(identifier, fetcher, collector, scope_key)
+        self._update_cache({cache_key: state})
+        return state
+
     def init(self):
         migration.upgrade('head')
 
@@ -187,3 +389,59 @@ class StateManager(object):
         q = utils.model_query(self.model, session)
         session.close()
         return [tenant.identifier for tenant in q]
+
+
+class StateWriter(object):
+    """Buffers state updates and commits them in batches.
+
+    States are committed in a single transaction once ``batch_size`` updates
+    are pending, or once the oldest pending update is older than
+    ``max_delay`` seconds. As a state must only be advanced once the
+    corresponding data has been pushed to the storage backend, states must
+    only be given to the writer after a successful push. Pending states must
+    be flushed before the lock of their scope is released.
+
+    :param state_manager: StateManager used to commit the states
+    :type state_manager: StateManager
+    :param batch_size: Number of updates triggering a commit
+    :type batch_size: int
+    :param max_delay: Age in seconds of the oldest update triggering a
+                      commit. 0 disables this limit.
+    :type max_delay: int
+    """
+
+    def __init__(self, state_manager, batch_size=1, max_delay=0):
+        self._state = state_manager
+        self._batch_size = batch_size
+        self._max_delay = max_delay
+        self._pending = collections.OrderedDict()
+        self._nb_pending = 0
+        self._first_pending_at = None
+
+    def set_state(self, identifier, state,
+                  fetcher=None, collector=None, scope_key=None):
+        """Buffers the new state of a scope.
+
+        Arguments are the same as the ones of ``StateManager.set_state``.
+        """
+        key = (fetcher, collector, scope_key)
+        self._pending.setdefault(key, {})[identifier] = state
+        self._nb_pending += 1
+        if self._first_pending_at is None:
+            self._first_pending_at = time.time()
+
+        if self._nb_pending >= self._batch_size or (
+                self._max_delay and
+                time.time() - self._first_pending_at >= self._max_delay):
+            self.flush()
+
+    def flush(self):
+        """Commits all pending states."""
+        while self._pending:
+            (fetcher, collector, scope_key), states = self._pending.popitem(
+                last=False)
+            self._state.set_states_bulk(
+                states, fetcher=fetcher,
+                collector=collector, scope_key=scope_key)
+        self._nb_pending = 0
+        self._first_pending_at = None
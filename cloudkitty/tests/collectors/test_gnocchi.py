@@ -14,6 +14,7 @@
 #    under the License.
 #
 import datetime
+import threading
 
 from dateutil import tz
 import mock
@@ -215,3 +216,261 @@ class GnocchiCollectorAggregationOperationTest(tests.TestCase):
             ["metric", "metric_one", "rate:mean"],
         ]
         self.do_test(expected_op, extra_args=extra_args)
+
+
+class GnocchiCollectorFetchAllPeriodsTest(tests.TestCase):
+
+    def setUp(self):
+        super(GnocchiCollectorFetchAllPeriodsTest, self).setUp()
+        self.conf.set_override('collector', 'gnocchi', 'collect')
+        self.conf.set_override(
+            'gnocchi_auth_type', 'basic', 'collector_gnocchi')
+        self.start = datetime.datetime(2019, 1, 1, tzinfo=tz.UTC)
+        self.end = datetime.datetime(2019, 1, 1, 3, tzinfo=tz.UTC)
+        conf = {
+            'metrics': {
+                'metric_one': {
+                    'unit': 'GiB',
+                    'groupby': ['project_id'],
+                    'extra_args': {'resource_type': 'resource_x'},
+                }
+            }
+        }
+        self.collector = gnocchi.GnocchiCollector(period=3600, conf=conf)
+
+    def test_fetch_all_periods_single_query(self):
+        measures = [
+            ['2019-01-01T00:00:00+00:00', 3600, 1],
+            ['2019-01-01T02:00:00+00:00', 3600, 3],
+            ['2019-01-01T03:00:00+00:00', 3600, 4],
+        ]
+        data = [{
+            'group': {'id': 'id_one', 'project_id': 'project'},
+            'measures': {'measures': {'aggregated': measures}},
+        }]
+        with mock.patch.object(self.collector._conn.aggregates, 'fetch',
+                               return_value=data) as fetch_mock:
+            output = self.collector.fetch_all_periods(
+                'metric_one', self.start, self.end, 'project')
+            fetch_mock.assert_called_once()
+
+        hour = datetime.timedelta(hours=1)
+        self.assertEqual(
+            [self.start, self.start + hour, self.start + 2 * hour],
+            list(output.keys()))
+        self.assertEqual(1, output[self.start][0].qty)
+        self.assertEqual([], output[self.start + hour])
+        self.assertEqual(3, output[self.start + 2 * hour][0].qty)
+
+    def test_fetch_all_scopes_single_query(self):
+        measures = [['2019-01-01T00:00:00+00:00', 3600, 1]]
+        data = [
+            {'group': {'id': 'id_one', 'project_id': 'project_one'},
+             'measures': {'measures': {'aggregated': measures}}},
+            {'group': {'id': 'id_two', 'project_id': 'project_two'},
+             'measures': {'measures': {'aggregated': measures}}},
+            {'group': {'id': 'id_three', 'project_id': 'project_one'},
+             'measures': {'measures': {'aggregated': measures}}},
+        ]
+        end = self.start + datetime.timedelta(hours=1)
+        with mock.patch.object(self.collector._conn.aggregates, 'fetch',
+                               return_value=data) as fetch_mock:
+            output = self.collector.fetch_all_scopes(
+                'metric_one', self.start, end,
+                ['project_one', 'project_two', 'project_three'])
+            fetch_mock.assert_called_once()
+            self.assertEqual(
+                {'and': [
+                    {'=': {'type': 'resource_x'}},
+                    {'in': {'project_id': [
+                        'project_one', 'project_two', 'project_three']}},
+                ]},
+                fetch_mock.call_args[1]['search'])
+
+        self.assertEqual(
+            {'project_one': ['id_one', 'id_three'],
+             'project_two': ['id_two'],
+             'project_three': []},
+            {scope_id: [point.groupby['id'] for point in points]
+             for scope_id, points in output.items()})
+
+
+class GnocchiResourceCacheTest(tests.TestCase):
+
+    def setUp(self):
+        super(GnocchiResourceCacheTest, self).setUp()
+        self.now = datetime.datetime(2019, 1, 1, 12, tzinfo=tz.UTC)
+        self.search = mock.Mock(return_value=[
+            {'id': 'a', 'started_at': '2019-01-01T00:00:00+00:00',
+             'ended_at': None},
+            {'id': 'b', 'started_at': '2019-01-01T00:00:00+00:00',
+             'ended_at': '2019-01-01T02:00:00+00:00'},
+            {'id': 'c', 'started_at': '2019-01-01T05:00:00+00:00',
+             'ended_at': None},
+        ])
+        self.cache = gnocchi.ResourceCache(self.search, ttl=3600, size=2)
+        self.scope_filter = {'=': {'project_id': 'p'}}
+
+    def _get(self, start_hour, end_hour, scope_id='p', minutes=0):
+        now = self.now + datetime.timedelta(minutes=minutes)
+        with mock.patch.object(gnocchi.tzutils, 'localized_now',
+                               return_value=now):
+            resources = self.cache.get(
+                'resource_x', self.scope_filter, scope_id,
+                datetime.datetime(2019, 1, 1, start_hour, tzinfo=tz.UTC),
+                datetime.datetime(2019, 1, 1, end_hour, tzinfo=tz.UTC))
+        return sorted(resource['id'] for resource in resources)
+
+    def test_get_filters_resources_locally(self):
+        self.assertEqual(['a', 'b'], self._get(1, 3))
+        self.assertEqual(['a', 'c'], self._get(4, 6))
+        # The cache has been refreshed after the end of both timeframes
+        self.search.assert_called_once_with('resource_x', {'and': [
+            {'or': [{'=': {'ended_at': None}},
+                    {'>=': {'ended_at': '2019-01-01T01:00:00+00:00'}}]},
+            {'=': {'project_id': 'p'}},
+        ]})
+
+    def test_get_refreshes_incrementally(self):
+        self.assertEqual(['a', 'b'], self._get(1, 3))
+        self.search.return_value = [
+            {'id': 'a', 'started_at': '2019-01-01T00:00:00+00:00',
+             'ended_at': '2019-01-01T12:30:00+00:00'},
+        ]
+        self.assertEqual(['a', 'c'], self._get(12, 13, minutes=30))
+        self.assertEqual(2, self.search.call_count)
+        self.assertEqual(
+            mock.call('resource_x', {'and': [
+                {'>=': {'revision_start': '2019-01-01T12:00:00+00:00'}},
+                {'=': {'project_id': 'p'}},
+            ]}),
+            self.search.call_args)
+
+    def test_get_reloads_expired_entries(self):
+        self._get(1, 3)
+        self._get(1, 3, minutes=60)
+        self.assertEqual(2, self.search.call_count)
+
+    def test_get_reloads_earlier_timeframes(self):
+        self._get(4, 6)
+        self._get(1, 3)
+        self.assertEqual(2, self.search.call_count)
+
+    def test_lru_eviction(self):
+        self._get(1, 3, scope_id='p1')
+        self._get(1, 3, scope_id='p2')
+        self._get(1, 3, scope_id='p1')
+        self._get(1, 3, scope_id='p3')
+        self.assertEqual(3, self.search.call_count)
+        # p2 was the least recently used entry
+        self._get(1, 3, scope_id='p1')
+        self.assertEqual(3, self.search.call_count)
+        self._get(1, 3, scope_id='p2')
+        self.assertEqual(4, self.search.call_count)
+
+    def test_get_loads_different_keys_concurrently(self):
+        started = threading.Event()
+        loaded = threading.Event()
+        waited = []
+        resources = self.search.return_value
+
+        def search(resource_type, query):
+            if 'p1' in str(query):
+                started.set()
+                # Blocks until p2 has been loaded by another thread
+                waited.append(loaded.wait(10))
+            else:
+                loaded.set()
+            return resources
+
+        self.search.side_effect = search
+        thread = threading.Thread(
+            target=self.cache.get,
+            args=('resource_x', {'=': {'project_id': 'p1'}}, 'p1',
+                  self.now, self.now))
+        thread.start()
+        self.assertTrue(started.wait(10))
+        self.cache.get('resource_x', {'=': {'project_id': 'p2'}}, 'p2',
+                       self.now, self.now)
+        thread.join()
+        self.assertEqual([True], waited)
+
+    def test_collector_shares_cache_between_metrics(self):
+        self.conf.set_override('collector', 'gnocchi', 'collect')
+        self.conf.set_override(
+            'gnocchi_auth_type', 'basic', 'collector_gnocchi')
+        self.conf.set_override(
+            'resource_cache_ttl', 3600, 'collector_gnocchi')
+        conf = {'metrics': {
+            metric: {
+                'unit': 'GiB',
+                'metadata': ['flavor'],
+                'extra_args': {'resource_type': 'resource_x'},
+            } for metric in ('metric_one', 'metric_two')
+        }}
+        collector = gnocchi.GnocchiCollector(period=3600, conf=conf)
+        start = datetime.datetime(2019, 1, 1, tzinfo=tz.UTC)
+        end = datetime.datetime(2019, 1, 1, 1, tzinfo=tz.UTC)
+        with mock.patch.object(collector._conn.resource, 'search',
+                               side_effect=[self.search.return_value, []]) \
+                as search_mock:
+            for metric in ('metric_one', 'metric_two'):
+                resources = collector._fetch_resources(
+                    metric, start, end, project_id='p')
+                self.assertEqual(['a', 'b'], sorted(resources.keys()))
+        self.assertEqual(2, search_mock.call_count)
+
+    def test_collector_batches_use_cache(self):
+        self.conf.set_override('collector', 'gnocchi', 'collect')
+        self.conf.set_override(
+            'gnocchi_auth_type', 'basic', 'collector_gnocchi')
+        self.conf.set_override(
+            'resource_cache_ttl', 3600, 'collector_gnocchi')
+        conf = {'metrics': {
+            metric: {
+                'unit': 'GiB',
+                'groupby': ['project_id'],
+                'metadata': ['flavor'],
+                'extra_args': {'resource_type': 'resource_x'},
+            } for metric in ('metric_one', 'metric_two')
+        }}
+        collector = gnocchi.GnocchiCollector(period=3600, conf=conf)
+        start = datetime.datetime(2019, 1, 1, tzinfo=tz.UTC)
+        end = datetime.datetime(2019, 1, 1, 1, tzinfo=tz.UTC)
+        resources = {
+            'p1': {'id': 'a', 'flavor': 'm1.tiny',
+                   'started_at': '2019-01-01T00:00:00+00:00'},
+            'p2': {'id': 'b', 'flavor': 'm1.nano',
+                   'started_at': '2019-01-01T00:00:00+00:00'},
+        }
+
+        def search(resource_type, query, sorts, marker):
+            if marker is not None:
+                return []
+            scope_id = query['and'][1]['=']['project_id']
+            return [resources[scope_id]]
+
+        measures = [['2019-01-01T00:00:00+00:00', 3600, 1]]
+        data = [
+            {'group': {'id': 'a', 'project_id': 'p1'},
+             'measures': {'measures': {'aggregated': measures}}},
+            {'group': {'id': 'b', 'project_id': 'p2'},
+             'measures': {'measures': {'aggregated': measures}}},
+        ]
+        with mock.patch.object(collector._conn.aggregates, 'fetch',
+                               return_value=data), \
+                mock.patch.object(collector._conn.resource, 'search',
+                                  side_effect=search) as search_mock:
+            for metric in ('metric_one', 'metric_two'):
+                output = collector.fetch_all_scopes(
+                    metric, start, end, ['p1', 'p2'])
+                self.assertEqual(
+                    {'p1': ['m1.tiny'], 'p2': ['m1.nano']},
+                    {scope_id: [point.metadata['flavor']
+                                for point in points]
+                     for scope_id, points in output.items()})
+            # Entries are shared with the collection of a single scope
+            self.assertEqual(['a'], list(collector._fetch_resources(
+                'metric_one', start, end, project_id='p1')))
+        # One search per scope, plus the empty page ending it
+        self.assertEqual(4, search_mock.call_count)
@@ -13,6 +13,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 #
+import datetime
 from decimal import Decimal
 
 import mock
@@ -24,6 +25,7 @@ from cloudkitty.common.prometheus_client import PrometheusResponseError
 from cloudkitty import dataframe
 from cloudkitty import tests
 from cloudkitty.tests import samples
+from cloudkitty.utils import tz as tzutils
 
 
 class PrometheusCollectorTest(tests.TestCase):
@@ -285,6 +287,56 @@ class PrometheusCollectorTest(tests.TestCase):
         self.assertEqual(expected_name, actual_name)
         self.assertEqual(expected_data, actual_data)
 
+    def test_fetch_all_periods_single_range_query(self):
+        start = tzutils.dt_from_ts(samples.INITIAL_TIMESTAMP)
+        hour = datetime.timedelta(hours=1)
+        query = (
+            'avg(avg_over_time(http_requests_total'
+            '{project_id="f266f30b11f246b589fd266f85eeec39"}[3600s]'
+            ')) by (foo, bar, project_id, code, instance)'
+        )
+
+        with mock.patch.object(
+            prometheus.PrometheusClient, 'get_range',
+            return_value=samples.PROMETHEUS_RESP_RANGE_QUERY,
+        ) as mock_get:
+            output = self.collector_mandatory.fetch_all_periods(
+                'http_requests_total',
+                start,
+                start + 3 * hour,
+                self._tenant_id,
+            )
+            mock_get.assert_called_once_with(
+                query,
+                (start + hour).isoformat(),
+                (start + 3 * hour).isoformat(),
+                '3600s',
+            )
+
+        self.assertEqual(
+            [start, start + hour, start + 2 * hour], list(output.keys()))
+        self.assertEqual(
+            [Decimal(7), Decimal(42)],
+            [point.qty for point in output[start]])
+        self.assertEqual([], output[start + hour])
+        self.assertEqual(
+            [Decimal(8)], [point.qty for point in output[start + 2 * hour]])
+
+    def test_fetch_all_periods_raises_exception(self):
+        start = tzutils.dt_from_ts(samples.INITIAL_TIMESTAMP)
+        with mock.patch.object(
+            prometheus.PrometheusClient, 'get_range',
+            side_effect=PrometheusResponseError,
+        ):
+            self.assertRaises(
+                exceptions.CollectError,
+                self.collector_mandatory.fetch_all_periods,
+                'http_requests_total',
+                start,
+                start + datetime.timedelta(hours=2),
+                self._tenant_id,
+            )
+
     def test_format_retrieve_raise_NoDataCollected(self):
         no_response = mock.patch(
             'cloudkitty.common.prometheus_client.PrometheusClient.get_instant',
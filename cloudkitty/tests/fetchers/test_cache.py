@@ -0,0 +1,114 @@
+# Copyright 2019 Objectif Libre
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+import json
+import os
+
+import fixtures
+import mock
+
+from cloudkitty import fetcher
+from cloudkitty import tests
+
+
+class FakeFetcher(fetcher.BaseFetcher):
+
+    name = 'fake'
+
+    def __init__(self, scopes, updated_scopes=None):
+        self.scopes = scopes
+        self.updated_scopes = updated_scopes
+        self.supports_incremental = updated_scopes is not None
+        self.calls = []
+
+    def get_tenants(self):
+        self.calls.append('get_tenants')
+        return self.scopes
+
+    def get_updated_tenants(self, since):
+        self.calls.append(('get_updated_tenants', since.timestamp()))
+        return self.updated_scopes
+
+
+class CachedFetcherTest(tests.TestCase):
+
+    def setUp(self):
+        super(CachedFetcherTest, self).setUp()
+        cache_dir = self.useFixture(fixtures.TempDir()).path
+        self.conf.set_override('cache_ttl', 3600, 'fetcher')
+        self.conf.set_override(
+            'cache_path', os.path.join(cache_dir, 'scopes.json'), 'fetcher')
+
+    def _get_tenants(self, fetcher_, now):
+        with mock.patch('time.time', return_value=now):
+            return sorted(fetcher.CachedFetcher(fetcher_).get_tenants())
+
+    def test_cache_is_shared_between_instances(self):
+        first = FakeFetcher(['a', 'b', 'a'])
+        second = FakeFetcher(['c'])
+
+        self.assertEqual(['a', 'b'], self._get_tenants(first, 1000))
+        self.assertEqual(['a', 'b'], self._get_tenants(second, 1100))
+        self.assertEqual([], second.calls)
+
+    def test_cache_is_refreshed_after_ttl(self):
+        self._get_tenants(FakeFetcher(['a']), 1000)
+        second = FakeFetcher(['b'])
+
+        self.assertEqual(['b'], self._get_tenants(second, 4600))
+        self.assertEqual(['get_tenants'], second.calls)
+
+    def test_incremental_refresh(self):
+        self._get_tenants(FakeFetcher(['a']), 1000)
+        second = FakeFetcher(['b'], updated_scopes=['c'])
+
+        self.assertEqual(['a', 'c'], self._get_tenants(second, 4600))
+        self.assertEqual([('get_updated_tenants', 1000)], second.calls)
+
+    def test_full_refresh_after_interval(self):
+        self.conf.set_override(
+            'cache_full_refresh_interval', 7200, 'fetcher')
+        self._get_tenants(FakeFetcher(['a']), 1000)
+        second = FakeFetcher(['b'], updated_scopes=['c'])
+
+        self.assertEqual(['b'], self._get_tenants(second, 8200))
+        self.assertEqual(['get_tenants'], second.calls)
+
+    def test_cache_of_other_fetcher_is_ignored(self):
+        self._get_tenants(FakeFetcher(['a']), 1000)
+        other = FakeFetcher(['b'])
+        other.name = 'other'
+
+        self.assertEqual(['b'], self._get_tenants(other, 1100))
+
+    def test_malformed_cache_is_refreshed(self):
+        for cache in ({'fetcher': 'fake', 'scopes': ['a']},
+                      {'fetcher': 'fake', 'scopes': ['a'],
+                       'refreshed_at': '1000', 'full_refresh_at': 1000},
+                      ['a']):
+            with open(self.conf.fetcher.cache_path, 'w') as f:
+                json.dump(cache, f)
+            fetcher_ = FakeFetcher(['b'], updated_scopes=['c'])
+
+            self.assertEqual(['b'], self._get_tenants(fetcher_, 1100))
+            self.assertEqual(['get_tenants'], fetcher_.calls)
+            os.unlink(self.conf.fetcher.cache_path)
+
+    def test_unsupported_incremental_refresh_is_not_called(self):
+        self._get_tenants(FakeFetcher(['a']), 1000)
+        second = FakeFetcher(['b'])
+        second.get_updated_tenants = mock.Mock()
+
+        self.assertEqual(['b'], self._get_tenants(second, 4600))
+        second.get_updated_tenants.assert_not_called()
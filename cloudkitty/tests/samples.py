@@ -259,6 +259,40 @@ PROMETHEUS_RESP_INSTANT_QUERY = {
     }
 }
 
+PROMETHEUS_RESP_RANGE_QUERY = {
+    "status": "success",
+    "data": {
+        "resultType": "matrix",
+        "result": [
+            {
+                "metric": {
+                    "code": "200",
+                    "method": "get",
+                    "group": "prometheus_group",
+                    "instance": "localhost:9090",
+                    "job": "prometheus",
+                },
+                "values": [
+                    [INITIAL_TIMESTAMP + 3600, "7"],
+                    [INITIAL_TIMESTAMP + 3 * 3600, "8"],
+                ]
+            },
+            {
+                "metric": {
+                    "code": "200",
+                    "method": "post",
+                    "group": "prometheus_group",
+                    "instance": "localhost:9090",
+                    "job": "prometheus",
+                },
+                "values": [
+                    [INITIAL_TIMESTAMP + 3600, "42"],
+                ]
+            },
+        ]
+    }
+}
+
 PROMETHEUS_EMPTY_RESP_INSTANT_QUERY = {
     "status": "success",
     "data": {
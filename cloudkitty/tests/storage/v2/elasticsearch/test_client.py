@@ -14,6 +14,7 @@
 #
 import collections
 import datetime
+import json
 import unittest
 
 from dateutil import tz
@@ -269,80 +270,63 @@ class TestElasticsearchClient(unittest.TestCase):
             fmock.assert_called_once_with({'index': {}}, terms)
 
     def test_commit(self):
-        docs = ['one', 'two', 'three', 'four', 'five', 'six', 'seven']
-        size = 3
-        with mock.patch.object(self.client, 'bulk_index') as bulk_mock:
-            with mock.patch.object(self.client, '_docs', new=docs):
-                with mock.patch.object(self.client, '_chunk_size', new=size):
-                    self.client.commit()
-                    bulk_mock.assert_has_calls([
-                        mock.call(['one', 'two', 'three']),
-                        mock.call(['four', 'five', 'six']),
-                        mock.call(['seven']),
-                    ])
-
-    def test_add_point_no_autocommit(self):
-        point = dataframe.DataPoint(
-            'unit', '0.42', '0.1337', {}, {})
-        start = datetime.datetime(2019, 1, 1)
-        end = datetime.datetime(2019, 1, 1, 1)
-        with mock.patch.object(self.client, 'commit') as func_mock:
-            with mock.patch.object(self.client, '_autocommit', new=False):
-                with mock.patch.object(self.client, '_chunk_size', new=3):
-                    self.client._docs = []
-                    for _ in range(5):
-                        self.client.add_point(
-                            point, 'awesome_type', start, end)
-
-                    func_mock.assert_not_called()
-                    self.assertEqual(self.client._docs, [{
-                        'start': start,
-                        'end': end,
-                        'type': 'awesome_type',
-                        'unit': point.unit,
-                        'qty': point.qty,
-                        'price': point.price,
-                        'groupby': point.groupby,
-                        'metadata': point.metadata,
-                    } for _ in range(5)])
-
-        self.client._docs = []
-
-    def test_add_point_with_autocommit(self):
-        point = dataframe.DataPoint(
-            'unit', '0.42', '0.1337', {}, {})
+        point = dataframe.DataPoint('unit', '0.42', '0.1337', {}, {})
         start = datetime.datetime(2019, 1, 1)
         end = datetime.datetime(2019, 1, 1, 1)
+        self.client._writer._chunk_size = 3
+        with mock.patch.object(self.client._sess, 'post') as post_mock:
+            post_mock.return_value = self._bulk_response()
+            for _ in range(7):
+                self.client.add_point(point, 'awesome_type', start, end)
+            post_mock.assert_not_called()
+            self.client.commit()
 
-        commit_calls = {'count': 0}
-
-        def commit():
-            # We can't re-assign nonlocal variables in python2
-            commit_calls['count'] += 1
-            self.client._docs = []
-
-        with mock.patch.object(self.client, 'commit', new=commit):
-            with mock.patch.object(self.client, '_autocommit', new=True):
-                with mock.patch.object(self.client, '_chunk_size', new=3):
-                    self.client._docs = []
-                    for i in range(5):
-                        self.client.add_point(
-                            point, 'awesome_type', start, end)
-
-                    self.assertEqual(commit_calls['count'], 1)
-                    self.assertEqual(self.client._docs, [{
-                        'start': start,
-                        'end': end,
-                        'type': 'awesome_type',
-                        'unit': point.unit,
-                        'qty': point.qty,
-                        'price': point.price,
-                        'groupby': point.groupby,
-                        'metadata': point.metadata,
-                    } for _ in range(2)])
-
-        # cleanup
-        self.client._docs = []
+        self.assertEqual(
+            [len(self._get_docs(call)) for call in post_mock.call_args_list],
+            [3, 3, 1])
+        self.assertEqual(
+            post_mock.call_args[0][0],
+            'http://elasticsearch:9200/index_name/test_mapping/_bulk')
+
+    @staticmethod
+    def _bulk_response(status_code=200, items=None):
+        response = mock.MagicMock(status_code=status_code)
+        response.json.return_value = {
+            'took': 1,
+            'errors': any('error' in item['index'] for item in items or []),
+            'items': items or [],
+        }
+        return response
+
+    @staticmethod
+    def _get_docs(call):
+        lines = call[1]['data'].splitlines()
+        for instruction in lines[::2]:
+            assert json.loads(instruction) == {'index': {}}
+        return [json.loads(line) for line in lines[1::2]]
+
+    def test_add_point_serializes_documents(self):
+        point = dataframe.DataPoint(
+            'unit', '0.42', '0.1337', {'one': '1'}, {'two': '2'})
+        start = datetime.datetime(2019, 1, 1, tzinfo=tz.UTC)
+        end = datetime.datetime(2019, 1, 1, 1, tzinfo=tz.UTC)
+        with mock.patch.object(self.client._sess, 'post') as post_mock:
+            post_mock.return_value = self._bulk_response()
+            self.client.add_point(point, 'awesome_type', start, end)
+            self.client.commit()
+
+        self.assertEqual(self._get_docs(post_mock.call_args), [{
+            'start': '2019-01-01T00:00:00+00:00',
+            'end': '2019-01-01T01:00:00+00:00',
+            'type': 'awesome_type',
+            'unit': 'unit',
+            'qty': 0.42,
+            'price': 0.1337,
+            'groupby': {'one': '1'},
+            'metadata': {'two': '2'},
+        }])
+        self.assertEqual(post_mock.call_args[1]['headers'],
+                         {'Content-Type': 'application/x-ndjson'})
 
     def test_delete_by_query_with_must(self):
         with mock.patch.object(self.client, '_req') as rmock:
@@ -480,3 +464,119 @@ class TestElasticsearchClient(unittest.TestCase):
         total, aggs = self._do_test_total(['x'], True)
         self.assertEqual(total, 6)
         self.assertEqual(aggs, ['three', 'one', 'two', 'three'])
+
+
+class TestBulkWriter(unittest.TestCase):
+
+    def setUp(self):
+        super(TestBulkWriter, self).setUp()
+        self.session = mock.MagicMock()
+        self.session.post.return_value = self._response()
+        sleep_patch = mock.patch('time.sleep')
+        self.sleep = sleep_patch.start()
+        self.addCleanup(sleep_patch.stop)
+
+    @staticmethod
+    def _response(status_code=200, statuses=()):
+        items = []
+        for status in statuses:
+            item = {'status': status}
+            if status >= 300:
+                item['error'] = {'type': 'error_{}'.format(status)}
+            items.append({'index': item})
+        response = mock.MagicMock(status_code=status_code)
+        response.json.return_value = {
+            'took': 1,
+            'errors': any(status >= 300 for status in statuses),
+            'items': items,
+        }
+        return response
+
+    def _get_writer(self, **kwargs):
+        return client.BulkWriter(self.session, 'http://es/_bulk', **kwargs)
+
+    @staticmethod
+    def _get_docs(call):
+        return call[1]['data'].splitlines()[1::2]
+
+    def test_add_with_autocommit(self):
+        writer = self._get_writer(chunk_size=3)
+        for i in range(5):
+            writer.add('"doc{}"'.format(i))
+        self.assertEqual(self.session.post.call_count, 1)
+        writer.flush()
+        self.assertEqual(
+            [self._get_docs(call)
+             for call in self.session.post.call_args_list],
+            [['"doc0"', '"doc1"', '"doc2"'], ['"doc3"', '"doc4"']])
+
+    def test_add_without_autocommit(self):
+        writer = self._get_writer(chunk_size=3, autocommit=False)
+        for i in range(5):
+            writer.add('"doc{}"'.format(i))
+        self.session.post.assert_not_called()
+        writer.flush()
+        self.assertEqual(self.session.post.call_count, 2)
+
+    def test_retries_only_failed_documents(self):
+        self.session.post.side_effect = [
+            self._response(statuses=(201, 429, 400, 503)),
+            self._response(statuses=(201, 201)),
+        ]
+        writer = self._get_writer()
+        for i in range(4):
+            writer.add('"doc{}"'.format(i))
+        writer.flush()
+
+        calls = self.session.post.call_args_list
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self._get_docs(calls[1]), ['"doc1"', '"doc3"'])
+        self.sleep.assert_called_once_with(1)
+
+    def test_retries_throttled_requests(self):
+        self.session.post.side_effect = [
+            self._response(status_code=429),
+            self._response(statuses=(201, )),
+        ]
+        writer = self._get_writer(chunk_size=16)
+        writer.add('"doc"')
+        writer.flush()
+        self.assertEqual(self.session.post.call_count, 2)
+        self.assertLess(writer.chunk_size, 16)
+
+    def test_raises_after_max_retries(self):
+        self.session.post.return_value = self._response(statuses=(429, ))
+        writer = self._get_writer(max_retries=2)
+        writer.add('"doc"')
+        self.assertRaises(exceptions.BulkIndexError, writer.flush)
+        self.assertEqual(self.session.post.call_count, 3)
+
+    def test_raises_invalid_status_code(self):
+        self.session.post.return_value = self._response(status_code=400)
+        writer = self._get_writer()
+        writer.add('"doc"')
+        self.assertRaises(exceptions.InvalidStatusCode, writer.flush)
+        self.assertEqual(self.session.post.call_count, 1)
+
+    def test_concurrent_requests(self):
+        writer = self._get_writer(chunk_size=1, concurrency=3)
+        for i in range(10):
+            writer.add('"doc{}"'.format(i))
+        writer.flush()
+        writer.close()
+        self.assertEqual(self.session.post.call_count, 10)
+
+    def test_chunk_size_adapts_to_latency(self):
+        writer = self._get_writer(chunk_size=100, target_latency=1)
+        writer._adapt_chunk_size(2, False)
+        self.assertEqual(writer.chunk_size, 50)
+        writer._adapt_chunk_size(0.75, False)
+        self.assertEqual(writer.chunk_size, 50)
+        writer._adapt_chunk_size(0.1, False)
+        self.assertEqual(writer.chunk_size, 63)
+        for _ in range(10):
+            writer._adapt_chunk_size(0.1, False)
+        self.assertEqual(writer.chunk_size, 100)
+        for _ in range(10):
+            writer._adapt_chunk_size(0.1, True)
+        self.assertEqual(writer.chunk_size, 6)
@@ -26,6 +26,7 @@ class FakeElasticsearchClient(client.ElasticsearchClient):
     def __init__(self, *args, **kwargs):
         kwargs["autocommit"] = False
         super(FakeElasticsearchClient, self).__init__(*args, **kwargs)
+        self._docs = []
         for method in ('get_index', 'put_mapping'):
             setattr(self, method, self.__base_response)
 
@@ -38,6 +39,18 @@ class FakeElasticsearchClient(client.ElasticsearchClient):
     def commit(self):
         pass
 
+    def add_point(self, point, type_, start, end):
+        self._docs.append({
+            'start': start,
+            'end': end,
+            'type': type_,
+            'unit': point.unit,
+            'qty': point.qty,
+            'price': point.price,
+            'groupby': point.groupby,
+            'metadata': point.metadata,
+        })
+
     @staticmethod
     def __filter_func(begin, end, filters, mtypes, doc):
         type_filter = lambda doc: doc['type'] in mtypes if mtypes else True
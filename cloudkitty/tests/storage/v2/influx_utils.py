@@ -19,6 +19,7 @@ from influxdb import resultset
 
 from cloudkitty.storage.v2.influx import _sanitized_groupby
 from cloudkitty.storage.v2.influx import InfluxClient
+from cloudkitty.storage.v2.influx import PERIOD_FIELD_NAME
 
 
 class FakeInfluxClient(InfluxClient):
@@ -37,10 +38,30 @@ class FakeInfluxClient(InfluxClient):
 
     def __init__(self, **kwargs):
         super(FakeInfluxClient, self).__init__(autocommit=False)
+        self._points = []
 
     def commit(self):
         pass
 
+    def append_point(self, metric_type, start, period, point):
+        measurement_fields = dict(point.metadata)
+        measurement_fields['qty'] = float(point.qty)
+        measurement_fields['price'] = float(point.price)
+        measurement_fields['unit'] = point.unit
+        measurement_fields['groupby'] = '|'.join(point.groupby.keys())
+        measurement_fields['metadata'] = '|'.join(point.metadata.keys())
+        measurement_fields[PERIOD_FIELD_NAME] = period
+
+        measurement_tags = dict(point.groupby)
+        measurement_tags['type'] = metric_type
+
+        self._points.append({
+            'measurement': 'dataframes',
+            'tags': measurement_tags,
+            'fields': measurement_fields,
+            'time': start,
+        })
+
     @staticmethod
     def __filter_func(types, filters, begin, end, elem):
         if elem['time'] < begin or elem['time'] >= end:
@@ -105,42 +126,33 @@ class FakeInfluxClient(InfluxClient):
 
         return resultset.ResultSet(total)
 
-    def retrieve(self,
-                 types,
-                 filters,
-                 begin, end,
-                 offset=0, limit=1000, paginate=True):
-        output = copy.deepcopy(self.total_sample)
+    def iter_total(self, *args, **kwargs):
+        for (_, series_groupby), points in self.get_total(
+                *args, **kwargs).items():
+            for point in points:
+                yield series_groupby or {}, point
 
+    def iter_points(self, types, filters, begin, end):
         filter_func = functools.partial(
             self.__filter_func, types, filters, begin, end)
-        points = list(filter(filter_func, self._points))
-
-        columns = set()
-        for point in points:
-            columns.update(point['tags'].keys())
-            columns.update(point['fields'].keys())
-        columns.add('time')
-
-        series = {
-            'name': 'dataframes',
-            'columns': list(columns),
-        }
-        values = []
-
-        def __get_tag_or_field(point, key):
-            if key == 'time':
-                return point['time'].isoformat()
-            return point['tags'].get(key) or point['fields'].get(key)
+        points = sorted(filter(filter_func, self._points),
+                        key=lambda point: point['time'])
 
         for point in points:
-            values.append([__get_tag_or_field(point, key)
-                           for key in series['columns']])
+            output = dict(point['fields'])
+            output.update(point['tags'])
+            output['time'] = point['time'].isoformat()
+            yield output
 
-        series['values'] = values
-        output['series'] = [series]
-
-        return len(list(points)), resultset.ResultSet(output)
+    def retrieve(self,
+                 types,
+                 filters,
+                 begin, end,
+                 offset=0, limit=1000, paginate=True):
+        points = list(self.iter_points(types, filters, begin, end))
+        if paginate:
+            return len(points), iter(points[offset:offset + limit])
+        return len(points), iter(points)
 
     def delete(self, begin, end, filters):
 
@@ -162,3 +174,9 @@ class FakeInfluxClient(InfluxClient):
 
     def retention_policy_exists(self, database, policy):
         return True
+
+    def get_rollups_start(self):
+        return None
+
+    def drop_rollups_start(self):
+        pass
@@ -16,9 +16,13 @@ import collections
 import copy
 from datetime import datetime
 from datetime import timedelta
+import gzip
+import json
 import unittest
 
 from dateutil import tz
+import influxdb
+from influxdb import line_protocol
 import mock
 
 from cloudkitty import dataframe
@@ -92,6 +96,103 @@ class TestInfluxDBStorage(TestCase):
             self.assertEqual(type_, 'amazing_type')
 
 
+class TestLineProtocolWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.client = mock.MagicMock()
+        self.start = datetime(2019, 1, 1, 12, 30, 15, 42, tzinfo=tz.UTC)
+        self.point = dataframe.DataPoint(
+            'instance',
+            '1.5',
+            '0.42',
+            {'project_id': 'a b,c=d', 'empty': ''},
+            {'flavor': 'm1 "tiny"', 'qty': 'ignored', 'path': 'C:\\'},
+        )
+
+    def _get_writer(self, **kwargs):
+        return influx.LineProtocolWriter(
+            self.client, 'cloudkitty', 'autogen', **kwargs)
+
+    def _get_lines(self, call, compressed=False):
+        data = call[1]['data']
+        if compressed:
+            data = gzip.decompress(data)
+        return data.decode('utf-8').splitlines()
+
+    def test_format_point_matches_influxdb_client(self):
+        fields = dict(self.point.metadata)
+        fields['qty'] = float(self.point.qty)
+        fields['price'] = float(self.point.price)
+        fields['unit'] = self.point.unit
+        fields['groupby'] = '|'.join(self.point.groupby.keys())
+        fields['metadata'] = '|'.join(self.point.metadata.keys())
+        fields[influx.PERIOD_FIELD_NAME] = 3600
+        tags = dict(self.point.groupby)
+        tags['type'] = 'my type'
+        expected = line_protocol.make_line(
+            'dataframes', tags=tags, fields=fields, time=self.start)
+
+        self.assertEqual(
+            self._get_writer().format_point(
+                'my type', self.start, 3600, self.point),
+            expected)
+
+    def test_append_writes_by_chunks(self):
+        writer = self._get_writer(chunk_size=2)
+        for _ in range(5):
+            writer.append('instance', self.start, 3600, self.point)
+        self.assertEqual(self.client.request.call_count, 2)
+        writer.flush()
+        self.assertEqual(self.client.request.call_count, 3)
+
+        calls = self.client.request.call_args_list
+        self.assertEqual(
+            [len(self._get_lines(call)) for call in calls], [2, 2, 1])
+        self.assertEqual(calls[0][1]['params'],
+                         {'db': 'cloudkitty', 'rp': 'autogen'})
+        self.assertEqual(calls[0][1]['expected_response_code'], 204)
+        self.assertNotIn('Content-Encoding', calls[0][1]['headers'])
+
+    def test_append_without_autocommit(self):
+        writer = self._get_writer(chunk_size=2, autocommit=False)
+        for _ in range(3):
+            writer.append('instance', self.start, 3600, self.point)
+        self.client.request.assert_not_called()
+        writer.flush()
+        self.assertEqual(self.client.request.call_count, 2)
+
+    def test_flush_without_points(self):
+        self._get_writer().flush()
+        self.client.request.assert_not_called()
+
+    def test_gzip(self):
+        writer = self._get_writer(use_gzip=True)
+        writer.append('instance', self.start, 3600, self.point)
+        writer.flush()
+        call = self.client.request.call_args
+        self.assertEqual(call[1]['headers']['Content-Encoding'], 'gzip')
+        self.assertEqual(
+            self._get_lines(call, compressed=True),
+            [writer.format_point('instance', self.start, 3600, self.point)])
+
+    def test_concurrent_writes(self):
+        writer = self._get_writer(chunk_size=1, concurrency=3)
+        for _ in range(10):
+            writer.append('instance', self.start, 3600, self.point)
+        writer.flush()
+        writer.close()
+        self.assertEqual(self.client.request.call_count, 10)
+
+    def test_flush_raises_write_errors(self):
+        self.client.request.side_effect = [None, ValueError('oops'), None]
+        writer = self._get_writer(chunk_size=1, concurrency=2)
+        for _ in range(3):
+            writer.append('instance', self.start, 3600, self.point)
+        self.assertRaises(ValueError, writer.flush)
+        writer.close()
+        self.assertEqual(self.client.request.call_count, 3)
+
+
 class FakeResultSet(object):
     def __init__(self, points=[], items=[]):
         self._points = points
@@ -124,40 +225,183 @@ class TestInfluxClient(unittest.TestCase):
     def test_get_filter_query_no_filters(self):
         self.assertEqual(self.client._get_filter_query({}), '')
 
+    def _mock_chunked_response(self, *chunks):
+        response = mock.MagicMock()
+        response.iter_lines.return_value = [
+            json.dumps(chunk).encode('utf-8') for chunk in chunks]
+        self._storage._conn._conn.request = m = mock.MagicMock(
+            return_value=response)
+        return m
+
     def test_retrieve_format_with_pagination(self):
         self._storage._conn._conn.query = m = mock.MagicMock()
-        m.return_value = (FakeResultSet(), FakeResultSet())
+        m.return_value = FakeResultSet(points=[
+            {'time': '2019-01-01T00:00:00Z', 'count': 600},
+            {'time': '2019-01-01T01:00:00Z', 'count': 600},
+        ])
+        request = self._mock_chunked_response()
 
-        self._storage.retrieve()
+        output = self._storage.retrieve(offset=1000)
+        self.assertEqual(output['total'], 1200)
         m.assert_called_once_with(
             "SELECT COUNT(groupby) FROM \"dataframes\""
             " WHERE time >= '{0}'"
-            " AND time < '{1}';"
+            " AND time < '{1}'"
+            " GROUP BY time(3600s) fill(none);".format(
+                self.period_begin, self.period_end,
+            ))
+        self.assertEqual(
+            request.call_args[1]['params']['q'],
             "SELECT * FROM \"dataframes\""
             " WHERE time >= '{0}'"
             " AND time < '{1}'"
-            " LIMIT 1000 OFFSET 0;".format(
+            " AND time >= '2019-01-01T01:00:00Z'"
+            " LIMIT 1000 OFFSET 400;".format(
                 self.period_begin, self.period_end,
             ))
+        self.assertEqual(request.call_args[1]['params']['chunked'], 'true')
 
     def test_retrieve_format_with_types(self):
         self._storage._conn._conn.query = m = mock.MagicMock()
-        m.return_value = (FakeResultSet(), FakeResultSet())
+        m.return_value = FakeResultSet(points=[
+            {'time': '2019-01-01T00:00:00Z', 'count': 10},
+        ])
+        request = self._mock_chunked_response()
 
         self._storage.retrieve(metric_types=['foo', 'bar'])
         m.assert_called_once_with(
             "SELECT COUNT(groupby) FROM \"dataframes\""
             " WHERE time >= '{0}'"
             " AND time < '{1}'"
-            " AND (type='foo' OR type='bar');"
+            " AND (type='foo' OR type='bar')"
+            " GROUP BY time(3600s) fill(none);".format(
+                self.period_begin, self.period_end,
+            ))
+        self.assertEqual(
+            request.call_args[1]['params']['q'],
             "SELECT * FROM \"dataframes\""
             " WHERE time >= '{0}'"
             " AND time < '{1}'"
             " AND (type='foo' OR type='bar')"
-            " LIMIT 1000 OFFSET 0;".format(
+            " AND time >= '2019-01-01T00:00:00Z'"
+            " LIMIT 1000;".format(
                 self.period_begin, self.period_end,
             ))
 
+    def test_retrieve_counts_points_once_for_all_pages(self):
+        self._storage._conn._conn.query = m = mock.MagicMock(
+            return_value=FakeResultSet(points=[
+                {'time': '2019-01-01T00:00:00Z', 'count': 1500}]))
+        request = self._mock_chunked_response()
+
+        for offset in (0, 1000):
+            self.assertEqual(
+                self._storage.retrieve(offset=offset)['total'], 1500)
+        self.assertEqual(m.call_count, 1)
+        self.assertEqual(request.call_count, 2)
+
+        influx.CONF.set_override(
+            'page_counts_cache_ttl', 0, 'storage_influxdb')
+        self.addCleanup(influx.CONF.clear_override,
+                        'page_counts_cache_ttl', 'storage_influxdb')
+        self._storage._conn._page_counts.clear()
+        for offset in (0, 1000):
+            self._storage.retrieve(offset=offset)
+        self.assertEqual(m.call_count, 3)
+
+    def test_retrieve_without_pagination_does_not_count(self):
+        self._storage._conn._conn.query = m = mock.MagicMock()
+        self._mock_chunked_response({'results': [{
+            'statement_id': 0, 'series': [{
+                'name': 'dataframes',
+                'columns': ['time', 'type', 'unit', 'qty', 'price',
+                            'groupby', 'metadata', 'project_id'],
+                'values': [['2019-01-01T00:00:00Z', 'instance', 'instance',
+                            1, 0.5, 'project_id', '', project_id]
+                           for project_id in ('a', 'b', 'c')],
+            }]}]})
+
+        output = self._storage.retrieve(paginate=False)
+        self.assertEqual(output['total'], 3)
+        self.assertEqual(len(output['dataframes']), 1)
+        m.assert_not_called()
+
+    def test_retrieve_offset_out_of_range(self):
+        self._storage._conn._conn.query = mock.MagicMock(
+            return_value=FakeResultSet(points=[
+                {'time': '2019-01-01T00:00:00Z', 'count': 10}]))
+        request = self._mock_chunked_response()
+
+        output = self._storage.retrieve(offset=10)
+        self.assertEqual(output, {'total': 10, 'dataframes': []})
+        request.assert_not_called()
+
+    def test_iter_dataframes_reads_chunks(self):
+        columns = ['time', 'type', 'unit', 'qty', 'price', 'groupby',
+                   'metadata', 'project_id', influx.PERIOD_FIELD_NAME]
+
+        def chunk(time, project_ids):
+            return {'results': [{'statement_id': 0, 'series': [{
+                'name': 'dataframes',
+                'columns': columns,
+                'values': [[time, 'instance', 'instance', 1, 0.5,
+                            'project_id', '', project_id, 3600]
+                           for project_id in project_ids],
+            }]}]}
+
+        request = self._mock_chunked_response(
+            chunk('2019-01-01T00:00:00Z', ['a', 'b']),
+            chunk('2019-01-01T00:00:00Z', ['c']),
+            chunk('2019-01-01T01:00:00Z', ['a']),
+        )
+        frames = self._storage.iter_dataframes(
+            begin=datetime(2019, 1, 1, tzinfo=tz.UTC),
+            end=datetime(2019, 1, 2, tzinfo=tz.UTC))
+        request.assert_not_called()
+
+        frames = list(frames)
+        self.assertEqual(request.call_count, 1)
+        self.assertEqual(len(frames), 2)
+        self.assertEqual(
+            [frame.start for frame in frames],
+            [datetime(2019, 1, 1, hour, tzinfo=tz.UTC) for hour in (0, 1)])
+        self.assertEqual(
+            [[point.groupby['project_id'] for _, point in frame.iterpoints()]
+             for frame in frames],
+            [['a', 'b', 'c'], ['a']])
+
+    def test_iter_dataframes_raises_query_errors(self):
+        self._mock_chunked_response(
+            {'results': [{'statement_id': 0, 'error': 'oops'}]})
+        self.assertRaises(
+            influxdb.exceptions.InfluxDBClientError,
+            list, self._storage.iter_dataframes())
+
+    def test_total_paginates_streamed_series(self):
+        def chunk(*project_ids):
+            return {'results': [{'statement_id': 0, 'series': [{
+                'name': 'dataframes',
+                'tags': {'project_id': project_id},
+                'columns': ['time', 'qty', 'price'],
+                'values': [['2019-01-01T00:00:00Z', 1, 2]],
+            } for project_id in project_ids]}]}
+
+        request = self._mock_chunked_response(
+            chunk('e', 'c'), chunk('a', 'd'), chunk('b'))
+        output = self._storage.total(
+            groupby=['project_id'], offset=1, limit=2)
+
+        self.assertEqual(request.call_args[1]['params']['chunked'], 'true')
+        self.assertEqual(output['total'], 5)
+        self.assertEqual(
+            [elem['project_id'] for elem in output['results']], ['b', 'c'])
+
+    def test_paginate_total_without_groupby(self):
+        results = [{'qty': idx} for idx in range(5)]
+        self.assertEqual(
+            influx.InfluxStorage._paginate_total(iter(results), [], 3, 10),
+            (5, results[3:]))
+
     def test_delete_no_parameters(self):
         self._storage._conn._conn.query = m = mock.MagicMock()
         self._storage.delete()
@@ -208,3 +452,123 @@ class TestInfluxClient(unittest.TestCase):
         self._storage.delete(end=datetime(2019, 1, 2))
         m.assert_called_once_with("""DELETE FROM "dataframes" WHERE """
                                   """time < '2019-01-02T00:00:00';""")
+
+
+class TestInfluxStorageRollups(TestCase):
+
+    def setUp(self):
+        super(TestInfluxStorageRollups, self).setUp()
+        self.conf.set_override('use_rollups', True, 'storage_influxdb')
+        self.storage = influx.InfluxStorage()
+        self.storage._conn = self.conn = mock.MagicMock()
+        self.conn.get_rollups_start.return_value = datetime(
+            2019, 1, 2, tzinfo=tz.UTC)
+
+    @staticmethod
+    def _dt(*args):
+        return datetime(2019, 1, *args, tzinfo=tz.UTC)
+
+    @staticmethod
+    def _total(*series):
+        return iter([(groupby, {'qty': qty, 'price': price})
+                     for groupby, qty, price in series])
+
+    def test_get_total_sources_without_rollups(self):
+        self.conn.get_rollups_start.return_value = None
+        self.assertEqual(
+            self.storage._get_total_sources(self._dt(1), self._dt(5)),
+            [(influx.MEASUREMENT, self._dt(1), self._dt(5))])
+
+    def test_get_total_sources(self):
+        self.assertEqual(
+            self.storage._get_total_sources(self._dt(1, 12), self._dt(5, 6)),
+            [(influx.MEASUREMENT, self._dt(1, 12), self._dt(2)),
+             (influx.DAILY_ROLLUP_MEASUREMENT, self._dt(2), self._dt(5)),
+             (influx.ROLLUP_MEASUREMENT, self._dt(5), self._dt(5, 6))])
+
+    def test_get_total_sources_ragged_edges(self):
+        self.assertEqual(
+            self.storage._get_total_sources(self._dt(3, 12), self._dt(5, 6)),
+            [(influx.ROLLUP_MEASUREMENT, self._dt(3, 12), self._dt(4)),
+             (influx.DAILY_ROLLUP_MEASUREMENT, self._dt(4), self._dt(5)),
+             (influx.ROLLUP_MEASUREMENT, self._dt(5), self._dt(5, 6))])
+
+    def test_get_total_sources_within_a_day(self):
+        self.assertEqual(
+            self.storage._get_total_sources(self._dt(3, 1), self._dt(3, 5)),
+            [(influx.ROLLUP_MEASUREMENT, self._dt(3, 1), self._dt(3, 5))])
+
+    def test_total_merges_sources(self):
+        self.conn.iter_total.side_effect = [
+            self._total(({'type': 'a'}, 1, 2)),
+            self._total(({'type': 'a'}, 3, 4), ({'type': 'b'}, 5, 6)),
+            self._total(({'type': 'b'}, 1, 1)),
+        ]
+        output = self.storage.total(
+            groupby=['type'], begin=self._dt(1, 12), end=self._dt(5, 6),
+            filters={'project_id': 'p'})
+
+        self.assertEqual(
+            [call[1]['measurement']
+             for call in self.conn.iter_total.call_args_list],
+            [influx.MEASUREMENT, influx.DAILY_ROLLUP_MEASUREMENT,
+             influx.ROLLUP_MEASUREMENT])
+        self.assertEqual(output['total'], 2)
+        self.assertEqual(
+            [(elem['type'], elem['qty'], elem['rate'])
+             for elem in output['results']],
+            [('a', 4, 6), ('b', 6, 7)])
+
+    def test_total_with_other_groupby_uses_raw_points(self):
+        self.conn.iter_total.return_value = self._total()
+        self.storage.total(groupby=['id'], begin=self._dt(1), end=self._dt(5))
+        self.conn.iter_total.assert_called_once_with(
+            None, self._dt(1), self._dt(5), ['id'], None)
+        self.conn.get_rollups_start.assert_not_called()
+
+    def test_push_writes_rollups(self):
+        frame = dataframe.DataFrame(
+            start=self._dt(3, 5), end=self._dt(3, 6))
+        for qty, price in ((1, 2), (3, 4)):
+            frame.add_point(dataframe.DataPoint(
+                'instance', qty, price, {'project_id': 'p'}, {}), 'instance')
+        self.storage.push([frame])
+
+        self.assertEqual(self.conn.append_point.call_count, 2)
+        self.conn.write_rollups.assert_called_once_with(
+            {(self._dt(3, 5), 3600, 'instance', 'p'): [4, 6]})
+        self.conn.update_daily_rollups.assert_called_once_with(
+            self._dt(3), self._dt(4), {'project_id': 'p'})
+
+    def test_check_rollups_sets_start(self):
+        self.conn.get_rollups_start.return_value = None
+        self.storage._check_rollups()
+        start = self.conn.set_rollups_start.call_args[0][0]
+        self.assertEqual((start.hour, start.minute, start.second), (0, 0, 0))
+        self.assertGreater(start, tzutils.localized_now())
+
+    def test_check_rollups_drops_start_when_disabled(self):
+        self.storage._use_rollups = False
+        self.storage._check_rollups()
+        self.conn.drop_rollups_start.assert_called_once_with()
+        self.conn.set_rollups_start.assert_not_called()
+
+    def test_delete_scope_updates_rollups(self):
+        filters = {'project_id': 'p'}
+        self.storage.delete(begin=self._dt(3, 5), filters=filters)
+        self.assertEqual(self.conn.delete.call_args_list, [
+            mock.call(self._dt(3, 5), None, filters),
+            mock.call(self._dt(3, 5), None, filters,
+                      measurement=influx.ROLLUP_MEASUREMENT),
+            mock.call(self._dt(3), None, filters,
+                      measurement=influx.DAILY_ROLLUP_MEASUREMENT),
+        ])
+        self.conn.update_daily_rollups.assert_called_once_with(
+            self._dt(3), self._dt(4), filters)
+
+    def test_delete_other_filters_postpones_rollups(self):
+        self.storage.delete(begin=self._dt(3), end=self._dt(3, 5),
+                            filters={'id': 'foo'})
+        self.conn.delete.assert_called_once_with(
+            self._dt(3), self._dt(3, 5), {'id': 'foo'})
+        self.conn.set_rollups_start.assert_called_once_with(self._dt(4))
@@ -132,6 +132,60 @@ class TestDataPoint(unittest.TestCase):
         }
         self.assertRaises(ValueError, dataframe.DataPoint.from_dict, invalid)
 
+    def test_from_dicts_matches_schema(self):
+        dicts = [
+            {"vol": {"unit": "u", "qty": 1.2},
+             "rating": {"price": 3},
+             "groupby": {"g": 1}, "metadata": {2: None}},
+            {"vol": {"unit": "u", "qty": "3"},
+             "groupby": {}, "metadata": {}},
+        ]
+        expected = []
+        for dict_ in dicts:
+            valid = dataframe.DATAPOINT_SCHEMA(copy.deepcopy(dict_))
+            expected.append(dataframe.DataPoint(
+                valid["vol"]["unit"], valid["vol"]["qty"],
+                valid["rating"]["price"], valid["groupby"],
+                valid["metadata"]))
+        self.assertEqual(expected, dataframe.DataPoint.from_dicts(dicts))
+
+    def test_from_dicts_invalid(self):
+        valid = {"vol": {"unit": "u", "qty": 1},
+                 "groupby": {}, "metadata": {}}
+        invalid_dicts = [
+            dict(valid, extra={}),
+            dict(valid, vol={"unit": "u", "qty": 1, "extra": 1}),
+            dict(valid, vol={"unit": 1, "qty": 1}),
+            dict(valid, vol={"unit": "u", "qty": "notanumber"}),
+            dict(valid, rating={"price": "notanumber"}),
+            dict(valid, rating={"extra": 1}),
+            dict(valid, groupby=None),
+            {"vol": {"unit": "u", "qty": 1}, "groupby": {}},
+            "notadict",
+        ]
+        for invalid in invalid_dicts:
+            self.assertRaises(ValueError, dataframe.DataPoint.from_dicts,
+                              [valid, invalid])
+
+    def test_from_dicts_legacy(self):
+        dict_ = {"vol": {"unit": "u", "qty": 1}, "desc": {"a": "b"}}
+        self.assertEqual(
+            [dataframe.DataPoint("u", 1, 0, {"a": "b"}, {})],
+            dataframe.DataPoint.from_dicts([dict_], legacy=True))
+        self.assertIn("desc", dict_)
+        self.assertRaises(ValueError, dataframe.DataPoint.from_dicts,
+                          [dict_])
+
+    def test_from_trusted_dict(self):
+        dict_ = {"vol": {"unit": "u", "qty": 1.2},
+                 "rating": {"price": decimal.Decimal(3)},
+                 "desc": {"a": 1}}
+        point = dataframe.DataPoint.from_trusted_dict(dict_, legacy=True)
+        self.assertEqual(
+            dataframe.DataPoint.from_dict(copy.deepcopy(dict_), legacy=True),
+            point)
+        self.assertIsInstance(point.groupby, datastructures.ImmutableDict)
+
     def test_set_price(self):
         point = dataframe.DataPoint(**self.default_params)
         self.assertEqual(point.price, decimal.Decimal(0))
@@ -246,6 +300,20 @@ class TestDataFrame(unittest.TestCase):
             }).as_dict(),
         )
 
+    def test_from_dict_trusted(self):
+        start = datetime.datetime(2019, 1, 2, 12, tzinfo=tz.UTC)
+        end = datetime.datetime(2019, 1, 2, 13, tzinfo=tz.UTC)
+        point = dataframe.DataPoint(
+            'unit', 0, 0, {'g_one': 'one'}, {'m_two': 'two'})
+        dict_ = {
+            'period': {'begin': start.isoformat(), 'end': end},
+            'usage': {'metric_x': [point.as_dict(mutable=True)]},
+        }
+        self.assertEqual(
+            dataframe.DataFrame.from_dict(copy.deepcopy(dict_)).as_dict(),
+            dataframe.DataFrame.from_dict(dict_, trusted=True).as_dict(),
+        )
+
     def test_from_dict_invalid_dict(self):
         self.assertRaises(
             ValueError, dataframe.DataFrame.from_dict, {'usage': None})
@@ -793,6 +793,57 @@ class HashMapRatingTest(tests.TestCase):
         self.assertEqual(expect,
                          self._hash._entries)
 
+    def test_load_rates_in_bulk(self):
+        self._generate_hashmap_rules()
+        with mock.patch.object(self._db_api, 'get_mapping') as get_mapping, \
+                mock.patch.object(self._db_api, 'get_threshold') as \
+                get_threshold:
+            self._hash.reload_config()
+            get_mapping.assert_not_called()
+            get_threshold.assert_not_called()
+        self.assertEqual(
+            {'cost': decimal.Decimal('2'), 'type': 'flat'},
+            self._hash._entries['compute']['fields']['flavor']['mappings'][
+                '_DEFAULT_']['m1.tiny'])
+
+    def test_load_rules(self):
+        self._generate_hashmap_rules()
+        rules = self._db_api.load_rules(tenant_uuid=self._tenant_id)
+        self.assertEqual(['compute'],
+                         [name for _, name in rules['services']])
+        self.assertEqual(['flavor', 'memory'],
+                         [name for _, _, name in rules['fields']])
+        # Global entries come first
+        self.assertEqual(
+            [None, 'm1.tiny', 'm1.large', 'm1.tiny'],
+            [mapping['value'] for mapping in rules['mappings']])
+        self.assertEqual(
+            [decimal.Decimal('1.337'), decimal.Decimal('2')],
+            [mapping['cost'] for mapping in rules['mappings']
+             if mapping['value'] == 'm1.tiny'])
+        self.assertEqual(
+            [decimal.Decimal('64'), decimal.Decimal('128'),
+             decimal.Decimal('64')],
+            [threshold['level'] for threshold in rules['thresholds']])
+
+        rules = self._db_api.load_rules()
+        self.assertEqual(3, len(rules['mappings']))
+        self.assertEqual(2, len(rules['thresholds']))
+
+    def test_rules_version_changes_with_rules(self):
+        mapping_ids, _ = self._generate_hashmap_rules()
+        version = self._hash.get_rules_version()
+        self.assertEqual(version, self._hash.get_rules_version())
+        self._db_api.update_mapping(mapping_ids[0], cost='1.43')
+        self.assertNotEqual(version, self._hash.get_rules_version())
+        version = self._hash.get_rules_version()
+        self._db_api.delete_mapping(mapping_ids[0])
+        self.assertNotEqual(version, self._hash.get_rules_version())
+        version = self._hash.get_rules_version()
+        self.assertRaises(api.NoSuchMapping,
+                          self._db_api.delete_mapping, mapping_ids[0])
+        self.assertEqual(version, self._hash.get_rules_version())
+
     def test_load_mappings(self):
         mapping_list = []
         service_db = self._db_api.create_service('compute')
@@ -1183,3 +1234,131 @@ class HashMapRatingTest(tests.TestCase):
         actual_data = [self._hash.process(d) for d in expected_data]
         self.assertEqual(df_dicts, [d.as_dict(mutable=True)
                                     for d in actual_data])
+
+    def test_process_matches_scalar_path(self):
+        self._generate_hashmap_rules()
+        service_db = self._db_api.get_service(name='compute')
+        self._db_api.create_threshold(
+            level='2',
+            cost='1.5',
+            map_type='rate',
+            service_id=service_db.service_id)
+        self._hash.reload_config()
+
+        for frame in copy.deepcopy(CK_RESOURCES_DATA):
+            expected = dataframe.DataFrame(start=frame.start, end=frame.end)
+            for service_name, point in frame.iterpoints():
+                self._hash._res = {}
+                self._hash.process_services(service_name, point)
+                self._hash.process_fields(service_name, point)
+                expected.add_point(
+                    self._hash.add_rating_informations(point), service_name)
+            self.assertEqual(expected.as_dict(mutable=True),
+                             self._hash.process(frame).as_dict(mutable=True))
+
+    def test_process_reuses_rules_between_points(self):
+        self._generate_hashmap_rules()
+        service_db = self._db_api.get_service(name='compute')
+        self._db_api.create_threshold(
+            level='2',
+            cost='1.5',
+            map_type='rate',
+            service_id=service_db.service_id)
+        self._hash.reload_config()
+
+        frame = dataframe.DataFrame(start=CK_RESOURCES_DATA[0].start,
+                                    end=CK_RESOURCES_DATA[0].end)
+        for i, qty in enumerate((1, 2, 1, 3, 2)):
+            frame.add_point(dataframe.DataPoint(
+                'instance', qty, 0, {'id': str(i)},
+                {'flavor': 'm1.tiny' if i % 2 else 'm1.nano',
+                 'memory': '64',
+                 'image_id': ['unhashable'] if i == 4 else 'a41fba37'}),
+                'compute')
+        expected = []
+        for service_name, point in frame.iterpoints():
+            self._hash._res = {}
+            self._hash.process_services(service_name, point)
+            self._hash.process_fields(service_name, point)
+            expected.append(self._hash.add_rating_informations(point).price)
+
+        with mock.patch.object(
+                self._hash._plan, 'evaluate',
+                wraps=self._hash._plan.evaluate) as evaluate_mock:
+            output = self._hash.process(frame)
+        self.assertEqual(
+            expected, [point.price for _, point in output.iterpoints()])
+        # The first four points share two keys, the last one can't be cached
+        self.assertEqual(3, evaluate_mock.call_count)
+
+    def test_rules_key_of_equal_values_with_different_str(self):
+        self._hash._plan = hash.plan.RatingPlan({
+            'compute': {
+                'mappings': {},
+                'thresholds': {},
+                'fields': {
+                    'memory': {
+                        'mappings': {
+                            '_DEFAULT_': {
+                                '1': {'type': 'flat',
+                                      'cost': decimal.Decimal(1)},
+                                '1.0': {'type': 'flat',
+                                        'cost': decimal.Decimal(2)},
+                                'True': {'type': 'flat',
+                                         'cost': decimal.Decimal(3)}}},
+                        'thresholds': {}},
+                },
+            },
+        })
+        points = [
+            dataframe.DataPoint('instance', 1, 0, {}, {'memory': value})
+            for value in (1, 1.0, True, decimal.Decimal('1'), 1.0)]
+        # 1, 1.0, True and Decimal('1') are equal and have the same hash
+        self.assertEqual(
+            [1, 2, 3, 1, 2],
+            [point.price for point in
+             self._hash._process_batch('compute', points)])
+
+    def test_rating_plan_indexes_rules(self):
+        entries = {
+            'compute': {
+                'mappings': {},
+                'thresholds': {},
+                'fields': {
+                    'flavor': {
+                        'mappings': {
+                            '_DEFAULT_': {
+                                'flavor_{}'.format(i): {
+                                    'type': 'flat',
+                                    'cost': decimal.Decimal(i)}
+                                for i in range(1000)},
+                            'test_group': {
+                                'flavor_42': {
+                                    'type': 'rate',
+                                    'cost': decimal.Decimal(2)}}},
+                        'thresholds': {}},
+                    'memory': {
+                        'mappings': {},
+                        'thresholds': {
+                            'test_group': {
+                                decimal.Decimal(128): {
+                                    'type': 'flat',
+                                    'cost': decimal.Decimal('0.2')},
+                                decimal.Decimal(64): {
+                                    'type': 'flat',
+                                    'cost': decimal.Decimal('0.1')}}}},
+                },
+            },
+        }
+        rating_plan = hash.plan.RatingPlan(entries)
+        point = dataframe.DataPoint(
+            'instance', 1, 0, {}, {'flavor': 'flavor_42', 'memory': '100'})
+        update_result = mock.Mock()
+        rating_plan.evaluate('compute', point, update_result)
+        rating_plan.evaluate('unknown', point, update_result)
+        self.assertEqual([
+            mock.call('_DEFAULT_', 'flat', decimal.Decimal(42)),
+            mock.call('test_group', 'rate', decimal.Decimal(2)),
+            mock.call('test_group', 'flat', decimal.Decimal('0.1'),
+                      decimal.Decimal(64), True, 'field'),
+        ], update_result.call_args_list)
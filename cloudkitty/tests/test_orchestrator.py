@@ -15,17 +15,24 @@
 #
 import datetime
 
+from dateutil import tz
+import fixtures
+import futurist
 import mock
 from oslo_messaging import conffixture
 from stevedore import extension
+import tooz
 from tooz import coordination
 from tooz.drivers import file
 
 from cloudkitty import collector
+from cloudkitty import dataframe
+from cloudkitty.db import api as db_api
 from cloudkitty import orchestrator
 from cloudkitty.storage.v2 import influx
 from cloudkitty import storage_state
 from cloudkitty import tests
+from cloudkitty import utils as ck_utils
 from cloudkitty.utils import tz as tzutils
 
 
@@ -168,6 +175,109 @@ class OrchestratorTest(tests.TestCase):
             self.assertEqual(1, worker._processors[2].obj.priority)
 
 
+class ProcessorCacheTest(tests.TestCase):
+
+    def setUp(self):
+        super(ProcessorCacheTest, self).setUp()
+        self.versions = {'fake1': 1, 'fake2': None}
+        self.reloads = []
+        test = self
+
+        class FakeModule1(tests.FakeRatingModule):
+            module_name = 'fake1'
+
+            @classmethod
+            def get_rules_version(cls):
+                return test.versions['fake1']
+
+            def reload_config(self):
+                test.reloads.append(self)
+
+        class FakeModule2(tests.FakeRatingModule):
+            module_name = 'fake2'
+
+            @classmethod
+            def get_rules_version(cls):
+                return test.versions['fake2']
+
+        self.plugins = [FakeModule1, FakeModule2]
+        self.module_db = db_api.get_instance().get_module_info()
+        for priority, plugin in enumerate(self.plugins):
+            self.module_db.set_priority(plugin.module_name, 2 - priority)
+            self.module_db.set_state(plugin.module_name, True)
+
+        self.cache = orchestrator.ProcessorCache(check_interval=60, size=2)
+        self.cache._manager = extension.ExtensionManager.make_test_instance([
+            extension.Extension(plugin.module_name, None, plugin, None)
+            for plugin in self.plugins], orchestrator.PROCESSORS_NAMESPACE)
+
+    def _get_processors(self, tenant_id, now=0):
+        with mock.patch('time.time', return_value=now):
+            return self.cache.get_processors(tenant_id)
+
+    def test_processors_are_reused(self):
+        with mock.patch.object(self.plugins[0], 'get_rules_version',
+                               return_value=1) as get_version:
+            first = self._get_processors('a')
+            second = self._get_processors('a', now=30)
+        self.assertEqual(['fake1', 'fake2'], [p.name for p in first])
+        self.assertIs(first[0].obj, second[0].obj)
+        # Processors without a rules version are never reused
+        self.assertIsNot(first[1].obj, second[1].obj)
+        self.assertIsNot(first[0].obj, self._get_processors('b')[0].obj)
+        get_version.assert_called_once_with()
+
+    def test_modules_are_not_instantiated_for_checks(self):
+        with mock.patch.object(self.plugins[0], '__init__',
+                               return_value=None) as init:
+            self._get_processors('a')
+            self.cache.invalidate()
+            self._get_processors('a')
+        init.assert_called_once_with(tenant_id='a')
+
+    def test_disabled_modules_are_skipped(self):
+        self.module_db.set_state('fake2', False)
+        self.assertEqual(
+            ['fake1'], [p.name for p in self._get_processors('a')])
+
+    def test_processors_are_reloaded_when_rules_change(self):
+        first = self._get_processors('a')
+        self.versions['fake1'] = 2
+        self.assertIs(first[0].obj, self._get_processors('a', now=30)[0].obj)
+        self.assertEqual([], self.reloads)
+        self.assertIs(first[0].obj, self._get_processors('a', now=60)[0].obj)
+        self.assertEqual([first[0].obj], self.reloads)
+        self._get_processors('a', now=90)
+        self.assertEqual(1, len(self.reloads))
+
+    def test_invalidate(self):
+        first = self._get_processors('a')
+        self.versions['fake1'] = 2
+        self.cache.invalidate()
+        self.assertIs(first[0].obj, self._get_processors('a')[0].obj)
+        self.assertEqual([first[0].obj], self.reloads)
+
+    def test_lru_eviction(self):
+        first = self._get_processors('a')
+        self._get_processors('b')
+        self._get_processors('c')
+        self.assertIsNot(first[0].obj, self._get_processors('a')[0].obj)
+
+    def test_size_follows_scope_count(self):
+        self.cache = orchestrator.ProcessorCache(check_interval=60)
+        self.cache._manager = extension.ExtensionManager.make_test_instance(
+            [extension.Extension('fake1', None, self.plugins[0], None)],
+            orchestrator.PROCESSORS_NAMESPACE)
+        self.cache.set_scope_count(3)
+        first = [self._get_processors(scope)[0].obj
+                 for scope in ('a', 'b', 'c')]
+        self.assertEqual(
+            first, [self._get_processors(scope)[0].obj
+                    for scope in ('a', 'b', 'c')])
+        self.cache.set_scope_count(1)
+        self.assertIsNot(first[1], self._get_processors('b')[0].obj)
+
+
 class WorkerTest(tests.TestCase):
 
     def setUp(self):
@@ -178,8 +288,10 @@ class WorkerTest(tests.TestCase):
                 self._tenant_id = 'a'
                 self._worker_id = '0'
                 self._log_prefix = '[IGNORE THIS MESSAGE]'
+                self._executor = futurist.ThreadPoolExecutor()
 
         self.worker = FakeWorker()
+        self.addCleanup(self.worker._executor.shutdown)
         self.worker._collect = mock.MagicMock()
 
     def test_do_collection_all_valid(self):
@@ -212,3 +324,329 @@ class WorkerTest(tests.TestCase):
             i for i in side_effect
             if not isinstance(i, collector.NoDataCollected)
         ], output)
+
+
+class WorkerCatchUpTest(tests.TestCase):
+
+    def setUp(self):
+        super(WorkerCatchUpTest, self).setUp()
+
+        class FakeWorker(orchestrator.Worker):
+            def __init__(self):
+                self._tenant_id = 'a'
+                self._worker_id = '0'
+                self._log_prefix = '[IGNORE THIS MESSAGE]'
+                self._period = 3600
+                self._wait_time = 7200
+                self._collector = mock.MagicMock()
+                self._storage = mock.MagicMock()
+                self._state = mock.MagicMock()
+                self._state_writer = storage_state.StateWriter(self._state)
+                self._processors = []
+                self._conf = {'metrics': {'metric_one': {}}}
+                self._executor = futurist.ThreadPoolExecutor()
+                self._pipeline_executor = futurist.ThreadPoolExecutor(
+                    max_workers=2)
+                self._scope_batch = None
+
+        self.worker = FakeWorker()
+        self.addCleanup(self.worker._executor.shutdown)
+        self.addCleanup(self.worker._pipeline_executor.shutdown)
+        self.conf.set_override('catch_up_periods', 24, 'orchestrator')
+        self.now = datetime.datetime(2019, 1, 2, tzinfo=tz.tzutc())
+
+    def _get_catch_up_periods(self, timestamp):
+        with mock.patch.object(tzutils, 'localized_now',
+                               return_value=self.now):
+            return self.worker._get_catch_up_periods(timestamp)
+
+    def test_get_catch_up_periods_disabled(self):
+        self.conf.set_override('catch_up_periods', 1, 'orchestrator')
+        self.assertEqual(1, self._get_catch_up_periods(
+            datetime.datetime(2019, 1, 1, tzinfo=tz.tzutc())))
+
+    def test_get_catch_up_periods_below_threshold(self):
+        self.assertEqual(1, self._get_catch_up_periods(
+            datetime.datetime(2019, 1, 1, 21, tzinfo=tz.tzutc())))
+
+    def test_get_catch_up_periods_limited_by_window(self):
+        self.assertEqual(24, self._get_catch_up_periods(
+            datetime.datetime(2018, 12, 30, tzinfo=tz.tzutc())))
+
+    def test_get_catch_up_periods_limited_by_lag(self):
+        self.assertEqual(10, self._get_catch_up_periods(
+            datetime.datetime(2019, 1, 1, 12, tzinfo=tz.tzutc())))
+
+    def test_collect_frames_splits_periods(self):
+        start = datetime.datetime(2019, 1, 1, tzinfo=tz.tzutc())
+        hour = datetime.timedelta(hours=1)
+        point = dataframe.DataPoint('instance', 1, 0, {}, {})
+        self.worker._collector.retrieve_periods.return_value = (
+            'metric_one', {start: [point], start + 2 * hour: [point]})
+
+        frames = self.worker._collect_frames(['metric_one'], start, 3)
+
+        self.worker._collector.retrieve_periods.assert_called_once_with(
+            'metric_one', start, start + 3 * hour, 'a')
+        self.assertEqual(
+            [start, start + hour, start + 2 * hour],
+            [frame.start for frame in frames])
+        self.assertEqual(
+            [1, 0, 1], [len(list(frame.iterpoints())) for frame in frames])
+
+    def test_run_pushes_caught_up_frames_at_once(self):
+        start = datetime.datetime(2019, 1, 1, tzinfo=tz.tzutc())
+        hour = datetime.timedelta(hours=1)
+        point = dataframe.DataPoint('instance', 1, 0, {}, {})
+        self.worker._check_state = mock.Mock(return_value=start)
+        self.worker._collector.retrieve_periods.return_value = (
+            'metric_one', {start: [point]})
+
+        # 22 periods can be collected: the scope is up to date after 24
+        # periods minus the 2 wait periods
+        self.conf.set_override('catch_up_periods', 22, 'orchestrator')
+        with mock.patch.object(tzutils, 'localized_now',
+                               return_value=self.now):
+            self.worker.run()
+
+        self.worker._storage.push.assert_called_once()
+        frames = self.worker._storage.push.call_args[0][0]
+        self.assertEqual(22, len(frames))
+        self.worker._state.set_states_bulk.assert_called_once_with(
+            {'a': start + 21 * hour},
+            fetcher=None, collector=None, scope_key=None)
+
+    def test_run_pipeline_stores_periods_in_order(self):
+        start = datetime.datetime(2019, 1, 1, tzinfo=tz.tzutc())
+        hour = datetime.timedelta(hours=1)
+        self.conf.set_override('catch_up_periods', 1, 'orchestrator')
+        self.worker._check_state = mock.Mock(return_value=start)
+        self.worker._collector.retrieve.return_value = (
+            'metric_one', [dataframe.DataPoint('instance', 1, 0, {}, {})])
+
+        with mock.patch.object(tzutils, 'localized_now',
+                               return_value=self.now):
+            self.worker.run()
+
+        self.assertEqual(22, self.worker._storage.push.call_count)
+        self.assertEqual(
+            [mock.call({'a': start + i * hour},
+                       fetcher=None, collector=None, scope_key=None)
+             for i in range(22)],
+            self.worker._state.set_states_bulk.call_args_list)
+
+    def test_run_batches_state_commits(self):
+        start = datetime.datetime(2019, 1, 1, tzinfo=tz.tzutc())
+        hour = datetime.timedelta(hours=1)
+        self.conf.set_override('catch_up_periods', 1, 'orchestrator')
+        self.worker._state_writer = storage_state.StateWriter(
+            self.worker._state, batch_size=10)
+        self.worker._check_state = mock.Mock(return_value=start)
+        self.worker._collector.retrieve.return_value = (
+            'metric_one', [dataframe.DataPoint('instance', 1, 0, {}, {})])
+
+        with mock.patch.object(tzutils, 'localized_now',
+                               return_value=self.now):
+            self.worker.run()
+
+        # 22 periods: two full batches, the remaining states are committed
+        # before run() returns
+        self.assertEqual(22, self.worker._storage.push.call_count)
+        self.assertEqual(
+            [mock.call({'a': start + i * hour},
+                       fetcher=None, collector=None, scope_key=None)
+             for i in (9, 19, 21)],
+            self.worker._state.set_states_bulk.call_args_list)
+
+    def test_run_pipeline_propagates_storage_errors(self):
+        start = datetime.datetime(2019, 1, 1, tzinfo=tz.tzutc())
+        self.conf.set_override('catch_up_periods', 1, 'orchestrator')
+        self.worker._check_state = mock.Mock(return_value=start)
+        self.worker._collector.retrieve.return_value = (
+            'metric_one', [dataframe.DataPoint('instance', 1, 0, {}, {})])
+        self.worker._storage.push.side_effect = ValueError
+
+        with mock.patch.object(tzutils, 'localized_now',
+                               return_value=self.now):
+            self.assertRaises(ValueError, self.worker.run)
+        self.worker._state.set_states_bulk.assert_not_called()
+
+
+class ScopeBatchTest(tests.TestCase):
+
+    def setUp(self):
+        super(ScopeBatchTest, self).setUp()
+        self.start = datetime.datetime(2019, 1, 1, tzinfo=tz.tzutc())
+        self.end = self.start + datetime.timedelta(hours=1)
+        # States are the start of the last processed period
+        previous = self.start - datetime.timedelta(hours=1)
+        self.states = {'a': previous, 'b': previous,
+                       'c': previous - datetime.timedelta(hours=1),
+                       'd': self.start, 'new': None}
+        state_manager = mock.MagicMock()
+        state_manager.get_cached_state.side_effect = self.states.get
+        self.collector = mock.MagicMock()
+        self.collector.collector_name = 'fake'
+        self.collector.conf = {'metric_one': {'alt_name': 'metric_alt'}}
+        self.point = dataframe.DataPoint('instance', 1, 0, {}, {})
+        self.collector.fetch_all_scopes.side_effect = (
+            lambda metric, start, end, scope_ids:
+                {s: [self.point] for s in scope_ids if s != 'b'})
+        self.batch = orchestrator.ScopeBatch(
+            self.collector, state_manager, 3600, 2)
+        self.batch.reset(['a', 'b', 'c', 'd', 'new'])
+
+    def test_retrieve_collects_due_scopes_at_once(self):
+        self.assertEqual(
+            ('metric_alt', [self.point]),
+            self.batch.retrieve('metric_one', self.start, self.end, 'a'))
+        self.assertRaises(
+            collector.NoDataCollected,
+            self.batch.retrieve, 'metric_one', self.start, self.end, 'b')
+        self.collector.fetch_all_scopes.assert_called_once_with(
+            'metric_one', self.start, self.end, mock.ANY)
+        self.assertEqual(
+            ['a', 'b'],
+            sorted(self.collector.fetch_all_scopes.call_args[0][3]))
+        # All the data of the batch has been handed out
+        self.assertEqual({}, self.batch._data)
+
+    def test_retrieve_scope_outside_of_batch(self):
+        start = self.start - datetime.timedelta(hours=1)
+        self.assertEqual(
+            ('metric_alt', [self.point]),
+            self.batch.retrieve('metric_one', start, self.start, 'c'))
+        self.collector.fetch_all_scopes.assert_called_once_with(
+            'metric_one', start, self.start, ['c'])
+
+    def test_retrieve_includes_scopes_without_state(self):
+        with mock.patch.object(tzutils, 'get_month_start',
+                               return_value=self.start):
+            self.batch.retrieve('metric_one', self.start, self.end, 'a')
+        self.assertEqual(
+            ['a', 'b', 'new'],
+            sorted(self.collector.fetch_all_scopes.call_args[0][3]))
+
+    def test_reset_drops_data(self):
+        self.batch.retrieve('metric_one', self.start, self.end, 'a')
+        self.batch.reset(['a', 'b'])
+        self.assertEqual({}, self.batch._data)
+
+
+class ScopeSchedulerTest(tests.TestCase):
+
+    def setUp(self):
+        super(ScopeSchedulerTest, self).setUp()
+        self.now = datetime.datetime(2019, 1, 2, tzinfo=tz.tzutc())
+        self.states = {
+            'late': datetime.datetime(2019, 1, 1, tzinfo=tz.tzutc()),
+            'up_to_date': datetime.datetime(2019, 1, 1, 21,
+                                            tzinfo=tz.tzutc()),
+            'new': None,
+        }
+        state_manager = mock.Mock()
+        state_manager.get_states_bulk.side_effect = lambda ids: {
+            scope_id: self.states.get(scope_id) for scope_id in ids}
+        state_manager.get_cached_state.side_effect = self.states.get
+        self.scheduler = orchestrator.ScopeScheduler(state_manager, 3600, 2)
+
+    def _reset_scheduler(self, scope_ids):
+        with mock.patch.object(tzutils, 'localized_now',
+                               return_value=self.now):
+            self.scheduler.reset(scope_ids)
+
+    def test_scopes_are_popped_by_due_date(self):
+        self._reset_scheduler(['up_to_date', 'new', 'late'])
+        self.scheduler._state.get_states_bulk.assert_called_once_with(
+            ['up_to_date', 'new', 'late'])
+        self.assertEqual(3, len(self.scheduler))
+        self.assertEqual(
+            ['late', 'new', 'up_to_date'],
+            [self.scheduler.pop() for _ in range(3)])
+
+    def test_due_date_takes_wait_periods_into_account(self):
+        self._reset_scheduler(['up_to_date'])
+        due = self.scheduler.next_due()
+        self.assertEqual(
+            datetime.datetime(2019, 1, 2, 0, 0, 1, tzinfo=tz.tzutc()), due)
+
+        # The next period of the scope is collectable at the due date, but
+        # not one second earlier
+        with mock.patch.object(tzutils, 'localized_now', return_value=due):
+            self.assertIsNotNone(ck_utils.check_time_state(
+                self.states['up_to_date'], 3600, 2))
+        with mock.patch.object(
+                tzutils, 'localized_now',
+                return_value=due - datetime.timedelta(seconds=1)):
+            self.assertIsNone(ck_utils.check_time_state(
+                self.states['up_to_date'], 3600, 2))
+
+    def test_schedule_not_before(self):
+        self.scheduler.schedule('late', not_before=self.now)
+        self.assertEqual(
+            datetime.datetime(2019, 1, 2, 0, 0, 1, tzinfo=tz.tzutc()),
+            self.scheduler.next_due())
+
+    def test_equal_due_dates_keep_insertion_order(self):
+        self.states['late_too'] = self.states['late']
+        self._reset_scheduler(['late_too', 'late'])
+        self.assertEqual('late_too', self.scheduler.pop())
+        self.assertEqual('late', self.scheduler.pop())
+        self.assertIsNone(self.scheduler.next_due())
+
+
+class ScopePartitioningTest(tests.TestCase):
+
+    def setUp(self):
+        super(ScopePartitioningTest, self).setUp()
+        self.conf.set_override('scope_partitioning', True, 'orchestrator')
+        lock_dir = self.useFixture(fixtures.TempDir()).path
+        self.conf.set_override(
+            'coordination_url', 'file://' + lock_dir, 'orchestrator')
+
+        class FakeOrchestrator(orchestrator.Orchestrator):
+            def __init__(self, worker_id):
+                self._worker_id = worker_id
+                self.coord = coordination.get_coordinator(
+                    'file://' + lock_dir,
+                    'member-{}'.format(worker_id).encode('ascii'))
+                self.coord.start()
+                self._init_partitioner()
+                self._executor = mock.Mock()
+                self._pipeline_executor = mock.Mock()
+
+        self.orchestrators = [FakeOrchestrator(i) for i in range(2)]
+        for orch in self.orchestrators:
+            self.addCleanup(orch.terminate)
+        self.tenants = ['tenant-{}'.format(i) for i in range(100)]
+
+    def test_scopes_are_distributed_between_workers(self):
+        owned = []
+        for orch in self.orchestrators:
+            orch._partition_changed()
+            owned.append(set(
+                t for t in self.tenants if orch._owns_tenant(t)))
+
+        self.assertEqual(set(self.tenants), owned[0] | owned[1])
+        self.assertEqual(set(), owned[0] & owned[1])
+        self.assertGreater(len(owned[0]), 0)
+        self.assertGreater(len(owned[1]), 0)
+
+    def test_scopes_are_rebalanced_when_a_worker_leaves(self):
+        self.orchestrators[0]._partition_changed()
+        self.orchestrators[1].coord.leave_group(
+            orchestrator.PARTITIONER_GROUP).get()
+
+        self.assertTrue(self.orchestrators[0]._partition_changed())
+        self.assertTrue(all(
+            self.orchestrators[0]._owns_tenant(t) for t in self.tenants))
+
+    def test_fallback_without_group_support(self):
+        orch = self.orchestrators[0]
+        orch._partitioner = None
+        with mock.patch.object(orch.coord, 'join_partitioned_group',
+                               side_effect=tooz.NotImplemented):
+            orch._init_partitioner()
+        self.assertIsNone(orch._partitioner)
+        self.assertFalse(orch._partition_changed())
+        self.assertTrue(orch._owns_tenant('tenant-0'))
@@ -16,14 +16,18 @@
 import copy
 import decimal
 import hashlib
+import os
+import pickle
 import zlib
 
 import mock
 from oslo_utils import uuidutils
 import six
 
+from cloudkitty.rating import instrumentation
 from cloudkitty.rating import pyscripts
 from cloudkitty.rating.pyscripts.db import api
+from cloudkitty.rating.pyscripts import executor
 from cloudkitty import tests
 
 
@@ -101,6 +105,51 @@ for period in data:
                         'price': decimal.Decimal(1.0)}
 """.encode('utf-8')
 
+ENTRY_POINT_POLICY = """
+import decimal
+
+USE_ENTRY_POINTS = True
+PRICES = {'m1.nano': decimal.Decimal(1)}
+calls = []
+
+
+def process(frame):
+    calls.append(len(frame))
+    for period in frame:
+        for service, resources in period['usage'].items():
+            for resource in resources:
+                price = PRICES.get(resource['desc'].get('flavor'))
+                if price is not None:
+                    resource['rating'] = {'price': price}
+""".encode('utf-8')
+
+BATCH_POLICY = """
+USE_ENTRY_POINTS = True
+batches = []
+
+
+def process(frame):
+    raise Exception()
+
+
+def process_batch(frames):
+    batches.append(len(frames))
+    return [{'rated': frame} for frame in frames]
+""".encode('utf-8')
+
+STATEFUL_POLICY = """
+import os
+
+USE_ENTRY_POINTS = True
+PID = os.getpid()
+calls = []
+
+
+def process(frame):
+    calls.append(frame)
+    return {'calls': len(calls), 'pid': PID}
+""".encode('utf-8')
+
 
 class PyScriptsRatingTest(tests.TestCase):
     def setUp(self):
@@ -292,6 +341,46 @@ class PyScriptsRatingTest(tests.TestCase):
             TEST_CODE2_CHECKSUM,
             self._pyscripts._scripts[policy_db.script_id]['checksum'])
 
+    def test_compile_only_modified_scripts(self):
+        policy1_db = self._db_api.create_script('policy1', TEST_CODE1)
+        policy2_db = self._db_api.create_script('policy2', TEST_CODE2)
+        self._pyscripts.reload_config()
+        self.assertEqual(2, self._pyscripts.compiled_count)
+        self.assertEqual(0, self._pyscripts.skipped_compile_count)
+        code = self._pyscripts._scripts[policy2_db.script_id]['code']
+
+        self._db_api.update_script(policy1_db.script_id, data=TEST_CODE3)
+        self._pyscripts.reload_config()
+        self.assertEqual(3, self._pyscripts.compiled_count)
+        self.assertEqual(1, self._pyscripts.skipped_compile_count)
+        self.assertIs(
+            code, self._pyscripts._scripts[policy2_db.script_id]['code'])
+        self.assertEqual(
+            TEST_CODE3_CHECKSUM,
+            self._pyscripts._scripts[policy1_db.script_id]['checksum'])
+
+    def test_reload_records_compilations(self):
+        policy_db = self._db_api.create_script('policy1', TEST_CODE1)
+        self._db_api.create_script('policy2', TEST_CODE2)
+        instr = mock.Mock()
+        with mock.patch.object(instrumentation, 'get_instrumentation',
+                               return_value=instr):
+            self._pyscripts.reload_config()
+            self._db_api.update_script(policy_db.script_id, data=TEST_CODE3)
+            self._pyscripts.reload_config()
+        self.assertEqual([
+            mock.call('pyscripts', 2, 0),
+            mock.call('pyscripts', 1, 1),
+        ], instr.record_compilations.call_args_list)
+
+    def test_list_checksums(self):
+        policy1_db = self._db_api.create_script('policy1', TEST_CODE1)
+        policy2_db = self._db_api.create_script('policy2', TEST_CODE2)
+        self.assertEqual({
+            policy1_db.script_id: TEST_CODE1_CHECKSUM,
+            policy2_db.script_id: TEST_CODE2_CHECKSUM,
+        }, self._db_api.list_checksums())
+
     def test_exec_code_isolation(self):
         self._db_api.create_script('policy1', TEST_CODE1)
         self._db_api.create_script('policy2', TEST_CODE3)
@@ -309,3 +398,144 @@ class PyScriptsRatingTest(tests.TestCase):
         compute_list[2]['rating'] = {'price': decimal.Decimal('1')}
         self._pyscripts.process(actual_data)
         self.assertEqual(expected_data, actual_data)
+
+    def test_process_rating_in_subprocess(self):
+        self._db_api.create_script('policy1', COMPLEX_POLICY1)
+        self._pyscripts.reload_config()
+        expected_data = copy.deepcopy(CK_RESOURCES_DATA)
+        self._pyscripts.process(expected_data)
+
+        self.conf.set_override('execution_backend', 'subprocess', 'pyscripts')
+        pool = executor.SubprocessExecutor(1)
+        self.addCleanup(pool.close)
+        with mock.patch.object(executor, 'get_executor', return_value=pool):
+            actual_data = self._pyscripts.process(
+                copy.deepcopy(CK_RESOURCES_DATA))
+            self.assertEqual(expected_data, actual_data)
+            self._db_api.create_script('policy2', TEST_CODE3)
+            self._pyscripts.reload_config()
+            self.assertRaises(NameError, self._pyscripts.process, {})
+
+    def test_subprocess_limits(self):
+        pool = executor.SubprocessExecutor(1, cpu_time_limit=1, timeout=30)
+        self.addCleanup(pool.close)
+        busy_loop = compile('while True: pass', '<busy>', 'exec')
+        self.assertRaises(executor.ScriptTimeout, pool.execute,
+                          [('busy', busy_loop)], [{}])
+        # The worker survives the CPU time limit
+        code = compile('data["a"] = 1', '<ok>', 'exec')
+        self.assertEqual({'a': 1}, pool.execute([('ok', code)], [{}])[0])
+
+        pool = executor.SubprocessExecutor(1, timeout=1)
+        self.addCleanup(pool.close)
+        sleep = compile('import time; time.sleep(60)', '<sleep>', 'exec')
+        self.assertRaises(executor.ScriptTimeout, pool.execute,
+                          [('sleep', sleep)], [{}])
+        self.assertEqual({'a': 1}, pool.execute([('ok', code)], [{}])[0])
+
+    def test_subprocess_splits_frames_between_workers(self):
+        pool = executor.SubprocessExecutor(2, cpu_time_limit=5, timeout=10)
+        calls = []
+
+        def apply_async(func, args):
+            calls.append('submit')
+
+            def get(timeout):
+                calls.append(('get', timeout))
+                return func(*args)
+            return mock.Mock(get=get)
+
+        fake_pool = mock.Mock()
+        fake_pool.apply_async.side_effect = apply_async
+        code = compile('data["rated"] = True', '<ok>', 'exec')
+        with mock.patch.object(pool, '_get_pool', return_value=fake_pool), \
+                mock.patch.object(executor, '_cpu_time_limit') as limit:
+            frames = pool.execute([('ok', code)], [{'a': i} for i in range(5)])
+        self.assertEqual([{'a': i, 'rated': True} for i in range(5)], frames)
+        # All chunks are submitted before waiting for the first one
+        self.assertEqual(['submit', 'submit', 'get', 'get'],
+                         [c if c == 'submit' else c[0] for c in calls])
+        self.assertAlmostEqual(30, calls[2][1], delta=1)
+        self.assertAlmostEqual(20, calls[3][1], delta=1)
+        self.assertEqual(
+            [3, 2], [len(pickle.loads(c[0][1][2]))  # nosec
+                     for c in fake_pool.apply_async.call_args_list])
+        # Limits are given for a single frame
+        self.assertEqual([mock.call(15), mock.call(10)],
+                         limit.call_args_list)
+
+    def test_process_entry_points(self):
+        self._db_api.create_script('policy1', COMPLEX_POLICY1)
+        self._pyscripts.reload_config()
+        expected_data = copy.deepcopy(CK_RESOURCES_DATA)
+        self._pyscripts.process(expected_data)
+
+        self._db_api.delete_script('policy1')
+        policy_db = self._db_api.create_script('policy2', ENTRY_POINT_POLICY)
+        self._pyscripts.reload_config()
+        for _ in range(2):
+            actual_data = copy.deepcopy(CK_RESOURCES_DATA)
+            self._pyscripts.process(actual_data)
+            self.assertEqual(expected_data, actual_data)
+
+        # The state of the script is kept as long as it isn't modified
+        self._pyscripts.reload_config()
+        module = self._pyscripts._modules[policy_db.script_id]
+        self.assertEqual([1, 1], module['calls'])
+        self._db_api.update_script(
+            policy_db.script_id, data=ENTRY_POINT_POLICY + b'\n')
+        self._pyscripts.reload_config()
+        module = self._pyscripts._modules[policy_db.script_id]
+        self.assertEqual([], module['calls'])
+
+    def test_process_batch_entry_point(self):
+        policy_db = self._db_api.create_script('policy1', BATCH_POLICY)
+        self._pyscripts.reload_config()
+        self.assertEqual([{'rated': 1}, {'rated': 2}],
+                         self._pyscripts.process_batch([1, 2]))
+        module = self._pyscripts._modules[policy_db.script_id]
+        self.assertEqual([2], module['batches'])
+
+    def test_entry_point_without_process(self):
+        self._db_api.create_script('policy1', b'USE_ENTRY_POINTS = True')
+        self.assertRaises(ValueError, self._pyscripts.reload_config)
+
+    def test_process_entry_points_in_subprocess(self):
+        self._db_api.create_script('policy1', BATCH_POLICY)
+        self._db_api.create_script('policy2', TEST_CODE1)
+        self._pyscripts.reload_config()
+        self.conf.set_override('execution_backend', 'subprocess', 'pyscripts')
+        pool = executor.SubprocessExecutor(1)
+        self.addCleanup(pool.close)
+        with mock.patch.object(executor, 'get_executor', return_value=pool):
+            self.assertEqual([{'rated': 1}, {'rated': 2}],
+                             self._pyscripts.process_batch([1, 2]))
+
+    def test_entry_points_not_loaded_in_parent_with_subprocess(self):
+        self._db_api.create_script('policy1', STATEFUL_POLICY)
+        self.conf.set_override('execution_backend', 'subprocess', 'pyscripts')
+        with mock.patch.object(executor, 'load_module') as load_module:
+            self._pyscripts.reload_config()
+        load_module.assert_not_called()
+        self.assertEqual({}, self._pyscripts._modules)
+
+        pool = executor.SubprocessExecutor(1)
+        self.addCleanup(pool.close)
+        with mock.patch.object(executor, 'get_executor', return_value=pool):
+            frame = self._pyscripts.process({})
+        self.assertNotEqual(os.getpid(), frame['pid'])
+
+    def test_subprocess_entry_points_state_per_scope(self):
+        pool = executor.SubprocessExecutor(2)
+        self.addCleanup(pool.close)
+        code = compile(STATEFUL_POLICY, '<stateful>', 'exec')
+
+        first = pool.execute([('s', code)], [{}, {}], scope_id='a')
+        second = pool.execute([('s', code)], [{}, {}], scope_id='a')
+        other = pool.execute([('s', code)], [{}], scope_id='b')
+        # All the frames of a scope are rated by the same worker, which
+        # keeps the state of the scope between calls
+        self.assertEqual([1, 2, 3, 4],
+                         [f['calls'] for f in first + second])
+        self.assertEqual(1, len(set(f['pid'] for f in first + second)))
+        self.assertEqual([1], [f['calls'] for f in other])
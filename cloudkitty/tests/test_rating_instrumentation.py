@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+# Copyright 2019 Objectif Libre
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+import datetime
+import os
+import socket
+import tempfile
+
+import mock
+
+from cloudkitty import dataframe
+from cloudkitty import orchestrator
+from cloudkitty.rating import instrumentation
+from cloudkitty import tests
+
+
+def _get_frame(**counts):
+    start = datetime.datetime(2019, 1, 1)
+    frame = dataframe.DataFrame(start, start + datetime.timedelta(hours=1))
+    for metric_type, count in counts.items():
+        frame.add_points(
+            [dataframe.DataPoint('unit', 1, 0, {}, {}) for _ in range(count)],
+            metric_type)
+    return frame
+
+
+class RatingInstrumentationTest(tests.TestCase):
+
+    def test_count_points(self):
+        frames = [_get_frame(cpu=2, ram=1), _get_frame(cpu=3)]
+        self.assertEqual({'cpu': 5, 'ram': 1},
+                         instrumentation.count_points(frames))
+        legacy = [{'usage': {'cpu': [{}, {}]}}, {'usage': {'cpu': [{}]}}]
+        self.assertEqual({'cpu': 3}, instrumentation.count_points(legacy))
+
+    def test_call_records_in_sink(self):
+        sink = mock.Mock()
+        instr = instrumentation.RatingInstrumentation(sink)
+        frames = [_get_frame(cpu=2)]
+        method = mock.Mock(return_value='rated')
+        with mock.patch('time.monotonic', side_effect=[10, 12.5]):
+            self.assertEqual(
+                'rated', instr.call('hashmap', 'scope', method, frames))
+        method.assert_called_once_with(frames)
+        sink.record.assert_called_once_with(
+            'hashmap', 'scope', 2.5, {'cpu': 2})
+
+    def test_worker_uses_instrumentation(self):
+        sink = mock.Mock()
+        processor = mock.Mock()
+        processor.name = 'noop'
+        processor.obj.process_batch.return_value = ['rated']
+        with mock.patch.object(
+                instrumentation, 'get_instrumentation',
+                return_value=instrumentation.RatingInstrumentation(sink)), \
+                mock.patch.object(
+                    orchestrator.BaseWorker, '_load_rating_processors'):
+            worker = orchestrator.BaseWorker('scope')
+        worker._processors = [processor]
+        self.assertEqual(['rated'], orchestrator.Worker._rate_frames(
+            worker, [_get_frame(cpu=1)]))
+        sink.record.assert_called_once_with(
+            'noop', 'scope', mock.ANY, {'cpu': 1})
+
+    def test_split_duration(self):
+        self.assertEqual({'cpu': 1.5, 'ram': 0.5},
+                         instrumentation.split_duration(
+                             2, {'cpu': 3, 'ram': 1}))
+        self.assertEqual({}, instrumentation.split_duration(2, {}))
+
+    def test_worker_terminate_flushes_instrumentation(self):
+        instr = mock.Mock()
+        worker = mock.Mock(_partitioner=None)
+        with mock.patch.object(instrumentation, 'get_instrumentation',
+                               return_value=instr):
+            orchestrator.Orchestrator.terminate(worker)
+        instr.flush.assert_called_once_with()
+
+    def test_get_instrumentation_disabled_by_default(self):
+        self.assertIsNone(instrumentation.get_instrumentation())
+
+
+class PrometheusTextfileSinkTest(tests.TestCase):
+
+    def setUp(self):
+        super(PrometheusTextfileSinkTest, self).setUp()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = os.path.join(self.tmpdir.name, 'metrics.prom')
+
+    def test_histograms_and_counters(self):
+        sink = instrumentation.PrometheusTextfileSink(
+            self.path, buckets=[1, 0.1], write_interval=3600, worker=0)
+        sink.record('hashmap', 'a', 0.05, {'cpu': 10})
+        sink.record('hashmap', 'a', 0.5, {'cpu': 4, 'ram': 1})
+        sink.record('hashmap', 'a', 2, {'cpu': 4})
+        labels = 'module="hashmap",scope="a"'
+        cpu = labels + ',type="cpu",worker="0"'
+        ram = labels + ',type="ram",worker="0"'
+        labels += ',worker="0"'
+        expected = [
+            'cloudkitty_rating_duration_seconds_bucket'
+            '{le="0.1",%s} 1' % labels,
+            'cloudkitty_rating_duration_seconds_bucket'
+            '{le="1",%s} 2' % labels,
+            'cloudkitty_rating_duration_seconds_bucket'
+            '{le="+Inf",%s} 3' % labels,
+            'cloudkitty_rating_duration_seconds_sum{%s} 2.55' % labels,
+            'cloudkitty_rating_duration_seconds_count{%s} 3' % labels,
+            # 0.5s are split between 4 cpu and 1 ram points
+            'cloudkitty_rating_type_duration_seconds_bucket'
+            '{le="0.1",module="hashmap",scope="a",type="cpu",'
+            'worker="0"} 1',
+            'cloudkitty_rating_type_duration_seconds_sum{%s} 2.45' % cpu,
+            'cloudkitty_rating_type_duration_seconds_count{%s} 3' % cpu,
+            'cloudkitty_rating_type_duration_seconds_sum{%s} 0.1' % ram,
+            'cloudkitty_rating_type_duration_seconds_count{%s} 1' % ram,
+            'cloudkitty_rating_points_total{%s} 18' % cpu,
+            'cloudkitty_rating_points_total{%s} 1' % ram,
+            'cloudkitty_rating_points_per_second{%s} 2.0' % labels,
+        ]
+        lines = sink.format().splitlines()
+        for line in expected:
+            self.assertIn(line, lines)
+
+    def test_compilations(self):
+        sink = instrumentation.PrometheusTextfileSink(
+            self.path, write_interval=3600, worker=0)
+        self.assertNotIn('compilations', sink.format())
+        sink.record_compilations('pyscripts', 2, 0)
+        sink.record_compilations('pyscripts', 1, 1)
+        lines = sink.format().splitlines()
+        self.assertIn('cloudkitty_rating_script_compilations_total'
+                      '{module="pyscripts",result="compiled",worker="0"} 3',
+                      lines)
+        self.assertIn('cloudkitty_rating_script_compilations_total'
+                      '{module="pyscripts",result="skipped",worker="0"} 1',
+                      lines)
+
+    def test_file_written_on_interval_and_flush(self):
+        sink = instrumentation.PrometheusTextfileSink(
+            self.path, write_interval=3600, worker=1)
+        path = os.path.join(self.tmpdir.name, 'metrics-1.prom')
+        sink.record('noop', 'a', 0.1, {'cpu': 1})
+        with open(path) as f:
+            self.assertIn('cloudkitty_rating_points_total{module="noop",'
+                          'scope="a",type="cpu",worker="1"} 1', f.read())
+        sink.record('noop', 'a', 0.1, {'cpu': 1})
+        with open(path) as f:
+            self.assertNotIn('worker="1"} 2', f.read())
+        sink.flush()
+        with open(path) as f:
+            self.assertIn('type="cpu",worker="1"} 2', f.read())
+        self.assertEqual(['metrics-1.prom'], os.listdir(self.tmpdir.name))
+
+    def test_one_file_per_worker(self):
+        instrumentation.set_worker_id(3)
+        self.addCleanup(instrumentation.set_worker_id, None)
+        sink = instrumentation.PrometheusTextfileSink(self.path)
+        sink.flush()
+        self.assertEqual(['metrics-3.prom'], os.listdir(self.tmpdir.name))
+
+
+class StatsdSinkTest(tests.TestCase):
+
+    def test_record(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(server.close)
+        server.bind(('127.0.0.1', 0))
+        server.settimeout(5)
+        sink = instrumentation.StatsdSink(
+            '127.0.0.1', server.getsockname()[1], prefix='ck')
+        sink.record('pyscripts', 'scope.1', 0.25, {'cpu': 10, 'ram': 5})
+        self.assertEqual([
+            'ck.scope_1.pyscripts.duration:250.000|ms',
+            'ck.scope_1.pyscripts.cpu.duration:166.667|ms',
+            'ck.scope_1.pyscripts.ram.duration:83.333|ms',
+            'ck.scope_1.pyscripts.cpu.points:10|c',
+            'ck.scope_1.pyscripts.ram.points:5|c',
+            'ck.scope_1.pyscripts.points_per_second:60.000|g',
+        ], server.recv(4096).decode('utf-8').splitlines())
+
+    def test_record_compilations(self):
+        server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(server.close)
+        server.bind(('127.0.0.1', 0))
+        server.settimeout(5)
+        sink = instrumentation.StatsdSink(
+            '127.0.0.1', server.getsockname()[1], prefix='ck')
+        sink.record_compilations('pyscripts', 1, 3)
+        self.assertEqual([
+            'ck.pyscripts.scripts_compiled:1|c',
+            'ck.pyscripts.scripts_unchanged:3|c',
+        ], server.recv(4096).decode('utf-8').splitlines())
@@ -21,8 +21,10 @@ import itertools
 
 import mock
 
+from cloudkitty import db
 from cloudkitty import storage_state
 from cloudkitty import tests
+from cloudkitty.utils import tz as tzutils
 
 
 class StateManagerTest(tests.TestCase):
@@ -134,3 +136,154 @@ class StateManagerTest(tests.TestCase):
             self.assertEqual(r_mock.state, new_state)
             session_mock.commit.assert_called_once()
             session_mock.add.assert_not_called()
+
+
+class StateManagerBulkTest(tests.TestCase):
+
+    def setUp(self):
+        super(StateManagerBulkTest, self).setUp()
+        self.conf.set_override('backend', 'fetcher1', 'fetcher')
+        self.conf.set_override('collector', 'collector1', 'collect')
+        self.conf.set_override('scope_key', 'scope_key', 'collect')
+        self._state = storage_state.StateManager()
+        self._state.init()
+        self._state.clear_cache()
+        self.addCleanup(self._state.clear_cache)
+
+    def _add_legacy_state(self, identifier, state):
+        session = db.get_session()
+        session.begin()
+        session.add(self._state.model(identifier=identifier, state=state))
+        session.commit()
+        session.close()
+
+    def test_get_states_bulk(self):
+        self._state.bulk_chunk_size = 2
+        self._state.set_state('a', datetime(2042, 1, 1))
+        self._state.set_state('b', datetime(2042, 1, 2))
+        self._state.set_state('c', datetime(2042, 1, 3), fetcher='other')
+        self._add_legacy_state('d', datetime(2042, 1, 4))
+
+        states = self._state.get_states_bulk(['a', 'b', 'c', 'd', 'e'])
+        self.assertEqual(
+            {'a': tzutils.utc_to_local(datetime(2042, 1, 1)),
+             'b': tzutils.utc_to_local(datetime(2042, 1, 2)),
+             'c': None,
+             'd': tzutils.utc_to_local(datetime(2042, 1, 4)),
+             'e': None},
+            states)
+
+    def test_get_states_bulk_fills_cache(self):
+        self._state.set_state('a', datetime(2042, 1, 1))
+        self._state.clear_cache()
+        self._state.get_states_bulk(['a', 'b'])
+
+        with mock.patch.object(self._state, 'get_state') as get_state:
+            self.assertEqual(tzutils.utc_to_local(datetime(2042, 1, 1)),
+                             self._state.get_cached_state('a'))
+            self.assertIsNone(self._state.get_cached_state('b'))
+            get_state.assert_not_called()
+
+    def test_set_state_writes_through_cache(self):
+        self._state.get_states_bulk(['a'])
+        storage_state.StateManager().set_state('a', datetime(2042, 1, 1))
+
+        with mock.patch.object(self._state, 'get_state') as get_state:
+            self.assertEqual(tzutils.utc_to_local(datetime(2042, 1, 1)),
+                             self._state.get_cached_state('a'))
+            get_state.assert_not_called()
+
+    def test_get_cached_state_loads_missing_states(self):
+        self._state.set_state('a', datetime(2042, 1, 1))
+        self._state.clear_cache()
+        self.assertEqual(tzutils.utc_to_local(datetime(2042, 1, 1)),
+                         self._state.get_cached_state('a'))
+
+    def test_set_states_bulk(self):
+        self._state.bulk_chunk_size = 2
+        self._state.set_state('a', datetime(2042, 1, 1))
+        self._add_legacy_state('b', datetime(2042, 1, 2))
+        self._state.set_state('c', datetime(2042, 1, 3), fetcher='other',
+                              collector='collector1', scope_key='scope_key')
+
+        self._state.set_states_bulk({
+            'a': datetime(2042, 2, 1),
+            'b': datetime(2042, 2, 2),
+            'c': datetime(2042, 2, 3),
+        })
+        self._state.clear_cache()
+
+        self.assertEqual(
+            {'a': tzutils.utc_to_local(datetime(2042, 2, 1)),
+             'b': tzutils.utc_to_local(datetime(2042, 2, 2)),
+             'c': tzutils.utc_to_local(datetime(2042, 2, 3))},
+            self._state.get_states_bulk(['a', 'b', 'c']))
+        self.assertEqual(
+            tzutils.utc_to_local(datetime(2042, 1, 3)),
+            self._state.get_state('c', fetcher='other',
+                                  collector='collector1',
+                                  scope_key='scope_key'))
+
+    def test_set_states_bulk_fills_legacy_columns(self):
+        self._add_legacy_state('a', datetime(2042, 1, 1))
+        self._state.set_states_bulk({'a': datetime(2042, 2, 1)})
+
+        session = db.get_session()
+        rows = session.query(self._state.model).all()
+        session.close()
+        self.assertEqual(1, len(rows))
+        self.assertEqual(
+            ('fetcher1', 'collector1', 'scope_key'),
+            (rows[0].fetcher, rows[0].collector, rows[0].scope_key))
+
+    def test_set_states_bulk_writes_through_cache(self):
+        self._state.set_states_bulk({'a': datetime(2042, 1, 1)})
+
+        with mock.patch.object(self._state, 'get_state') as get_state:
+            self.assertEqual(tzutils.utc_to_local(datetime(2042, 1, 1)),
+                             self._state.get_cached_state('a'))
+            get_state.assert_not_called()
+
+
+class StateWriterTest(tests.TestCase):
+
+    def setUp(self):
+        super(StateWriterTest, self).setUp()
+        self._state = mock.Mock()
+
+    def test_batch_size(self):
+        writer = storage_state.StateWriter(self._state, batch_size=3)
+        writer.set_state('a', datetime(2042, 1, 1))
+        writer.set_state('a', datetime(2042, 1, 2))
+        self._state.set_states_bulk.assert_not_called()
+        writer.set_state('b', datetime(2042, 1, 1))
+        self._state.set_states_bulk.assert_called_once_with(
+            {'a': datetime(2042, 1, 2), 'b': datetime(2042, 1, 1)},
+            fetcher=None, collector=None, scope_key=None)
+
+    def test_max_delay(self):
+        writer = storage_state.StateWriter(
+            self._state, batch_size=10, max_delay=60)
+        with mock.patch('time.time', side_effect=[0, 30, 90]):
+            writer.set_state('a', datetime(2042, 1, 1))
+            self._state.set_states_bulk.assert_not_called()
+            writer.set_state('a', datetime(2042, 1, 2))
+        self._state.set_states_bulk.assert_called_once_with(
+            {'a': datetime(2042, 1, 2)},
+            fetcher=None, collector=None, scope_key=None)
+
+    def test_flush(self):
+        writer = storage_state.StateWriter(self._state, batch_size=10)
+        writer.set_state('a', datetime(2042, 1, 1))
+        writer.set_state('b', datetime(2042, 1, 1), fetcher='other')
+        writer.flush()
+        self.assertEqual([
+            mock.call({'a': datetime(2042, 1, 1)},
+                      fetcher=None, collector=None, scope_key=None),
+            mock.call({'b': datetime(2042, 1, 1)},
+                      fetcher='other', collector=None, scope_key=None),
+        ], self._state.set_states_bulk.call_args_list)
+
+        self._state.reset_mock()
+        writer.flush()
+        self._state.set_states_bulk.assert_not_called()
@@ -0,0 +1,79 @@
+# Copyright 2019 Objectif Libre
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+import datetime
+import decimal
+
+import mock
+
+from cloudkitty import dataframe
+from cloudkitty import storage
+from cloudkitty import tests
+from cloudkitty import write_orchestrator
+
+
+class WriteOrchestratorTest(tests.TestCase):
+
+    def setUp(self):
+        super(WriteOrchestratorTest, self).setUp()
+        self.storage = mock.Mock()
+        self.wo = write_orchestrator.WriteOrchestrator(
+            mock.Mock(), 'tenant', self.storage, period=3600)
+        self.writer = mock.Mock()
+        self.wo._write_pipeline.append(self.writer)
+
+    @staticmethod
+    def _get_frame(start, price):
+        frame = dataframe.DataFrame(
+            start=start, end=start + datetime.timedelta(seconds=3600))
+        frame.add_point(dataframe.DataPoint(
+            'instance', 1, price, {'id': 'a'}, {'flavor': 'm1.tiny'}),
+            'instance')
+        return frame
+
+    def test_get_timeframe_iterates_over_storage(self):
+        start = datetime.datetime(2019, 1, 1)
+        self.storage.iter_dataframes.return_value = iter(
+            [self._get_frame(start, 1)])
+
+        frames = self.wo.get_timeframe(0)
+        self.storage.iter_dataframes.assert_not_called()
+        frames = list(frames)
+
+        self.storage.iter_dataframes.assert_called_once_with(
+            begin=0, end=3600, filters={'project_id': 'tenant'})
+        self.storage.retrieve.assert_not_called()
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(
+            frames[0]['usage']['instance'][0]['desc'],
+            {'id': 'a', 'flavor': 'm1.tiny'})
+
+    def test_push_data_dispatches_every_frame(self):
+        start = datetime.datetime(2019, 1, 1)
+        self.storage.iter_dataframes.return_value = iter([
+            self._get_frame(start, 1),
+            self._get_frame(start + datetime.timedelta(seconds=3600), 2),
+        ])
+        self.wo.usage_start, self.wo.usage_end = 0, 7200
+
+        self.assertTrue(self.wo._push_data())
+        self.assertEqual(self.writer.append.call_count, 2)
+        self.assertEqual(self.wo.total, decimal.Decimal(3))
+
+    def test_push_data_without_data(self):
+        self.storage.iter_dataframes.side_effect = storage.NoTimeFrame()
+        self.wo.usage_start, self.wo.usage_end = 0, 3600
+
+        self.assertFalse(self.wo._push_data())
+        self.writer.append.assert_not_called()
@@ -98,35 +98,37 @@ class WriteOrchestrator(object):
             backend.append(data, self.usage_start, self.usage_end)
 
     def get_timeframe(self, timeframe, timeframe_end=None):
+        """Yields the dataframes of a period, in legacy dict format.
+
+        Dataframes are read one by one through the storage's
+        ``iter_dataframes`` method, so the period is never loaded at once.
+        """
         if not timeframe_end:
             timeframe_end = timeframe + self._period
+        filters = {'project_id': self._tenant_id}
         try:
-            filters = {'project_id': self._tenant_id}
-            data = self._storage.retrieve(begin=timeframe,
-                                          end=timeframe_end,
-                                          filters=filters,
-                                          paginate=False)
-            for df in data['dataframes']:
-                for service, resources in df['usage'].items():
+            for frame in self._storage.iter_dataframes(begin=timeframe,
+                                                       end=timeframe_end,
+                                                       filters=filters):
+                data = frame.as_dict(mutable=True)
+                for service, resources in data['usage'].items():
                     for resource in resources:
                         resource['desc'] = copy.deepcopy(resource['metadata'])
                         resource['desc'].update(resource['groupby'])
+                yield data
         except storage.NoTimeFrame:
-            return None
-        return data
+            return
 
     def close(self):
         for writer in self._write_pipeline:
             writer.close()
 
     def _push_data(self):
-        data = self.get_timeframe(self.usage_start, self.usage_end)
-        if data and data['total'] > 0:
-            for timeframe in data['dataframes']:
-                self._dispatch(timeframe['usage'])
-            return True
-        else:
-            return False
+        pushed = False
+        for timeframe in self.get_timeframe(self.usage_start, self.usage_end):
+            self._dispatch(timeframe['usage'])
+            pushed = True
+        return pushed
 
     def _commit_data(self):
         for backend in self._write_pipeline: